@@ -1,12 +1,33 @@
 import streamlit as st
-import pydeck as pdk
-import geopandas as gpd
-import pandas as pd
 
-from components.connect_motherduck import get_md_con_georoost
+from components.connect_motherduck import get_md_con_georoost, get_mirror_warnings, warm_up_connection
 from components.load_page import load_page_config
-from components.cilpped_geometry_loader import download_clipped_geometry
-from components.kokudo_boundary_loader import download_boundary_kokudo
+from components.area_catalog import get_area_catalog
+from components.layer_exporter import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS
+from components.export_cache import get_export_cache, make_export_key
+from components.instrumentation import collect_stages, instrument
+from components.zip_builder import ZIP_COMPRESSION_LEVEL, ZIP_COMPRESSION_PRESETS
+from components.geometry_simplifier import (
+    COORDINATE_PRECISION_OPTIONS,
+    DEFAULT_COORDINATE_PRECISION,
+    SIMPLIFY_PRESETS,
+)
+from components.mesh_rollup import (
+    DEFAULT_MESH_LEVEL,
+    MESH_LEVELS,
+    available_mesh_levels,
+    choose_mesh_level,
+    estimate_mesh_rows,
+    mesh_level_options,
+)
+from components.layer_registry import (
+    LAYER_REGISTRY,
+    column_options,
+    column_selectable,
+    default_layer_columns,
+    list_layer_columns,
+)
+# geopandas・pydeckを使うモジュールは、取得・表示のセクションに入ってから読み込む
 
 
 # =======================
@@ -14,25 +35,18 @@ from components.kokudo_boundary_loader import download_boundary_kokudo
 # =======================
 
 
-# データベースのパス
-con = get_md_con_georoost()
+# データベースへの接続をバックグラウンドで開始（取得ボタンが押されるまで待たない）
+warm_up_connection()
 
 # ページ設定の読み込み
 load_page_config()
 
-# 都道府県のリストを取得、セッションステートに保存
-if 'pref_dict' in st.session_state:
-    pref_dict = st.session_state['pref_dict']
-else:
-    pref_dict = pd.read_csv('seeds/pref_code.csv', dtype={'pref_code': str, 'pref_name': str}).set_index('pref_name')['pref_code'].to_dict()
-    st.session_state['pref_dict'] = pref_dict
+# ローカルミラー利用時は鮮度を確認
+for warning in get_mirror_warnings():
+    st.warning(warning)
 
-# 市区町村のリストを取得、セッションステートに保存
-if 'city_dict' in st.session_state:
-    city_dict = st.session_state['city_dict']
-else:
-    city_dict = pd.read_csv('seeds/city_code.csv', dtype={'jcode': str, 'city_name': str}).set_index('city_name')['jcode'].to_dict()
-    st.session_state['city_dict'] = city_dict
+# 都道府県・市区町村のカタログを取得（プロセス全体で1回だけ読み込む）
+area_catalog = get_area_catalog()
 
 # =======================
 # === Streamlit Body ====
@@ -57,7 +71,7 @@ with st.expander("使い方の説明", expanded=False):
     st.markdown("""
     1. **都道府県・市区町村の選択**: 上記のプルダウンメニューから対象地域を選択してください
     2. **データ取得ボタンをクリック**: 選択した地域のデータを取得します
-    3. **GeoJSONファイルをダウンロード**: まとめてダウンロード、または個別にダウンロードできます
+    3. **GeoJSONファイルをダウンロード**: まとめてダウンロード、または個別にダウンロードできます（FlatGeobuf・GeoParquet・GeoJSONSeqも選択できます）
     4. **[Kepler.gl](https://kepler.gl/demo/)などのGISツールで読み込み**: ダウンロードしたGeoJSONファイルを読み込みます
     5. **レイヤーを編集**: 色や透明度、表示項目などを調整します
     6. **ベースマップを保存**: 編集したマップを保存してご利用ください
@@ -102,373 +116,388 @@ with st.expander("市区町村境界を確認する", expanded=False):
 
 
 # 都道府県の選択
-pref_levels = st.multiselect(
+pref_code = st.multiselect(
     "都道府県名を選択してください", 
-    pref_dict.keys(), 
-    format_func=lambda x: f"{x} ({pref_dict[x]})"
+    area_catalog.pref_codes(), 
+    format_func=area_catalog.label
 )
-if pref_levels:
-    pref_code = [pref_dict[x] for x in pref_levels]
-
-# 市区町村の選択
-if pref_levels:
-    filtered_city_dict = {k: v for k, v in city_dict.items() if v[:2] in pref_code}
-else:
-    filtered_city_dict = city_dict
-city_levels = st.multiselect(
+
+# 市区町村の選択（都道府県を選んだ場合はその都道府県内に絞り込む）
+city_code = st.multiselect(
     "市区町村名を選択してください", 
-    filtered_city_dict.keys(),
-    format_func=lambda x: f"{x} ({filtered_city_dict[x]})"
+    area_catalog.city_codes(pref_code),
+    format_func=area_catalog.label
 )
-if city_levels:
-    city_code = [city_dict[x] for x in city_levels]
 
 
-# データ取得ボタン
-if st.button("データを取得") and (pref_levels or city_levels):
-    # 鉄道駅データを取得
-    query_df = con.sql('''
-        SELECT
-            * EXCLUDE(geom),
-            St_AsText(geom) AS geometry
-        FROM main_jpn.jpn_kokudo__station_info_kepler
-        WHERE {}
-    '''.format(
-        'SUBSTRING(jcode, 1, 5) IN ({})'.format(
-            ', '.join(f"'{code}'" for code in city_code)
-        ) if city_levels else 'SUBSTRING(pref_code, 1, 2)  IN ({})'.format(
-            ', '.join(f"'{code}'" for code in pref_code)
-        )
-    )).df()
-    clipped_station_gdf = gpd.GeoDataFrame(
-        query_df.drop(columns=['geometry']),
-        geometry=gpd.GeoSeries.from_wkt(query_df['geometry']),
-        crs="EPSG:4326"
+# 出力形式、ジオメトリの簡略化と座標の桁数の選択
+col_format, col_simplify, col_precision, col_zip = st.columns(4)
+with col_format:
+    export_format = st.selectbox(
+        "出力形式",
+        list(EXPORT_FORMATS),
+        index=list(EXPORT_FORMATS).index(DEFAULT_EXPORT_FORMAT),
+        help="FlatGeobuf（空間インデックス付き）やGeoParquetは、大きな地域でも軽く、GISツールで素早く読み込めます。"
     )
-    clipped_station_gdf['tooltip'] = "鉄道駅"
-    st.session_state['clipped_station_gdf'] = clipped_station_gdf
-
-    # 鉄道路線データを取得
-    query_df = con.sql('''
-        SELECT
-            * EXCLUDE(geom),
-            St_AsText(geom) AS geometry
-        FROM main_jpn.jpn_kokudo__railroad_section_kepler
-        WHERE {}
-    '''.format(
-        'SUBSTRING(jcode, 1, 5) IN ({})'.format(
-            ', '.join(f"'{code}'" for code in city_code)
-        ) if city_levels else 'SUBSTRING(pref_code, 1, 2)  IN ({})'.format(
-            ', '.join(f"'{code}'" for code in pref_code)
-        )
-    )).df()
-    clipped_ralisection_gdf = gpd.GeoDataFrame(
-        query_df.drop(columns=['geometry']),
-        geometry=gpd.GeoSeries.from_wkt(query_df['geometry']),
-        crs="EPSG:4326"
+with col_simplify:
+    simplify_preset = st.selectbox("ジオメトリの簡略化", list(SIMPLIFY_PRESETS))
+with col_precision:
+    coordinate_precision = st.selectbox(
+        "座標の小数点以下の桁数",
+        COORDINATE_PRECISION_OPTIONS,
+        index=COORDINATE_PRECISION_OPTIONS.index(DEFAULT_COORDINATE_PRECISION),
+        format_func=lambda x: "元の精度" if x is None else f"{x}桁"
     )
-    clipped_ralisection_gdf['tooltip'] = "鉄道路線"
-    st.session_state['clipped_ralisection_gdf'] = clipped_ralisection_gdf
-
-    # バス停データを取得
-    query_df = con.sql('''
-        SELECT
-            * EXCLUDE(geom),
-            St_AsText(geom) AS geometry
-        FROM main_jpn.jpn_kokudo__bus_stop_kepler
-        WHERE {}
-    '''.format(
-        'SUBSTRING(jcode, 1, 5) IN ({})'.format(
-            ', '.join(f"'{code}'" for code in city_code)
-        ) if city_levels else 'SUBSTRING(pref_code, 1, 2)  IN ({})'.format(
-            ', '.join(f"'{code}'" for code in pref_code)
-        )
-    )).df()
-    clipped_busstop_gdf = gpd.GeoDataFrame(
-        query_df.drop(columns=['geometry']),
-        geometry=gpd.GeoSeries.from_wkt(query_df['geometry']),
-        crs="EPSG:4326"
+with col_zip:
+    zip_preset = st.selectbox(
+        "zipの圧縮",
+        list(ZIP_COMPRESSION_PRESETS),
+        index=list(ZIP_COMPRESSION_PRESETS.values()).index(ZIP_COMPRESSION_LEVEL),
+        help="無圧縮や速度優先はzipの作成が速く、サイズ優先はダウンロードが小さくなります。"
     )
-    clipped_busstop_gdf['tooltip'] = "バス停"
-    st.session_state['clipped_busstop_gdf'] = clipped_busstop_gdf
-
-    # バス路線データを取得
-    query_df = con.sql('''
-        SELECT
-            * EXCLUDE(geom),
-            St_AsText(geom) AS geometry
-        FROM main_jpn.jpn_kokudo__bus_line_kepler
-        WHERE {}
-    '''.format(
-        'SUBSTRING(jcode, 1, 5) IN ({})'.format(
-            ', '.join(f"'{code}'" for code in city_code)
-        ) if city_levels else 'SUBSTRING(pref_code, 1, 2)  IN ({})'.format(
-            ', '.join(f"'{code}'" for code in pref_code)
-        )
-    )).df()
-    clipped_busline_gdf = gpd.GeoDataFrame(
-        query_df.drop(columns=['geometry']),
-        geometry=gpd.GeoSeries.from_wkt(query_df['geometry']),
-        crs="EPSG:4326"
-    )
-    clipped_busline_gdf['tooltip'] = "バス路線"
-    st.session_state['clipped_busline_gdf'] = clipped_busline_gdf
-
-    # メッシュ人口データを取得
-    clipped_meshpop_gdf = download_clipped_geometry(
-        con=con, 
-        area_codes=city_code if city_levels else pref_code, 
-        boundary_name="city" if city_levels else "pref",
-        table_name="main_jpn.jpn_census2020_mesh5__all_kepler"
+
+# メッシュ人口の解像度（自動の場合は選択地域の大きさから取得時に決める）
+mesh_level_choice = st.selectbox(
+    "メッシュ人口の解像度",
+    ["auto"] + list(MESH_LEVELS),
+    format_func=lambda x: "自動（地域の大きさに合わせる）" if x == "auto" else MESH_LEVELS[x]["label"],
+    help="広い地域では4次（500m）・3次（1km）メッシュに集約し、取得とダウンロードを軽くします。"
+)
+
+# 出力する列の選択（選ばなかった列はデータベースから読み込まない）
+layer_columns = default_layer_columns()
+with st.expander("出力する列を選ぶ", expanded=False):
+    if st.toggle("レイヤーごとに出力する列を絞り込む", value=False):
+        for key, spec in LAYER_REGISTRY.items():
+            if not column_selectable(key):
+                continue
+            options = list_layer_columns(key)
+            selected = st.multiselect(
+                spec.label,
+                options,
+                default=[column for column in (spec.columns or options) if column in options],
+                key=f"columns_{key}",
+                help="地域コードなど、取得に必要な列は選ばなくても出力されます。"
+            )
+            # すべての列を選んだ場合は絞り込まない（キャッシュや事前生成したバンドルを共有できる）
+            if list(selected) != list(options):
+                layer_columns[key] = tuple(selected)
+            else:
+                layer_columns.pop(key, None)
+
+
+# 前回の取得を中止した場合は知らせる（取得前の結果はそのまま表示する）
+if st.session_state.pop('fetch_cancelled', False):
+    st.info("データの取得を中止しました。")
+
+# データ取得ボタン
+if st.button("データを取得") and (pref_code or city_code):
+    from components.basemap_loader import BASEMAP_EXPORT_NAMES, BASEMAP_LAYER_NAMES, estimate_basemap_rows
+    from components.fetch_progress import MAX_FETCH_ROWS, FetchProgress, track_fetch_progress
+    from components.incremental_fetcher import (
+        RAW_LAYER_OPTIONS,
+        fetch_basemap_layers_incremental,
+        is_raw_layer_key,
+        plan_incremental_fetch,
     )
-    clipped_meshpop_gdf['tooltip'] = "メッシュ人口"
-    clipped_meshpop_gdf = clipped_meshpop_gdf
-    st.session_state['clipped_meshpop_gdf'] = clipped_meshpop_gdf
-
-    # 町丁字人口データを取得
-    query_df = con.sql('''
-        SELECT
-            * EXCLUDE(geom),
-            St_AsText(geom) AS geometry
-        FROM main_jpn.jpn_census2020_town__map_with_all_kepler
-        WHERE {}
-    '''.format(
-        'SUBSTRING(KEY_CODE, 1, 5) IN ({})'.format(
-            ', '.join(f"'{code}'" for code in city_code)
-        ) if city_levels else 'SUBSTRING(KEY_CODE, 1, 2)  IN ({})'.format(
-            ', '.join(f"'{code}'" for code in pref_code)
+    from components.batch_exporter import load_prebuilt_bundle
+    from components.zip_builder import build_zip
+    from components.layer_exporter import decode_layer, encode_layer
+    from components.geometry_simplifier import simplify_geodataframe
+    from components.result_store import get_result_store
+
+    area_codes = city_code if city_code else pref_code
+    boundary_name = "city" if city_code else "pref"
+    simplify_tolerance = SIMPLIFY_PRESETS[simplify_preset]
+    export_options = (export_format, simplify_tolerance, coordinate_precision)
+    zip_level = ZIP_COMPRESSION_PRESETS[zip_preset]
+
+    # メッシュ人口の解像度を決める（集約テーブルがない解像度は選べない）
+    # 複数のセッションから同時に使うため、共有接続ではなくカーソルで問い合わせる
+    mesh_cursor = get_md_con_georoost().cursor()
+    try:
+        mesh_levels = available_mesh_levels(mesh_cursor)
+        if mesh_level_choice == "auto":
+            # 外接矩形は所属関係インデックスがなく、見積もりに使う場合だけ読み込む
+            mesh_estimates = estimate_mesh_rows(
+                mesh_cursor,
+                boundary_name,
+                area_codes,
+                lambda: area_catalog.bounds(mesh_cursor, boundary_name, area_codes)
+            )
+            mesh_level = choose_mesh_level(mesh_estimates, mesh_levels)
+        elif mesh_level_choice in mesh_levels:
+            mesh_level = mesh_level_choice
+        else:
+            st.warning(f"{MESH_LEVELS[mesh_level_choice]['label']}の集約テーブルがないため、{MESH_LEVELS[DEFAULT_MESH_LEVEL]['label']}で取得します。")
+            mesh_level = DEFAULT_MESH_LEVEL
+    finally:
+        mesh_cursor.close()
+    # メッシュ人口とzipだけは、解像度ごとに別の結果としてキャッシュする（列を絞り込んだレイヤーは列ごとに分ける）
+    layer_options = {
+        key: mesh_level_options(key, export_options, mesh_level) + column_options(key, layer_columns)
+        for key in BASEMAP_EXPORT_NAMES
+    }
+    raw_options = {
+        key: mesh_level_options(key, RAW_LAYER_OPTIONS, mesh_level) + column_options(key, layer_columns)
+        for key in BASEMAP_EXPORT_NAMES
+    }
+
+    # 段階ごとの計測結果は診断パネルに表示する
+    with collect_stages() as stage_records:
+        # 事前生成したバンドルがあればそのまま使い、なければ共有キャッシュにあるレイヤーを再利用する
+        export_cache = get_export_cache()
+        geojson_exports = {}
+        prebuilt_zip = None
+        # 事前生成したバンドルは5次メッシュ・すべての列のもののみ
+        prebuilt = None
+        if mesh_level == DEFAULT_MESH_LEVEL and not layer_columns:
+            prebuilt = load_prebuilt_bundle(boundary_name, area_codes, export_options)
+        if prebuilt is not None:
+            prebuilt_zip, geojson_exports = prebuilt
+        for key in BASEMAP_EXPORT_NAMES:
+            if key in geojson_exports:
+                continue
+            cached_geojson = export_cache.get(make_export_key(key, boundary_name, area_codes, layer_options[key]))
+            if cached_geojson is not None:
+                geojson_exports[key] = cached_geojson
+        missing_keys = [key for key in BASEMAP_EXPORT_NAMES if key not in geojson_exports]
+
+        # キャッシュにないレイヤーは、未加工の取得結果を共有ストアから探し、なければ並列に取得する
+        result_store = get_result_store()
+        layers, errors, raw_handles = {}, {}, {}
+        for key in missing_keys:
+            handle = result_store.acquire(make_export_key(key, boundary_name, area_codes, raw_options[key]))
+            if handle is not None:
+                raw_handles[key] = handle
+                layers[key] = handle.get()
+        fetch_keys = [key for key in missing_keys if key not in layers]
+        if fetch_keys:
+            # 前回と同じ境界名なら、前回の結果に対する地域の差分だけを取得する
+            previous_area = st.session_state.get('fetched_area')
+            previous_codes, previous_layers = None, {}
+            if previous_area is not None and previous_area[0] == boundary_name:
+                previous_codes = previous_area[1]
+                previous_layers = {
+                    key: handle.get()
+                    for key, handle in st.session_state.get('layer_handles', {}).items()
+                    if is_raw_layer_key(handle.key, raw_options[key])
+                }
+            # 取得する前に行数を数え、上限を超える取得は断る
+            # 行数は実際に問い合わせる地域（前回の結果にも地域ごとのキャッシュにもない地域）だけ数える
+            fetch_codes = plan_incremental_fetch(
+                area_codes, boundary_name, fetch_keys, previous_codes, previous_layers,
+                MESH_LEVELS[mesh_level]["table"], layer_columns
+            )
+            expected_rows = estimate_basemap_rows(
+                get_md_con_georoost(), fetch_codes, boundary_name, MESH_LEVELS[mesh_level]["table"]
+            )
+            expected_total = sum(rows for rows in expected_rows.values() if rows is not None)
+            if MAX_FETCH_ROWS and expected_total > MAX_FETCH_ROWS:
+                st.error(
+                    f"選択した地域のデータは約{expected_total:,}行あり、一度に取得できる上限（{MAX_FETCH_ROWS:,}行）を超えています。"
+                    "地域を絞り込むか、メッシュ人口の解像度を粗くしてください。"
+                )
+                st.stop()
+            # 取得中は進捗を表示し、中止ボタン（または他の操作）で実行中のクエリを中断する
+            progress_bar = st.progress(0.0, text="データを取得中...")
+            cancel_placeholder = st.empty()
+            cancel_placeholder.button("取得を中止", key="cancel_fetch")
+            fetch_progress = FetchProgress(
+                expected_rows,
+                on_update=lambda progress: progress_bar.progress(progress.fraction(), text=f"データを取得中... {progress.describe()}")
+            )
+            try:
+                with track_fetch_progress(fetch_progress):
+                    fetched_layers, errors = fetch_basemap_layers_incremental(
+                        con=get_md_con_georoost(),
+                        area_codes=area_codes,
+                        boundary_name=boundary_name,
+                        layer_keys=fetch_keys,
+                        previous_codes=previous_codes,
+                        previous_layers=previous_layers,
+                        mesh_table=MESH_LEVELS[mesh_level]["table"],
+                        layer_columns=layer_columns
+                    )
+            finally:
+                if fetch_progress.cancelled:
+                    st.session_state['fetch_cancelled'] = True
+            progress_bar.empty()
+            cancel_placeholder.empty()
+            layers.update(fetched_layers)
+            for key, error in errors.items():
+                st.warning(f"{BASEMAP_LAYER_NAMES[key]}の取得に失敗しました: {error}")
+        if missing_keys:
+            # エンコードは取得ごとに1回だけ行い、成功したレイヤーは共有キャッシュに載せる
+            # （未加工の結果は差分取得に使うため、簡略化したものは別に作る）
+            with st.spinner(f"{export_format}ファイルを生成中..."):
+                for key in missing_keys:
+                    with instrument("simplify", layer=key, rows=len(layers[key])):
+                        simplified_gdf = simplify_geodataframe(layers[key], simplify_tolerance, coordinate_precision)
+                    with instrument("encode", layer=key, format=export_format) as record:
+                        geojson_exports[key] = encode_layer(simplified_gdf, export_format)
+                        record["bytes"] = len(geojson_exports[key])
+                    if key not in errors:
+                        export_cache.put(make_export_key(key, boundary_name, area_codes, layer_options[key]), geojson_exports[key])
+        for key, data in geojson_exports.items():
+            if key not in layers:
+                with instrument("decode_export", layer=key, format=export_format, bytes=len(data)):
+                    layers[key] = decode_layer(data, export_format)
+        geojson_exports = {key: geojson_exports[key] for key in BASEMAP_EXPORT_NAMES}
+
+        # zipもキャッシュから再利用する（圧縮レベルが変われば別のzip）
+        zip_key = make_export_key(
+            "zip", boundary_name, area_codes, mesh_level_options("zip", export_options, mesh_level)
+            + (zip_level, tuple(sorted(layer_columns.items())))
         )
-    )).df()
-    clipped_mappop_gdf = gpd.GeoDataFrame(
-        query_df.drop(columns=['geometry']),
-        geometry=gpd.GeoSeries.from_wkt(query_df['geometry']),
-        crs="EPSG:4326"
-    )
-    clipped_mappop_gdf['tooltip'] = "町丁字人口"
-    st.session_state['clipped_mappop_gdf'] = clipped_mappop_gdf
-
-    # 行政区域データを取得
-    boundary_gdf = download_boundary_kokudo(
-        con=con, 
-        area_codes=city_code if city_levels else pref_code, 
-        boundary_name="city" if city_levels else "pref"
-    )
-    boundary_gdf['tooltip'] = "行政区域データ"
-    st.session_state['boundary_gdf'] = boundary_gdf
-    
-    # 中心座標を取得
-    st.session_state["center_lat"] = boundary_gdf.geometry.to_crs('EPSG:6674').centroid.to_crs('EPSG:4326').y.mean()
-    st.session_state["center_lon"] = boundary_gdf.geometry.to_crs('EPSG:6674').centroid.to_crs('EPSG:4326').x.mean()
+        # 事前生成したバンドルのzipは既定の圧縮レベルのもの（他のレベルはレイヤーから作り直す）
+        if zip_level != ZIP_COMPRESSION_LEVEL:
+            prebuilt_zip = None
+        geojson_zip = prebuilt_zip or export_cache.get(zip_key)
+        if geojson_zip is None:
+            member_names = {
+                key: f"{BASEMAP_EXPORT_NAMES[key]}{EXPORT_FORMATS[export_format]['extension']}"
+                for key in geojson_exports
+            }
+            with instrument("zip", level=zip_level) as record:
+                # レイヤーごとに並列に圧縮し、変わっていないレイヤーは圧縮済みのものを使う
+                geojson_zip = build_zip(
+                    {member_names[key]: data for key, data in geojson_exports.items()},
+                    level=zip_level,
+                    cache=export_cache,
+                    cache_keys={
+                        member_names[key]: make_export_key(key, boundary_name, area_codes, layer_options[key])
+                        for key in geojson_exports if key not in errors
+                    }
+                )
+                record["bytes"] = len(geojson_zip)
+            if not errors:
+                export_cache.put(zip_key, geojson_zip)
+
+    # 取得結果はプロセス全体のストアで共有し、セッションには参照だけを持たせる
+    layer_handles = {}
+    for key, layer_gdf in layers.items():
+        if key in raw_handles:
+            layer_handles[key] = raw_handles[key]
+        elif key in errors:
+            # 取得に失敗したレイヤー（空）は他のセッションと共有しない
+            layer_handles[key] = result_store.put((key, "error", id(layer_gdf)), layer_gdf)
+        elif key in missing_keys:
+            layer_handles[key] = result_store.put(make_export_key(key, boundary_name, area_codes, raw_options[key]), layer_gdf)
+        else:
+            layer_handles[key] = result_store.put(make_export_key(key, boundary_name, area_codes, layer_options[key]), layer_gdf)
+    st.session_state['layer_handles'] = layer_handles
+    st.session_state['geojson_exports'] = geojson_exports
+    st.session_state['geojson_zip'] = geojson_zip
+    st.session_state['fetched_area'] = (boundary_name, area_codes)
+    st.session_state['export_format'] = export_format
+    st.session_state['mesh_level'] = mesh_level
+    st.session_state['diagnostics'] = stage_records
+    st.session_state.pop('preview_decks', None)
+
+    # 地図の中心とズームはカタログの重心・外接矩形から求める
+    center_lat, center_lon, zoom = area_catalog.view_state(get_md_con_georoost(), boundary_name, area_codes)
+    st.session_state["center_lat"] = center_lat
+    st.session_state["center_lon"] = center_lon
+    st.session_state["zoom"] = zoom
 
 # データ表示・ダウンロードセクション
-if ('clipped_station_gdf' in st.session_state) \
-    and ('clipped_ralisection_gdf' in st.session_state) \
-    and ('boundary_gdf' in st.session_state):
-
-    boundary_gdf = st.session_state['boundary_gdf']
-    clipped_station_gdf = st.session_state['clipped_station_gdf']
-    clipped_ralisection_gdf = st.session_state['clipped_ralisection_gdf']
-    clipped_busstop_gdf = st.session_state['clipped_busstop_gdf']
-    clipped_busline_gdf = st.session_state['clipped_busline_gdf']
-    clipped_meshpop_gdf = st.session_state['clipped_meshpop_gdf']
-    clipped_mappop_gdf = st.session_state['clipped_mappop_gdf']
+if ('layer_handles' in st.session_state) \
+    and ('geojson_exports' in st.session_state) \
+    and ('fetched_area' in st.session_state):
+    from components.basemap_loader import BASEMAP_EXPORT_NAMES, BASEMAP_LAYER_NAMES
+    from components.map_preview import PREVIEW_MAX_FEATURES, PREVIEW_TILE_LAYERS, build_preview_deck
+    from components.tile_server import get_tile_server, tile_url
+
+    geojson_exports = st.session_state['geojson_exports']
+    fetched_format = st.session_state.get('export_format', DEFAULT_EXPORT_FORMAT)
+    format_info = EXPORT_FORMATS[fetched_format]
 
     # まとめてzipでダウンロード
-    st.markdown("### まとめてGeoJSONファイルをダウンロード")
-    zip_filename = f"ベースマップ_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}.zip"
-    with st.spinner("GeoJSONファイルを生成中..."):
-        import io
-        import zipfile
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED) as zip_file:
-            # 鉄道駅
-            station_geojson = clipped_station_gdf.to_json()
-            zip_file.writestr(f"鉄道駅.geojson", station_geojson)
-            # 鉄道路線
-            rail_section_geojson = clipped_ralisection_gdf.to_json()
-            zip_file.writestr(f"鉄道路線.geojson", rail_section_geojson)
-            # バス停
-            bus_stop_geojson = clipped_busstop_gdf.to_json()
-            zip_file.writestr(f"バス停.geojson", bus_stop_geojson)
-            # バス路線
-            bus_line_geojson = clipped_busline_gdf.to_json()
-            zip_file.writestr(f"バス路線.geojson", bus_line_geojson)
-            # メッシュ人口
-            meshpop_geojson = clipped_meshpop_gdf.to_json()
-            zip_file.writestr(f"メッシュ人口.geojson", meshpop_geojson)
-            # 町丁字人口
-            mappop_geojson = clipped_mappop_gdf.to_json()
-            zip_file.writestr(f"町丁字人口.geojson", mappop_geojson)
-            # 行政区域
-            boundary_geojson = boundary_gdf.to_json()
-            zip_file.writestr(f"行政区域.geojson", boundary_geojson)
-        zip_buffer.seek(0)
-        st.download_button(
-            label="GeoJSONファイルをまとめてダウンロード (zip形式)",
-            data=zip_buffer,
-            file_name=zip_filename,
-            mime="application/zip",
-            width='stretch'
-        )
-    # 個別にGeoJSONでダウンロード
-    st.markdown("### 各データをGeoJSONファイルでダウンロード")
-    # 鉄道駅データのダウンロード
-    clipped_station_name = f"鉄道駅_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="鉄道駅をGeoJSONでダウンロード",
-        data=clipped_station_gdf.to_json(),
-        file_name=f"{clipped_station_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    # 鉄道路線データのダウンロード
-    clipped_rail_section_name = f"鉄道路線_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="鉄道路線をGeoJSONでダウンロード",
-        data=clipped_ralisection_gdf.to_json(),
-        file_name=f"{clipped_rail_section_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    # バス停データのダウンロード
-    clipped_bus_stop_name = f"バス停_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="バス停をGeoJSONでダウンロード",
-        data=clipped_busstop_gdf.to_json(),
-        file_name=f"{clipped_bus_stop_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    # バス路線データのダウンロード
-    clipped_bus_line_name = f"バス路線_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="バス路線をGeoJSONでダウンロード",
-        data=clipped_busline_gdf.to_json(),
-        file_name=f"{clipped_bus_line_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    # メッシュ人口データのダウンロード
-    clipped_meshpop_name = f"メッシュ人口_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="メッシュ人口をGeoJSONでダウンロード",
-        data=clipped_meshpop_gdf.to_json(),
-        file_name=f"{clipped_meshpop_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    # 町丁字人口データのダウンロード
-    clipped_mappop_name = f"町丁字人口_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
+    st.markdown(f"### まとめて{fetched_format}ファイルをダウンロード")
+    fetched_mesh_level = st.session_state.get('mesh_level', DEFAULT_MESH_LEVEL)
+    if fetched_mesh_level != DEFAULT_MESH_LEVEL:
+        st.caption(f"メッシュ人口は{MESH_LEVELS[fetched_mesh_level]['label']}に集約しています。")
+    area_label = '_'.join(area_catalog.name(code) for code in (city_code or pref_code))
+    zip_filename = f"ベースマップ_{area_label}.zip"
     st.download_button(
-        label="町丁字人口をGeoJSONでダウンロード",
-        data=clipped_mappop_gdf.to_json(),
-        file_name=f"{clipped_mappop_name}.geojson",
-        mime="application/geo+json",
+        label=f"{fetched_format}ファイルをまとめてダウンロード (zip形式)",
+        data=st.session_state['geojson_zip'],
+        file_name=zip_filename,
+        mime="application/zip",
         width='stretch'
     )
-    # 行政区域データのダウンロード
-    boundary_name = f"行政区域_{'_'.join(city_levels) if city_levels else '_'.join(pref_levels)}"
-    st.download_button(
-        label="行政区域をGeoJSONでダウンロード",
-        data=boundary_gdf.to_json(),
-        file_name=f"{boundary_name}.geojson",
-        mime="application/geo+json",
-        width='stretch'
-    )
-    
+    # 個別にダウンロード
+    st.markdown(f"### 各データを{fetched_format}ファイルでダウンロード")
+    for key, export_name in BASEMAP_EXPORT_NAMES.items():
+        st.download_button(
+            label=f"{export_name}を{fetched_format}でダウンロード",
+            data=geojson_exports[key],
+            file_name=f"{export_name}_{area_label}{format_info['extension']}",
+            mime=format_info["mime"],
+            width='stretch'
+        )
     
-    # 地図表示のための中心座標取得
-    center_lat = st.session_state['center_lat']
-    center_lon = st.session_state['center_lon']
     
-
-    # PyDeckで地図を表示
+    # PyDeckで地図を表示（Deckは取得ごとに1回だけ作成し、再実行時は使い回す）
     st.markdown(f"### ベース地図プレビュー")
-    station_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_station_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        line_width_min_pixels=4,
-        get_line_color=[25, 100, 25, 200], # 深緑色
-    )
-    rail_section_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_ralisection_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        line_width_min_pixels=3,
-        get_line_color=[152, 251, 152, 200], # 若草色
-    )
-    bus_stop_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_busstop_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        line_width_min_pixels=4,
-        get_line_color=[0, 0, 255, 200], # 青色
-    )
-    bus_line_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_busline_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        line_width_min_pixels=2,
-        get_line_color=[64, 224, 208, 200], # ターコイズブルー
-    )
-    meshpop_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_meshpop_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        get_line_color=[255, 140, 0, 200], # 灰色
-        line_width_min_pixels=1,
-    )
-    mappop_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=clipped_mappop_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        get_line_color=[255, 140, 0, 200], # 灰色
-        line_width_min_pixels=1,
-    )
-    boundary_layer = pdk.Layer(
-        "GeoJsonLayer",
-        data=boundary_gdf,
-        pickable=True,
-        stroked=True,
-        filled=False,
-        line_width_min_pixels=4,
-        get_line_color=[0, 0, 0, 255], # 黒色
-    )
-    initial_view_state = pdk.ViewState(
-        latitude=center_lat,
-        longitude=center_lon,
-        zoom=11,
-        pitch=0,
-    )
-    deck = pdk.Deck(
-        layers=[
-            boundary_layer, 
-            rail_section_layer, 
-            station_layer, 
-            bus_line_layer, 
-            bus_stop_layer,
-            meshpop_layer,
-            mappop_layer
-        ],
-        tooltip={"text": "レイヤー名: {tooltip}"},
-        initial_view_state=initial_view_state,
-        map_style='light'
-    )
+    use_tiles = False
+    if get_tile_server() is not None:
+        use_tiles = st.toggle("メッシュ人口・町丁字人口をベクトルタイルで表示", value=True)
+    preview_decks = st.session_state.setdefault('preview_decks', {})
+    if use_tiles not in preview_decks:
+        fetched_boundary_name, fetched_area_codes = st.session_state['fetched_area']
+        tile_urls = {
+            key: tile_url(layer, fetched_boundary_name, fetched_area_codes, fetched_mesh_level)
+            for key, layer in PREVIEW_TILE_LAYERS.items()
+        } if use_tiles else None
+        with collect_stages() as preview_records, instrument("preview_deck", tiles=use_tiles) as record:
+            preview_decks[use_tiles] = build_preview_deck(
+                {key: st.session_state['layer_handles'][key].get() for key in BASEMAP_LAYER_NAMES},
+                center_lat=st.session_state['center_lat'],
+                center_lon=st.session_state['center_lon'],
+                zoom=st.session_state['zoom'],
+                tile_urls=tile_urls
+            )
+            # pydeckがブラウザへ送るJSONの大きさ
+            record["bytes"] = len(preview_decks[use_tiles][0].to_json())
+        st.session_state.setdefault('diagnostics', []).extend(preview_records)
+    deck, truncated_keys = preview_decks[use_tiles]
+    if truncated_keys:
+        st.caption(
+            f"プレビューでは{'・'.join(BASEMAP_LAYER_NAMES[key] for key in truncated_keys)}を"
+            f"{PREVIEW_MAX_FEATURES}件までに間引いて表示しています。ダウンロードしたファイルには全件含まれます。"
+        )
     st.pydeck_chart(deck)
 
+# 直近の取得の段階ごとの計測結果をサイドバーに表示
+if st.session_state.get('diagnostics'):
+    with st.sidebar.expander("診断情報", expanded=False):
+        diagnostics = [
+            {k: v for k, v in record.items() if k not in ("profile", "profile_error")}
+            for record in st.session_state['diagnostics']
+        ]
+        st.caption(f"合計 {sum(record['seconds'] for record in diagnostics):.2f}秒（並列に取得したレイヤーは重複して計上）")
+        st.dataframe(diagnostics, hide_index=True)
+        from components.result_store import get_result_store
+        store_stats = get_result_store().stats()
+        st.caption(
+            f"共有ストア: {store_stats['entries']}件（メモリ上 {store_stats['in_memory']}件、"
+            f"{store_stats['bytes'] / 1024 / 1024:.0f} / {store_stats['max_bytes'] / 1024 / 1024:.0f}MB、"
+            f"退避 {store_stats['spills']}回）"
+        )
+        from components.area_cache import get_area_piece_cache
+        area_cache_stats = get_area_piece_cache().stats()
+        st.caption(
+            f"地域ごとのキャッシュ: {area_cache_stats['entries']}件（"
+            f"{area_cache_stats['bytes'] / 1024 / 1024:.0f} / {area_cache_stats['max_bytes'] / 1024 / 1024:.0f}MB、"
+            f"ヒット {area_cache_stats['hits']}回、ミス {area_cache_stats['misses']}回）"
+        )
+        for record in st.session_state['diagnostics']:
+            if "profile" in record:
+                st.markdown(f"**{record['stage']}** {record.get('layer', '')}")
+                st.json(record["profile"], expanded=False)
+
     
 
 # =======================
@@ -0,0 +1,153 @@
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+import duckdb
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from components.cilpped_geometry_loader import download_clipped_geometry
+from components.geometry_reader import query_to_geodataframe
+from components.local_mirror import write_mirror_table
+from components.mesh_membership_index import MESH_KEY_COLUMN
+from components.table_catalog import BBOX_COLUMNS, bbox_select_expression
+from benchmarks.synthetic_fixture import build_synthetic_database
+
+
+# 比較する選択（ラベル, 境界名, 地域コード）
+# 隣接する都道府県・都道府県をまたいで隣接する市区町村を選び、境界をまたぐセルの結合も比べる
+BENCHMARK_CASES: List[Tuple[str, str, List[str]]] = [
+    ("pref x1", "pref", ["01"]),
+    ("pref x2", "pref", ["01", "02"]),
+    ("city x3", "city", ["01002", "01004", "02001"]),
+]
+
+
+def legacy_clip(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: str,
+        table_name: str
+    ) -> gpd.GeoDataFrame:
+    """
+    改修前のクリップ処理（外接矩形による絞り込みなし、全列でのGROUP BY）。
+    """
+    if boundary_name == "pref":
+        boundary_cte = '''
+            SELECT id, pref_name, pref_code, geom
+            FROM main_intermediate.int_kokudo__map_00_all_2025_pref
+            WHERE pref_code IN ({})
+        '''
+        name_column = "string_agg(DISTINCT b.pref_name, '・' ORDER BY b.pref_name) AS pref_name,"
+    else:  # boundary_name == "city"
+        boundary_cte = '''
+            SELECT id, pref_name, pref_code, city_name, jcode, geom
+            FROM main_intermediate.int_kokudo__map_00_all_2025_city
+            WHERE jcode IN ({})
+        '''
+        name_column = ""
+    clipped_gdf = query_to_geodataframe(con, '''
+        WITH boundary AS ({})
+        SELECT
+            t.* EXCLUDE(geom),
+            {}
+            ST_AsWKB(ST_Union_Agg(ST_Intersection(t.geom, b.geom))) AS geometry
+        FROM {} AS t, boundary AS b
+        WHERE ST_Intersects(t.geom, b.geom)
+        GROUP BY t.*
+    '''.format(
+        boundary_cte.format(', '.join(f"'{code}'" for code in area_codes)),
+        name_column,
+        table_name
+    ))
+    # 外接矩形の列は改修前のテーブルにはない（ミラーで追加したもの）
+    return clipped_gdf.drop(columns=[column for column in BBOX_COLUMNS if column in clipped_gdf.columns])
+
+
+def assert_same_clip(before: gpd.GeoDataFrame, after: gpd.GeoDataFrame) -> None:
+    """
+    改修前後のクリップ結果が同じ行・属性・都道府県名・ジオメトリになっているか確かめる。
+    """
+    assert len(before) == len(after), f"件数が一致しません: before={len(before)}, after={len(after)}"
+    assert sorted(before.columns) == sorted(after.columns), f"列が一致しません: {list(before.columns)} / {list(after.columns)}"
+    before = before.set_index(MESH_KEY_COLUMN).sort_index()
+    after = after.set_index(MESH_KEY_COLUMN).sort_index()[before.columns]
+    assert before.index.equals(after.index), "メッシュが一致しません"
+
+    attributes = [column for column in before.columns if column != "geometry"]
+    pd.testing.assert_frame_equal(pd.DataFrame(before[attributes]), pd.DataFrame(after[attributes]))
+    difference = shapely.area(shapely.symmetric_difference(before.geometry.values, after.geometry.values))
+    assert (difference < 1e-12).all(), f"ジオメトリが一致しません（最大の差 {difference.max()}）"
+
+
+def widen_mesh_table(
+        con: duckdb.DuckDBPyConnection,
+        table_name: str,
+        attribute_columns: int,
+        bbox_columns: bool,
+        parquet_dir: Optional[str] = None
+    ) -> None:
+    """
+    合成メッシュを本番に近い形にする（人口の属性列を増やし、ミラーと同じ外接矩形の列を加える）。
+    parquet_dirを指定した場合は、ローカルミラーと同じくParquetに書き出してビューで参照する。
+    """
+    extra_columns = [f"(T001142001 + {i})::INTEGER AS T001142{i + 2:03d}" for i in range(attribute_columns - 1)]
+    if bbox_columns:
+        extra_columns.append(bbox_select_expression())
+    if extra_columns:
+        con.execute('''
+            CREATE OR REPLACE TABLE {table} AS
+            SELECT *, {columns} FROM {table} ORDER BY KEY_CODE
+        '''.format(table=table_name, columns=", ".join(extra_columns)))
+    if parquet_dir is not None:
+        write_mirror_table(con, table_name, f"SELECT * FROM {table_name}", mirror_dir=parquet_dir, order_by=MESH_KEY_COLUMN)
+        con.execute(f"DROP TABLE {table_name}")
+        con.execute('''
+            CREATE VIEW {} AS SELECT * FROM read_parquet('{}')
+        '''.format(table_name, os.path.join(parquet_dir, table_name, "*.parquet")))
+
+
+def time_call(func: Callable, repeat: int) -> float:
+    """
+    関数を繰り返し実行し、最短の実行時間（秒）を返す。
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="download_clipped_geometry の改修前後を比較する")
+    parser.add_argument("--grid-size", type=int, default=400, help="メッシュの一辺のセル数")
+    parser.add_argument("--pref-grid", type=int, default=4, help="都道府県の一辺の数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数")
+    parser.add_argument("--attribute-columns", type=int, default=1, help="メッシュの人口の属性列の数")
+    parser.add_argument("--bbox-columns", action="store_true", help="ミラーと同じ外接矩形の列を加える")
+    parser.add_argument("--parquet", action="store_true", help="メッシュをローカルミラーと同じくParquetから読む")
+    args = parser.parse_args()
+
+    con = build_synthetic_database(args.grid_size, args.pref_grid)
+    table_name = "main_jpn.jpn_census2020_mesh5__all_kepler"
+    parquet_dir = tempfile.mkdtemp(prefix="clip_benchmark_") if args.parquet else None
+    widen_mesh_table(con, table_name, args.attribute_columns, args.bbox_columns, parquet_dir)
+    print(
+        f"cells: {args.grid_size ** 2}, prefs: {args.pref_grid ** 2}, "
+        f"attribute columns: {args.attribute_columns}, bbox columns: {args.bbox_columns}, parquet: {args.parquet}"
+    )
+    for label, boundary_name, area_codes in BENCHMARK_CASES:
+        clip_before = partial(legacy_clip, con, area_codes, boundary_name, table_name)
+        clip_after = partial(download_clipped_geometry, con, area_codes, boundary_name, table_name)
+        after_gdf = clip_after()
+        assert_same_clip(clip_before(), after_gdf)
+
+        before = time_call(clip_before, args.repeat)
+        after = time_call(clip_after, args.repeat)
+        print(f"{label} ({','.join(area_codes)}): clipped rows {len(after_gdf)}")
+        print(f"  before: {before:.3f}s")
+        print(f"  after:  {after:.3f}s ({before / after:.1f}x)")
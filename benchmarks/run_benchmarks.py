@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import duckdb
+import geopandas as gpd
+
+from benchmarks.synthetic_fixture import add_synthetic_layers, build_synthetic_database
+from components.basemap_loader import BASEMAP_EXPORT_NAMES, fetch_basemap_layers
+from components.cilpped_geometry_loader import download_clipped_geometry
+from components.geojson_exporter import encode_geojson
+from components.geometry_reader import arrow_to_geodataframe
+from components.kepler_layer_loader import download_layer_kepler
+from components.kokudo_boundary_loader import download_boundary_kokudo
+from components.layer_exporter import EXPORT_FORMATS, encode_layer
+from components.zip_builder import build_zip
+
+# 計測結果の保存先
+RESULTS_DIR = "benchmarks/results"
+MESH_TABLE = "main_jpn.jpn_census2020_mesh5__all_kepler"
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """
+    関数を繰り返し実行し、最短の実行時間（秒）と最後の戻り値を返す。
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def _size(result: Any) -> Dict[str, int]:
+    """
+    戻り値の大きさ（GeoDataFrameは件数、バイト列はバイト数）を記録用に返す。
+    """
+    if isinstance(result, (bytes, bytearray)):
+        return {"bytes": len(result)}
+    if isinstance(result, tuple):
+        # (レイヤー → GeoDataFrame, エラー) の場合は全レイヤーの件数
+        return {"rows": sum(len(gdf) for gdf in result[0].values())}
+    if hasattr(result, "__len__"):
+        return {"rows": len(result)}
+    return {}
+
+
+def run_benchmarks(
+        con: duckdb.DuckDBPyConnection,
+        pref_codes: List[str],
+        city_codes: List[str],
+        repeat: int = 3
+    ) -> Dict[str, Dict]:
+    """
+    ローダーからzipの作成までを段階ごとに計測するための関数
+    :param con: 本番と同じテーブル構成のDuckDB接続
+    :param pref_codes: 都道府県単位で計測する都道府県コード
+    :param city_codes: 市区町村単位で計測する市区町村コード
+    :param repeat: 各段階の繰り返し回数（最短時間を記録する）
+    :return: 段階名 → 実行時間と出力の大きさ
+    """
+    stages: Dict[str, Dict] = {}
+
+    def stage(name: str, func: Callable[[], Any]) -> Any:
+        seconds, result = measure(func, repeat)
+        stages[name] = {"seconds": round(seconds, 4), **_size(result)}
+        print(f"{name:<24} {seconds:8.3f}s  {_size(result)}")
+        return result
+
+    # 取得
+    stage("boundary_pref", lambda: download_boundary_kokudo(con, pref_codes, "pref"))
+    stage("boundary_city", lambda: download_boundary_kokudo(con, city_codes, "city"))
+    stage("kepler_station_pref", lambda: download_layer_kepler(
+        con, "main_jpn.jpn_kokudo__station_info_kepler", pref_codes, "pref"
+    ))
+    stage("clip_mesh_pref", lambda: download_clipped_geometry(con, pref_codes, "pref", MESH_TABLE))
+    stage("clip_mesh_city", lambda: download_clipped_geometry(con, city_codes, "city", MESH_TABLE))
+    layers, errors = stage("fetch_all_layers_pref", lambda: fetch_basemap_layers(con, pref_codes, "pref"))
+    if errors:
+        raise RuntimeError(", ".join(f"{key}: {error}" for key, error in errors.items()))
+
+    # ジオメトリの変換（WKTの文字列パースとWKBの直接変換を比べる）
+    table = con.execute('''
+        SELECT * EXCLUDE(geom), ST_AsText(geom) AS wkt, ST_AsWKB(geom) AS geometry
+        FROM {}
+    '''.format(MESH_TABLE)).fetch_arrow_table()
+    wkt_frame = table.drop_columns(["geometry"]).to_pandas()
+    stage("decode_wkt", lambda: gpd.GeoDataFrame(
+        wkt_frame.drop(columns=["wkt"]),
+        geometry=gpd.GeoSeries.from_wkt(wkt_frame["wkt"]),
+        crs="EPSG:4326"
+    ))
+    stage("decode_wkb", lambda: arrow_to_geodataframe(table.drop_columns(["wkt"])))
+
+    # エンコードとzipの作成
+    stage("encode_geojson", lambda: b"".join(encode_geojson(gdf) for gdf in layers.values()))
+    for export_format in EXPORT_FORMATS:
+        if export_format == "GeoJSON":
+            continue
+        stage(
+            f"encode_{export_format.lower()}",
+            lambda export_format=export_format: b"".join(encode_layer(gdf, export_format) for gdf in layers.values())
+        )
+    members = {f"{BASEMAP_EXPORT_NAMES[key]}.geojson": encode_geojson(gdf) for key, gdf in layers.items()}
+    stage("build_zip", lambda: build_zip(members))
+
+    return stages
+
+
+def save_results(stages: Dict[str, Dict], scale: Dict, results_dir: str = RESULTS_DIR) -> str:
+    """
+    計測結果を実行環境の情報とともにJSONで保存し、保存先のパスを返す。
+    """
+    created_at = datetime.now(timezone.utc)
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{created_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": created_at.isoformat(),
+            "python": platform.python_version(),
+            "duckdb": duckdb.__version__,
+            "machine": platform.machine(),
+            "scale": scale,
+            "stages": stages,
+        }, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def check_results(
+        stages: Dict[str, Dict],
+        baseline_path: Optional[str] = None,
+        max_regression: float = 1.5,
+        thresholds_path: Optional[str] = None
+    ) -> List[str]:
+    """
+    計測結果を基準の結果・上限時間と比較する
+    :param stages: 今回の計測結果
+    :param baseline_path: 比較する過去の計測結果（JSON）
+    :param max_regression: 基準に対して許容する実行時間の倍率
+    :param thresholds_path: 段階名 → 上限時間（秒）のJSON
+    :return: 基準を満たさなかった段階についてのメッセージ
+    """
+    messages = []
+    if baseline_path is not None:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+        for name, result in stages.items():
+            if name not in baseline:
+                continue
+            ratio = result["seconds"] / max(baseline[name]["seconds"], 1e-6)
+            print(f"{name:<24} {ratio:6.2f}x vs baseline")
+            if ratio > max_regression:
+                messages.append(f"{name}: 基準の{ratio:.2f}倍（許容 {max_regression:.2f}倍）")
+    if thresholds_path is not None:
+        with open(thresholds_path, encoding="utf-8") as f:
+            thresholds = json.load(f)
+        for name, max_seconds in thresholds.items():
+            if name in stages and stages[name]["seconds"] > max_seconds:
+                messages.append(f"{name}: {stages[name]['seconds']:.3f}秒（上限 {max_seconds}秒）")
+    return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合成データでローダーとエクスポートの各段階を計測する")
+    parser.add_argument("--database", help="synthetic_fixture で書き出したDuckDBファイル（省略時はメモリ上に作成）")
+    parser.add_argument("--grid-size", type=int, default=400, help="メッシュの一辺のセル数")
+    parser.add_argument("--pref-grid", type=int, default=4, help="都道府県の一辺の数")
+    parser.add_argument("--features-per-city", type=int, default=200, help="1市区町村あたりの点・線の数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="計測結果の保存先")
+    parser.add_argument("--baseline", help="比較する過去の計測結果（JSON）")
+    parser.add_argument("--max-regression", type=float, default=1.5, help="基準に対して許容する実行時間の倍率")
+    parser.add_argument("--thresholds", help="段階名 → 上限時間（秒）のJSON")
+    args = parser.parse_args()
+
+    if args.database:
+        con = duckdb.connect(args.database, read_only=True)
+        con.sql('LOAD spatial;')
+    else:
+        con = build_synthetic_database(args.grid_size, args.pref_grid)
+        add_synthetic_layers(con, features_per_city=args.features_per_city)
+
+    stages = run_benchmarks(con, pref_codes=["01"], city_codes=["01001", "01002"], repeat=args.repeat)
+    path = save_results(stages, {
+        "database": args.database,
+        "grid_size": args.grid_size,
+        "pref_grid": args.pref_grid,
+        "features_per_city": args.features_per_city,
+    }, results_dir=args.results_dir)
+    print(f"saved: {path}")
+
+    messages = check_results(stages, args.baseline, args.max_regression, args.thresholds)
+    for message in messages:
+        print(message)
+    raise SystemExit(1 if messages else 0)
@@ -0,0 +1,135 @@
+import argparse
+import duckdb
+
+# 合成メッシュの原点と1セルの大きさ（度）
+ORIGIN_LON = 139.0
+ORIGIN_LAT = 35.0
+CELL_SIZE = 0.0025
+
+
+def build_synthetic_database(grid_size: int, pref_grid: int) -> duckdb.DuckDBPyConnection:
+    """
+    本番と同じテーブル名・列構成の合成データをメモリ上のDuckDBに作成する
+    :param grid_size: メッシュの一辺のセル数（grid_size^2 セルを作成）
+    :param pref_grid: 都道府県の一辺の数（pref_grid^2 都道府県を作成し、それぞれ2x2の市区町村に分割）
+    """
+    con = duckdb.connect()
+    con.sql('INSTALL spatial;')
+    con.sql('LOAD spatial;')
+    con.sql('CREATE SCHEMA main_jpn;')
+    con.sql('CREATE SCHEMA main_intermediate;')
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_census2020_mesh5__all_kepler AS
+        SELECT
+            printf('%05d%05d', i, j) AS KEY_CODE,
+            (hash(i * $grid + j) % 1000)::INTEGER AS T001142001,
+            ST_MakeEnvelope(
+                $lon + j * $cell, $lat + i * $cell,
+                $lon + (j + 1) * $cell, $lat + (i + 1) * $cell
+            ) AS geom
+        FROM range($grid) AS r1(i), range($grid) AS r2(j)
+    ''', {"grid": grid_size, "lon": ORIGIN_LON, "lat": ORIGIN_LAT, "cell": CELL_SIZE})
+
+    # 境界はメッシュの境目とずらして、境界をまたぐセルができるようにする
+    pref_size = grid_size * CELL_SIZE / pref_grid
+    offset = CELL_SIZE / 3
+    con.execute('''
+        CREATE TABLE main_intermediate.int_kokudo__map_00_all_2025_pref AS
+        SELECT
+            p AS id,
+            printf('%02d', p + 1) AS pref_code,
+            '県' || printf('%02d', p + 1) AS pref_name,
+            ST_MakeEnvelope(
+                $lon + $offset + (p % $n) * $size, $lat + $offset + (p // $n) * $size,
+                $lon + $offset + (p % $n + 1) * $size, $lat + $offset + (p // $n + 1) * $size
+            ) AS geom
+        FROM range($n * $n) AS r(p)
+    ''', {"n": pref_grid, "size": pref_size, "offset": offset, "lon": ORIGIN_LON, "lat": ORIGIN_LAT})
+    con.execute('''
+        CREATE TABLE main_intermediate.int_kokudo__map_00_all_2025_city AS
+        SELECT
+            p.id * 4 + c AS id,
+            p.pref_name,
+            p.pref_code,
+            p.pref_name || '市' || printf('%03d', c + 1) AS city_name,
+            p.pref_code || printf('%03d', c + 1) AS jcode,
+            ST_MakeEnvelope(
+                ST_XMin(p.geom) + (c % 2) * $half, ST_YMin(p.geom) + (c // 2) * $half,
+                ST_XMin(p.geom) + (c % 2 + 1) * $half, ST_YMin(p.geom) + (c // 2 + 1) * $half
+            ) AS geom
+        FROM main_intermediate.int_kokudo__map_00_all_2025_pref AS p, range(4) AS r(c)
+    ''', {"half": pref_size / 2})
+    return con
+
+
+def add_synthetic_layers(
+        con: duckdb.DuckDBPyConnection,
+        features_per_city: int = 200,
+        town_grid: int = 4
+    ) -> None:
+    """
+    鉄道駅・鉄道路線・バス停・バス路線・町丁字人口の合成テーブルを市区町村の範囲内に作成する
+    :param con: build_synthetic_database で作成したDuckDB接続
+    :param features_per_city: 1市区町村あたりの点・線の数
+    :param town_grid: 1市区町村を何x何の町丁字に分割するか
+    """
+    # 市区町村の外接矩形の中に、ハッシュで決まる位置（実行ごとに同じ）へ地物を置く
+    city_features = '''
+        SELECT
+            c.pref_code,
+            c.jcode,
+            k,
+            ST_XMin(c.geom) + (hash(c.id, k, 0) % 10000) / 10000.0 * (ST_XMax(c.geom) - ST_XMin(c.geom)) AS x,
+            ST_YMin(c.geom) + (hash(c.id, k, 1) % 10000) / 10000.0 * (ST_YMax(c.geom) - ST_YMin(c.geom)) AS y
+        FROM main_intermediate.int_kokudo__map_00_all_2025_city AS c, range($n) AS r(k)
+    '''
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_kokudo__station_info_kepler AS
+        SELECT pref_code, jcode, '駅' || k AS station_name, '路線' || (k % 10) AS line_name,
+            ST_MakeLine(ST_Point(x, y), ST_Point(x + $cell, y)) AS geom
+        FROM ({})
+    '''.format(city_features), {"n": features_per_city, "cell": CELL_SIZE})
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_kokudo__railroad_section_kepler AS
+        SELECT pref_code, jcode, '路線' || (k % 10) AS line_name,
+            ST_MakeLine([ST_Point(x, y), ST_Point(x + 4 * $cell, y + $cell), ST_Point(x + 8 * $cell, y)]) AS geom
+        FROM ({})
+    '''.format(city_features), {"n": features_per_city, "cell": CELL_SIZE})
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_kokudo__bus_stop_kepler AS
+        SELECT pref_code, jcode, 'バス停' || k AS bus_stop_name, ST_Point(x, y) AS geom
+        FROM ({})
+    '''.format(city_features), {"n": features_per_city})
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_kokudo__bus_line_kepler AS
+        SELECT pref_code, jcode, '系統' || k AS bus_line_name,
+            ST_MakeLine([ST_Point(x, y), ST_Point(x + 2 * $cell, y + 2 * $cell), ST_Point(x + 4 * $cell, y)]) AS geom
+        FROM ({})
+    '''.format(city_features), {"n": features_per_city, "cell": CELL_SIZE})
+    con.execute('''
+        CREATE TABLE main_jpn.jpn_census2020_town__map_with_all_kepler AS
+        SELECT
+            c.jcode || printf('%04d%02d', t // $n + 1, t % $n + 1) AS KEY_CODE,
+            (hash(c.id, t) % 5000)::INTEGER AS JINKO,
+            ST_MakeEnvelope(
+                ST_XMin(c.geom) + (t % $n) * (ST_XMax(c.geom) - ST_XMin(c.geom)) / $n,
+                ST_YMin(c.geom) + (t // $n) * (ST_YMax(c.geom) - ST_YMin(c.geom)) / $n,
+                ST_XMin(c.geom) + (t % $n + 1) * (ST_XMax(c.geom) - ST_XMin(c.geom)) / $n,
+                ST_YMin(c.geom) + (t // $n + 1) * (ST_YMax(c.geom) - ST_YMin(c.geom)) / $n
+            ) AS geom
+        FROM main_intermediate.int_kokudo__map_00_all_2025_city AS c, range($n * $n) AS r(t)
+    ''', {"n": town_grid})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本番と同じ構成の合成データベースをファイルに書き出す")
+    parser.add_argument("database", help="書き出し先のDuckDBファイル")
+    parser.add_argument("--grid-size", type=int, default=400, help="メッシュの一辺のセル数")
+    parser.add_argument("--pref-grid", type=int, default=4, help="都道府県の一辺の数")
+    parser.add_argument("--features-per-city", type=int, default=200, help="1市区町村あたりの点・線の数")
+    args = parser.parse_args()
+
+    con = build_synthetic_database(args.grid_size, args.pref_grid)
+    add_synthetic_layers(con, features_per_city=args.features_per_city)
+    con.execute(f"ATTACH '{args.database}' AS target")
+    con.execute("COPY FROM DATABASE memory TO target")
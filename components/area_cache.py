@@ -0,0 +1,202 @@
+import os
+from typing import Dict, List, Literal, Optional, Set, Tuple
+import geopandas as gpd
+import pandas as pd
+import duckdb
+import streamlit as st
+
+from components.basemap_loader import fetch_basemap_layers
+from components.cilpped_geometry_loader import CLIP_AREA_COLUMN
+from components.export_cache import SOURCE_TABLE_VERSION, ExportCache
+from components.layer_registry import LAYER_REGISTRY
+from components.mesh_membership_index import MESH_KEY_COLUMN
+from components.mesh_rollup import CLIPPED_MESH_LAYER, MESH_SOURCE_TABLE
+from components.parallel_layer_fetcher import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT_SEC
+from components.result_store import estimate_bytes
+
+# 地域ごとの取得結果を保持する上限（MB）
+DEFAULT_AREA_CACHE_MB = 512
+
+# セッションステートのキー → 行の地域を判定する列（都道府県, 市区町村）
+LAYER_AREA_COLUMNS = {
+    key: (spec.pref_column, spec.city_column)
+    for key, spec in LAYER_REGISTRY.items()
+    if spec.clip != "clip"
+}
+# 境界名 → 地域コードの桁数
+AREA_CODE_LENGTHS = {"pref": 2, "city": 5}
+
+
+def area_piece_key(
+        layer: str,
+        boundary_name: Literal["pref", "city"],
+        area_code: str,
+        mesh_table: str = MESH_SOURCE_TABLE,
+        columns: Optional[Tuple[str, ...]] = None
+    ) -> Tuple:
+    """
+    1地域・1レイヤー分の取得結果のキャッシュキーを作成する（メッシュ人口は解像度ごとに、列を絞り込んだものは列ごとに分ける）。
+    """
+    return (
+        layer, boundary_name, area_code, mesh_table if layer == CLIPPED_MESH_LAYER else None, columns, SOURCE_TABLE_VERSION
+    )
+
+
+def fetch_basemap_layers_by_area(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        layer_keys: List[str],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT_SEC,
+        mesh_table: str = MESH_SOURCE_TABLE,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None,
+        cache: Optional[ExportCache] = None
+    ) -> Tuple[Dict[str, gpd.GeoDataFrame], Dict[str, Exception]]:
+    """
+    地域ごとの取得結果をキャッシュし、複数地域の選択はキャッシュした断片を組み合わせて返す
+    キャッシュにない地域だけをまとめて問い合わせ、結果を地域ごとに分けてキャッシュに載せる。
+    メッシュ人口は地域ごとにクリップした断片として取得し、境界をまたぐセルは手元で結合する。
+    :param con: DuckDB接続
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param layer_keys: 取得するレイヤー
+    :param max_workers: 同時実行数の上限
+    :param timeout: 全レイヤー取得のタイムアウト（秒）
+    :param mesh_table: メッシュ人口のテーブル名
+    :param layer_columns: セッションステートのキー → 出力する列（指定のないレイヤーはすべての列）
+    :param cache: 地域ごとの取得結果のキャッシュ（省略時はプロセス全体で共有するもの）
+    """
+    if cache is None:
+        cache = get_area_piece_cache()
+    layer_columns = layer_columns or {}
+    codes = sorted(set(area_codes))
+    pieces: Dict[str, Dict[str, gpd.GeoDataFrame]] = {key: {} for key in layer_keys}
+    for key in layer_keys:
+        for code in codes:
+            piece = cache.get(area_piece_key(key, boundary_name, code, mesh_table, layer_columns.get(key)))
+            if piece is not None:
+                pieces[key][code] = piece
+
+    # 足りない地域の組み合わせごとにまとめて取得する（通常は全レイヤーで同じ組み合わせになる）
+    missing_groups: Dict[Tuple[str, ...], List[str]] = {}
+    for key in layer_keys:
+        missing = tuple(code for code in codes if code not in pieces[key])
+        if missing:
+            missing_groups.setdefault(missing, []).append(key)
+
+    layers, errors = {}, {}
+    for missing, keys in missing_groups.items():
+        fetched, fetch_errors = fetch_basemap_layers(
+            con, list(missing), boundary_name, keys, max_workers, timeout, mesh_table,
+            split_mesh_by_area=True, layer_columns=layer_columns
+        )
+        for key in keys:
+            if key in fetch_errors:
+                # 失敗したレイヤー（空）はキャッシュに載せない
+                errors[key] = fetch_errors[key]
+                layers[key] = fetched[key]
+                continue
+            for code, piece in split_by_area(key, fetched[key], list(missing), boundary_name).items():
+                pieces[key][code] = piece
+                cache.put(
+                    area_piece_key(key, boundary_name, code, mesh_table, layer_columns.get(key)),
+                    piece,
+                    size=estimate_bytes(piece)
+                )
+
+    for key in layer_keys:
+        if key not in errors:
+            layers[key] = combine_area_pieces(key, [pieces[key][code] for code in codes])
+    return layers, errors
+
+
+def missing_area_codes(
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        layer_keys: List[str],
+        mesh_table: str = MESH_SOURCE_TABLE,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None,
+        cache: Optional[ExportCache] = None
+    ) -> Dict[str, List[str]]:
+    """
+    fetch_basemap_layers_by_area() がキャッシュになく問い合わせる地域コードを、レイヤーごとに返す
+    取得する前の行数の見積もりを、実際に問い合わせる地域だけに絞るために使う。
+    引数は fetch_basemap_layers_by_area() と同じ。
+    """
+    if cache is None:
+        cache = get_area_piece_cache()
+    layer_columns = layer_columns or {}
+    codes = sorted(set(area_codes))
+    return {
+        key: [
+            code for code in codes
+            if area_piece_key(key, boundary_name, code, mesh_table, layer_columns.get(key)) not in cache
+        ]
+        for key in layer_keys
+    }
+
+
+def split_by_area(
+        key: str,
+        gdf: gpd.GeoDataFrame,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"]
+    ) -> Dict[str, gpd.GeoDataFrame]:
+    """
+    取得結果を地域ごとに分ける（行のない地域は空のGeoDataFrameにする）。
+    メッシュ人口は地域ごとの断片として取得したもの（CLIP_AREA_COLUMN列あり）を渡すこと。
+    """
+    if key == CLIPPED_MESH_LAYER:
+        area = gdf[CLIP_AREA_COLUMN].astype(str)
+        gdf = gdf.drop(columns=[CLIP_AREA_COLUMN])
+    else:
+        column = LAYER_AREA_COLUMNS[key][0 if boundary_name == "pref" else 1]
+        area = gdf[column].astype(str).str[:AREA_CODE_LENGTHS[boundary_name]]
+    parts = {code: part for code, part in gdf.groupby(area.values, sort=False)}
+    return {code: parts.get(code, gdf.iloc[0:0]) for code in area_codes}
+
+
+def combine_area_pieces(key: str, pieces: List[gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
+    """
+    地域ごとの取得結果を1つにまとめる
+    メッシュ人口で複数の地域にまたがるセルは、断片のジオメトリを結合して1行にし、都道府県名もまとめる。
+    """
+    non_empty = [piece for piece in pieces if not piece.empty]
+    if len(non_empty) <= 1:
+        # キャッシュ上の断片を呼び出し側で書き換えないよう複製して返す
+        return (non_empty or pieces)[0].copy()
+
+    geometry_name = non_empty[0].geometry.name
+    merged = gpd.GeoDataFrame(pd.concat(non_empty, ignore_index=True), geometry=geometry_name, crs=non_empty[0].crs)
+    if key != CLIPPED_MESH_LAYER:
+        return merged
+    crossing_mask = merged[MESH_KEY_COLUMN].duplicated(keep=False)
+    if not crossing_mask.any():
+        return merged
+
+    crossing = merged[crossing_mask]
+    dissolved = crossing.dissolve(by=MESH_KEY_COLUMN, aggfunc="first", sort=False).reset_index()
+    if "pref_name" in crossing.columns:
+        pref_names = crossing.groupby(MESH_KEY_COLUMN, sort=False)["pref_name"].agg(
+            lambda values: join_area_names({name for value in values for name in str(value).split("・")})
+        )
+        dissolved["pref_name"] = dissolved[MESH_KEY_COLUMN].map(pref_names)
+    combined = pd.concat([merged[~crossing_mask], dissolved[merged.columns]], ignore_index=True)
+    return gpd.GeoDataFrame(combined, geometry=geometry_name, crs=merged.crs)
+
+
+def join_area_names(names: Set[str]) -> str:
+    """
+    地域名を「・」でつないだ文字列にする（空の名前は除き、並びは一定にする）。
+    """
+    return "・".join(sorted(name for name in names if name))
+
+
+@st.cache_resource
+def get_area_piece_cache() -> ExportCache:
+    """
+    プロセス全体で共有する、地域ごとの取得結果のキャッシュを取得する。
+    """
+    max_mb = int(os.environ.get("GEOROOST_AREA_CACHE_MB", DEFAULT_AREA_CACHE_MB))
+    return ExportCache(max_bytes=max_mb * 1024 * 1024)
@@ -0,0 +1,154 @@
+import csv
+import math
+import threading
+from typing import Dict, List, Literal, Optional, Tuple
+import duckdb
+import streamlit as st
+
+from components.table_catalog import BOUNDARY_TABLES
+
+# 境界が取得できなかった場合の地図の中心（富士山頂）とズーム
+DEFAULT_CENTER = (35.3622222, 138.7313889)
+DEFAULT_ZOOM = 5
+# 選択地域に合わせたズームの範囲
+MIN_ZOOM = 5
+MAX_ZOOM = 13
+
+
+class AreaCatalog:
+    """
+    都道府県・市区町村のコード → 名前・外接矩形・重心を保持するカタログ
+    選択肢の絞り込み（都道府県 → 市区町村）や地図の初期表示を辞書の参照だけで行う。
+    市区町村名は重複する（伊達市、府中市など）ため、すべてコードをキーにする。
+    """
+
+    def __init__(self, pref_seed: str = "seeds/pref_code.csv", city_seed: str = "seeds/city_code.csv"):
+        self.pref_names = _read_seed(pref_seed, "pref_code", "pref_name")
+        self.city_names = _read_seed(city_seed, "jcode", "city_name")
+        self.cities_by_pref: Dict[str, List[str]] = {code: [] for code in self.pref_names}
+        for city_code in self.city_names:
+            self.cities_by_pref.setdefault(city_code[:2], []).append(city_code)
+        # 境界名 → コード → (xmin, ymin, xmax, ymax, 重心の緯度, 重心の経度)
+        self._bounds: Optional[Dict[str, Dict[str, Tuple[float, ...]]]] = None
+        self._bounds_lock = threading.Lock()
+
+    def pref_codes(self) -> List[str]:
+        """
+        都道府県コードの一覧を返す。
+        """
+        return list(self.pref_names)
+
+    def city_codes(self, pref_codes: Optional[List[str]] = None) -> List[str]:
+        """
+        市区町村コードの一覧を返す（都道府県を指定した場合はその都道府県内のみ）。
+        """
+        if not pref_codes:
+            return list(self.city_names)
+        return [city_code for pref_code in pref_codes for city_code in self.cities_by_pref.get(pref_code, [])]
+
+    def name(self, code: str) -> str:
+        """
+        コードから都道府県名・市区町村名を返す。
+        """
+        return self.pref_names.get(code) or self.city_names.get(code, code)
+
+    def label(self, code: str) -> str:
+        """
+        選択肢に表示する「名前 (コード)」を返す。
+        """
+        return f"{self.name(code)} ({code})"
+
+    def view_state(
+            self,
+            con: duckdb.DuckDBPyConnection,
+            boundary_name: Literal["pref", "city"],
+            area_codes: List[str]
+        ) -> Tuple[float, float, int]:
+        """
+        選択地域を表示する地図の中心（緯度・経度）とズームを返す
+        :param con: DuckDB接続（初回のみ境界テーブルから外接矩形と重心を読み込む）
+        :param boundary_name: 境界名（pref or city）
+        :param area_codes: 都道府県 or 市区町村コードのリスト
+        """
+        bounds = self._load_bounds(con)[boundary_name]
+        records = [bounds[code] for code in area_codes if code in bounds]
+        if not records:
+            return DEFAULT_CENTER[0], DEFAULT_CENTER[1], DEFAULT_ZOOM
+
+        # 中心は各地域の重心の平均、ズームは全地域の外接矩形が収まる大きさ
+        center_lat = sum(record[4] for record in records) / len(records)
+        center_lon = sum(record[5] for record in records) / len(records)
+        span = max(
+            max(record[2] for record in records) - min(record[0] for record in records),
+            max(record[3] for record in records) - min(record[1] for record in records),
+            1e-6
+        )
+        zoom = int(min(max(math.log2(360 / span), MIN_ZOOM), MAX_ZOOM))
+        return center_lat, center_lon, zoom
+
+    def bounds(
+            self,
+            con: duckdb.DuckDBPyConnection,
+            boundary_name: Literal["pref", "city"],
+            area_codes: List[str]
+        ) -> List[Tuple[float, float, float, float]]:
+        """
+        選択地域ごとの外接矩形（xmin, ymin, xmax, ymax）を返す（境界がない地域は含めない）。
+        :param con: DuckDB接続（初回のみ境界テーブルから読み込む）
+        :param boundary_name: 境界名（pref or city）
+        :param area_codes: 都道府県 or 市区町村コードのリスト
+        """
+        bounds = self._load_bounds(con)[boundary_name]
+        return [bounds[code][:4] for code in area_codes if code in bounds]
+
+    def _load_bounds(self, con: duckdb.DuckDBPyConnection) -> Dict[str, Dict[str, Tuple[float, ...]]]:
+        """
+        境界テーブルから全地域の外接矩形と重心を一度だけ読み込む
+        重心は元の処理と同じく平面直角座標系（EPSG:6674）で求めてから経緯度に戻す。
+        """
+        with self._bounds_lock:
+            if self._bounds is None:
+                bounds = {}
+                # 複数のセッションから同時に呼ばれるため、共有接続ではなくカーソルを使う
+                cursor = con.cursor()
+                try:
+                    for boundary_name, (boundary_table, code_column) in BOUNDARY_TABLES.items():
+                        rows = cursor.execute('''
+                            WITH areas AS (
+                                SELECT
+                                    {code_column} AS code,
+                                    min(ST_XMin(geom)) AS xmin,
+                                    min(ST_YMin(geom)) AS ymin,
+                                    max(ST_XMax(geom)) AS xmax,
+                                    max(ST_YMax(geom)) AS ymax,
+                                    ST_Transform(
+                                        ST_Centroid(ST_Transform(ST_Collect(list(geom)), 'EPSG:4326', 'EPSG:6674', always_xy := true)),
+                                        'EPSG:6674', 'EPSG:4326', always_xy := true
+                                    ) AS centroid
+                                FROM {boundary_table}
+                                GROUP BY {code_column}
+                            )
+                            SELECT code, xmin, ymin, xmax, ymax, ST_Y(centroid), ST_X(centroid)
+                            FROM areas
+                        '''.format(code_column=code_column, boundary_table=boundary_table)).fetchall()
+                        bounds[boundary_name] = {row[0]: tuple(row[1:]) for row in rows}
+                finally:
+                    cursor.close()
+                self._bounds = bounds
+            return self._bounds
+
+
+def _read_seed(path: str, code_column: str, name_column: str) -> Dict[str, str]:
+    """
+    シードのCSVから コード → 名前 の辞書を作成する（コードは先頭の0を保つため文字列のまま扱う）。
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        return {row[code_column]: row[name_column] for row in csv.DictReader(f)}
+
+
+@st.cache_resource
+def get_area_catalog() -> AreaCatalog:
+    """
+    プロセス全体で共有する地域カタログを取得する。
+    """
+    return AreaCatalog()
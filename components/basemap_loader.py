@@ -0,0 +1,150 @@
+from functools import partial
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+import geopandas as gpd
+import duckdb
+
+from components.cilpped_geometry_loader import count_clipped_geometry, download_clipped_geometry
+from components.instrumentation import instrument
+from components.kokudo_boundary_loader import count_boundary_kokudo, download_boundary_kokudo
+from components.kepler_layer_loader import count_layer_kepler, download_layer_kepler
+from components.layer_registry import LAYER_REGISTRY, projected_columns
+from components.mesh_rollup import MESH_SOURCE_TABLE
+from components.parallel_layer_fetcher import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_TIMEOUT_SEC,
+    fetch_layers_parallel,
+)
+
+# セッションステートのキー → ツールチップに表示するレイヤー名
+BASEMAP_LAYER_NAMES = {key: spec.label for key, spec in LAYER_REGISTRY.items()}
+
+# セッションステートのキー → ダウンロードするファイル名に使うレイヤー名
+BASEMAP_EXPORT_NAMES = {key: spec.export_name for key, spec in LAYER_REGISTRY.items()}
+
+
+def build_basemap_loaders(
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        mesh_table: str = MESH_SOURCE_TABLE,
+        count: bool = False,
+        split_mesh_by_area: bool = False,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None
+    ) -> Dict[str, Callable[[duckdb.DuckDBPyConnection], object]]:
+    """
+    レイヤーの定義（LAYER_REGISTRY）から、ベースマップの各レイヤーを取得する関数をまとめて作成する
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param mesh_table: メッシュ人口のテーブル名（解像度に応じて集約テーブルを指定する）
+    :param count: Trueの場合は、取得する代わりに行数を数える関数を作成する（数えられなければNoneを返す）
+    :param split_mesh_by_area: メッシュ人口を地域ごとの断片に分けて取得する（download_clipped_geometry参照）
+    :param layer_columns: セッションステートのキー → 出力する列（指定のないレイヤーはすべての列）
+    """
+    layer_columns = layer_columns or {}
+    loaders = {}
+    for key, spec in LAYER_REGISTRY.items():
+        columns = projected_columns(key, layer_columns.get(key))
+        if spec.clip == "filter":
+            loaders[key] = partial(
+                count_layer_kepler if count else partial(download_layer_kepler, columns=columns),
+                table_name=spec.table,
+                area_codes=area_codes,
+                boundary_name=boundary_name,
+                city_column=spec.city_column,
+                pref_column=spec.pref_column
+            )
+        elif spec.clip == "clip":
+            loaders[key] = partial(
+                count_clipped_geometry if count else partial(download_clipped_geometry, columns=columns),
+                area_codes=area_codes,
+                boundary_name=boundary_name,
+                table_name=mesh_table,
+                split_by_area=split_mesh_by_area
+            )
+        else:  # spec.clip == "boundary"
+            loaders[key] = partial(
+                count_boundary_kokudo if count else download_boundary_kokudo,
+                area_codes=area_codes,
+                boundary_name=boundary_name
+            )
+    return loaders
+
+
+def estimate_basemap_rows(
+        con: duckdb.DuckDBPyConnection,
+        area_codes_by_layer: Dict[str, List[str]],
+        boundary_name: Literal["pref", "city"],
+        mesh_table: str = MESH_SOURCE_TABLE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT_SEC
+    ) -> Dict[str, Optional[int]]:
+    """
+    取得する前に、各レイヤーの行数を並列に数える（ジオメトリを読まない count(*) のみ）
+    進捗の表示と、大きすぎる取得を断るために使う。数えられないレイヤーはNoneにする。
+    メッシュ人口は地域ごとの断片として取得するため、断片の数で数える。
+    :param con: DuckDB接続
+    :param area_codes_by_layer: セッションステートのキー → 実際に問い合わせる地域コード
+        （incremental_fetcher.plan_incremental_fetch() の結果。キャッシュから返す地域は含めない）
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param mesh_table: メッシュ人口のテーブル名
+    :param max_workers: 同時実行数の上限
+    :param timeout: 全レイヤーを数えるタイムアウト（秒）
+    """
+    # 問い合わせる地域がない（すべてキャッシュから返す）レイヤーは0行とする
+    estimates: Dict[str, Optional[int]] = {key: 0 for key, codes in area_codes_by_layer.items() if not codes}
+    counters = {}
+    for key, codes in area_codes_by_layer.items():
+        if codes:
+            counters[key] = build_basemap_loaders(codes, boundary_name, mesh_table, count=True, split_mesh_by_area=True)[key]
+    if not counters:
+        return estimates
+
+    with instrument("estimate") as record:
+        counts, errors = fetch_layers_parallel(con, counters, max_workers, timeout, stage="estimate_layer")
+        estimates.update(counts)
+        estimates.update({key: None for key in errors})
+        record["rows"] = sum(rows for rows in estimates.values() if rows is not None)
+    return estimates
+
+
+def fetch_basemap_layers(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        layer_keys: Optional[List[str]] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT_SEC,
+        mesh_table: str = MESH_SOURCE_TABLE,
+        split_mesh_by_area: bool = False,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None
+    ) -> Tuple[Dict[str, gpd.GeoDataFrame], Dict[str, Exception]]:
+    """
+    ベースマップの全レイヤーを並列に取得する
+    取得に失敗したレイヤーは空のGeoDataFrameで置き換え、例外を別途返す。
+    :param con: DuckDB接続
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param layer_keys: 取得するレイヤー（省略時は全レイヤー）
+    :param max_workers: 同時実行数の上限
+    :param timeout: 全レイヤー取得のタイムアウト（秒）
+    :param mesh_table: メッシュ人口のテーブル名
+    :param split_mesh_by_area: メッシュ人口を地域ごとの断片に分けて取得する
+    :param layer_columns: セッションステートのキー → 出力する列（SQLで取得する列を絞り込む）
+    """
+    if layer_keys is None:
+        layer_keys = list(BASEMAP_LAYER_NAMES)
+    loaders = build_basemap_loaders(
+        area_codes, boundary_name, mesh_table, split_mesh_by_area=split_mesh_by_area, layer_columns=layer_columns
+    )
+    layers, errors = fetch_layers_parallel(
+        con,
+        {key: loaders[key] for key in layer_keys},
+        max_workers=max_workers,
+        timeout=timeout
+    )
+    for key in layer_keys:
+        layer_name = BASEMAP_LAYER_NAMES[key]
+        if key not in layers:
+            layers[key] = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+        layers[key]['tooltip'] = layer_name
+
+    return layers, errors
@@ -0,0 +1,312 @@
+import argparse
+import io
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, List, Literal, Optional, Tuple
+import duckdb
+import pandas as pd
+
+from components.basemap_loader import BASEMAP_EXPORT_NAMES, fetch_basemap_layers
+from components.export_cache import SOURCE_TABLE_VERSION
+from components.geometry_simplifier import (
+    COORDINATE_PRECISION_OPTIONS,
+    DEFAULT_COORDINATE_PRECISION,
+    SIMPLIFY_PRESETS,
+    simplify_geodataframe,
+)
+from components.layer_exporter import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS, encode_layer
+from components.zip_builder import ZIP_COMPRESSION_LEVEL, build_zip
+
+# 事前生成したバンドルの保存先
+BUNDLE_DIR = os.environ.get("GEOROOST_BUNDLE_DIR", "data/bundles")
+# 生成状況を記録するファイル
+CHECKPOINT_FILE = "checkpoint.json"
+# 同時に生成する地域数（プロセス数）
+DEFAULT_BATCH_WORKERS = 4
+
+# 境界名 → 地域コードの一覧を持つシードファイルとコード列
+BATCH_SEEDS = {
+    "pref": ("seeds/pref_code.csv", "pref_code"),
+    "city": ("seeds/city_code.csv", "jcode"),
+}
+
+# ワーカープロセスごとのDuckDB接続
+_worker_con: Optional[duckdb.DuckDBPyConnection] = None
+
+
+def list_batch_areas(boundary_names: List[Literal["pref", "city"]]) -> List[Tuple[str, str]]:
+    """
+    シードファイルから生成対象の（境界名, 地域コード）を列挙する。
+    :param boundary_names: 対象の境界名（pref or city）
+    """
+    areas = []
+    for boundary_name in boundary_names:
+        seed_path, code_column = BATCH_SEEDS[boundary_name]
+        codes = pd.read_csv(seed_path, dtype={code_column: str})[code_column]
+        areas.extend((boundary_name, code) for code in codes)
+    return areas
+
+
+def bundle_path(
+        boundary_name: Literal["pref", "city"],
+        area_code: str,
+        export_format: str = DEFAULT_EXPORT_FORMAT,
+        bundle_dir: str = BUNDLE_DIR
+    ) -> str:
+    """
+    バンドル（zip）の保存先のパスを返す。
+    """
+    return os.path.join(bundle_dir, export_format, boundary_name, f"{area_code}.zip")
+
+
+def export_bundle(
+        con: duckdb.DuckDBPyConnection,
+        boundary_name: Literal["pref", "city"],
+        area_code: str,
+        export_options: Tuple,
+        bundle_dir: str = BUNDLE_DIR,
+        zip_level: int = ZIP_COMPRESSION_LEVEL
+    ) -> Dict:
+    """
+    1地域分のベースマップ（全レイヤー）を取得し、zipのバンドルとして保存するための関数
+    書き出しが終わってから差し替えるため、途中で失敗しても既存のバンドルは壊れない。
+    :param con: DuckDB接続
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param area_code: 都道府県 or 市区町村コード
+    :param export_options: （出力形式, 簡略化の許容誤差, 座標の桁数）
+    :param bundle_dir: バンドルの保存先
+    :param zip_level: zipの圧縮レベル（0は無圧縮）
+    :return: 保存先と処理時間、レイヤーごとの件数
+    """
+    export_format, simplify_tolerance, coordinate_precision = export_options
+    started = time.perf_counter()
+    layers, errors = fetch_basemap_layers(con, [area_code], boundary_name)
+    if errors:
+        raise RuntimeError(", ".join(f"{key}: {error}" for key, error in errors.items()))
+    fetched = time.perf_counter()
+
+    layers = {
+        key: simplify_geodataframe(gdf, simplify_tolerance, coordinate_precision)
+        for key, gdf in layers.items()
+    }
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    path = bundle_path(boundary_name, area_code, export_format, bundle_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(build_zip({
+            f"{BASEMAP_EXPORT_NAMES[key]}{extension}": encode_layer(layers[key], export_format)
+            for key in BASEMAP_EXPORT_NAMES
+        }, zip_level))
+    os.replace(path + ".tmp", path)
+    finished = time.perf_counter()
+
+    return {
+        "path": path,
+        "fetch_sec": round(fetched - started, 3),
+        "encode_sec": round(finished - fetched, 3),
+        "total_sec": round(finished - started, 3),
+        "rows": {key: len(gdf) for key, gdf in layers.items()},
+    }
+
+
+def run_batch_export(
+        areas: List[Tuple[str, str]],
+        export_options: Tuple,
+        bundle_dir: str = BUNDLE_DIR,
+        max_workers: int = DEFAULT_BATCH_WORKERS,
+        force: bool = False,
+        zip_level: int = ZIP_COMPRESSION_LEVEL
+    ) -> Dict:
+    """
+    複数地域のバンドルをプロセスプールで並列に生成する
+    終わった地域から順にチェックポイントへ記録するため、中断しても続きから再開できる。
+    同じ設定・同じ参照元バージョンで生成済みのバンドルは作り直さない。
+    :param areas: （境界名, 地域コード）のリスト
+    :param export_options: （出力形式, 簡略化の許容誤差, 座標の桁数）
+    :param bundle_dir: バンドルの保存先
+    :param max_workers: 同時に生成する地域数
+    :param force: 生成済みのバンドルも作り直す
+    :param zip_level: zipの圧縮レベル（0は無圧縮）
+    :return: 更新後のチェックポイント
+    """
+    checkpoint = read_checkpoint(bundle_dir)
+    pending = [
+        (boundary_name, area_code) for boundary_name, area_code in areas
+        if force or not _is_up_to_date(checkpoint, boundary_name, area_code, export_options, bundle_dir)
+    ]
+    print(f"{len(areas) - len(pending)} areas up to date, {len(pending)} to export")
+    if not pending:
+        return checkpoint
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(_export_bundle_in_worker, boundary_name, area_code, export_options, bundle_dir, zip_level): (boundary_name, area_code)
+            for boundary_name, area_code in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            boundary_name, area_code = futures[future]
+            entry = {
+                "options": list(export_options),
+                "version": SOURCE_TABLE_VERSION,
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }
+            try:
+                entry.update(future.result(), status="done")
+                print(
+                    f"[{done}/{len(pending)}] {boundary_name}/{area_code}: "
+                    f"fetch {entry['fetch_sec']:.1f}s, encode {entry['encode_sec']:.1f}s, total {entry['total_sec']:.1f}s"
+                )
+            except Exception as e:
+                entry.update(status="failed", error=str(e))
+                print(f"[{done}/{len(pending)}] {boundary_name}/{area_code}: failed ({e})")
+            checkpoint["areas"][_checkpoint_key(boundary_name, area_code, export_options[0])] = entry
+            _write_checkpoint(bundle_dir, checkpoint)
+
+    return checkpoint
+
+
+def load_prebuilt_bundle(
+        boundary_name: Literal["pref", "city"],
+        area_codes: List[str],
+        export_options: Tuple,
+        bundle_dir: str = BUNDLE_DIR
+    ) -> Optional[Tuple[bytes, Dict[str, bytes]]]:
+    """
+    事前生成したバンドルがあれば読み込む（1地域を選択した場合のみ）
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param export_options: （出力形式, 簡略化の許容誤差, 座標の桁数）
+    :param bundle_dir: バンドルの保存先
+    :return: zipのバイト列と、セッションステートのキー → レイヤーのバイト列（なければNone）
+    """
+    if len(set(area_codes)) != 1:
+        return None
+    area_code = area_codes[0]
+    checkpoint = read_checkpoint(bundle_dir)
+    if not _is_up_to_date(checkpoint, boundary_name, area_code, export_options, bundle_dir):
+        return None
+
+    with open(bundle_path(boundary_name, area_code, export_options[0], bundle_dir), "rb") as f:
+        bundle = f.read()
+    extension = EXPORT_FORMATS[export_options[0]]["extension"]
+    with zipfile.ZipFile(io.BytesIO(bundle)) as zip_file:
+        members = {
+            key: zip_file.read(f"{export_name}{extension}")
+            for key, export_name in BASEMAP_EXPORT_NAMES.items()
+        }
+    return bundle, members
+
+
+def read_checkpoint(bundle_dir: str = BUNDLE_DIR) -> Dict:
+    """
+    チェックポイントを読み込む。まだなければ空の記録を返す。
+    """
+    checkpoint_path = os.path.join(bundle_dir, CHECKPOINT_FILE)
+    if not os.path.exists(checkpoint_path):
+        return {"areas": {}}
+    with open(checkpoint_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_checkpoint(bundle_dir: str, checkpoint: Dict) -> None:
+    """
+    チェックポイントを書き込む（途中で落ちても壊れないよう一時ファイル経由で置き換える）。
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    checkpoint_path = os.path.join(bundle_dir, CHECKPOINT_FILE)
+    with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def _checkpoint_key(boundary_name: str, area_code: str, export_format: str) -> str:
+    return f"{export_format}/{boundary_name}/{area_code}"
+
+
+def _is_up_to_date(
+        checkpoint: Dict,
+        boundary_name: str,
+        area_code: str,
+        export_options: Tuple,
+        bundle_dir: str
+    ) -> bool:
+    """
+    同じ設定・同じ参照元バージョンで生成済みのバンドルが残っているか確認する。
+    """
+    entry = checkpoint["areas"].get(_checkpoint_key(boundary_name, area_code, export_options[0]))
+    return (
+        entry is not None
+        and entry["status"] == "done"
+        and entry["version"] == SOURCE_TABLE_VERSION
+        and entry["options"] == list(export_options)
+        and os.path.exists(bundle_path(boundary_name, area_code, export_options[0], bundle_dir))
+    )
+
+
+def _init_worker() -> None:
+    """
+    ワーカープロセスごとにDuckDB接続を1つだけ作成する。
+    """
+    from components.connect_motherduck import CONNECTION_MODE, connect_georoost
+    from components.local_mirror import MIRROR_DIR, connect_local_mirror
+
+    global _worker_con
+    _worker_con = connect_local_mirror(MIRROR_DIR) if CONNECTION_MODE == "local" else connect_georoost()
+
+
+def _export_bundle_in_worker(
+        boundary_name: Literal["pref", "city"],
+        area_code: str,
+        export_options: Tuple,
+        bundle_dir: str,
+        zip_level: int
+    ) -> Dict:
+    return export_bundle(_worker_con, boundary_name, area_code, export_options, bundle_dir, zip_level)
+
+
+def _parse_precision(value: str) -> Optional[int]:
+    """
+    --precision の値を座標の桁数にする（none は画面の「元の精度」と同じく丸めない）。
+    """
+    return None if value.lower() == "none" else int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="都道府県・市区町村ごとのベースマップのバンドルを事前生成する")
+    parser.add_argument("--boundary", action="append", choices=list(BATCH_SEEDS), help="対象の境界（複数指定可、省略時は両方）")
+    parser.add_argument("--code", action="append", help="対象の地域コード（複数指定可、省略時はシードの全コード）")
+    parser.add_argument("--format", default=DEFAULT_EXPORT_FORMAT, choices=list(EXPORT_FORMATS), help="出力形式")
+    parser.add_argument("--simplify", default="元の精度", choices=list(SIMPLIFY_PRESETS), help="ジオメトリの簡略化")
+    parser.add_argument(
+        "--precision",
+        type=_parse_precision,
+        default=DEFAULT_COORDINATE_PRECISION,
+        choices=COORDINATE_PRECISION_OPTIONS,
+        metavar="{" + ",".join("none" if p is None else str(p) for p in COORDINATE_PRECISION_OPTIONS) + "}",
+        help="座標の小数点以下の桁数（none は元の精度）"
+    )
+    parser.add_argument("--zip-level", type=int, default=ZIP_COMPRESSION_LEVEL, choices=range(10), help="zipの圧縮レベル（0は無圧縮）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_BATCH_WORKERS, help="同時に生成する地域数")
+    parser.add_argument("--bundle-dir", default=BUNDLE_DIR, help="バンドルの保存先")
+    parser.add_argument("--force", action="store_true", help="生成済みのバンドルも作り直す")
+    args = parser.parse_args()
+
+    areas = list_batch_areas(args.boundary or list(BATCH_SEEDS))
+    if args.code:
+        areas = [(boundary_name, code) for boundary_name, code in areas if code in args.code]
+    checkpoint = run_batch_export(
+        areas,
+        (args.format, SIMPLIFY_PRESETS[args.simplify], args.precision),
+        bundle_dir=args.bundle_dir,
+        max_workers=args.workers,
+        force=args.force,
+        zip_level=args.zip_level
+    )
+    failed = [key for key, entry in checkpoint["areas"].items() if entry["status"] == "failed"]
+    if failed:
+        print(f"failed: {', '.join(failed)}")
+    raise SystemExit(1 if failed else 0)
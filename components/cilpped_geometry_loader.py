@@ -1,69 +1,264 @@
-from typing import Literal, List
+from typing import Literal, List, Optional, Sequence, Tuple
 import geopandas as gpd
 import duckdb
 
+from components.geometry_reader import query_to_geodataframe
+from components.query_builder import area_code_filter, area_code_params, select_columns
+from components.mesh_membership_index import MESH_KEY_COLUMN, MESH_MEMBERSHIP_INDEXES
+from components.table_catalog import BBOX_COLUMNS, BOUNDARY_TABLES, has_bbox_columns, table_columns, table_exists
+
+# 地域ごとに分けて取得する場合に、断片の地域コードを入れる列
+CLIP_AREA_COLUMN = "clip_area_code"
+
 def download_clipped_geometry(
-        con: duckdb.DuckDBPyConnection, 
-        area_codes: List[str], 
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
         boundary_name: Literal["pref", "city"],
-        table_name: str
+        table_name: str,
+        split_by_area: bool = False,
+        columns: Optional[Sequence[str]] = None
     ) -> gpd.GeoDataFrame:
     """
     クリップした地理空間をダウンロードするための関数
+    ミラーで外接矩形の列を加えたテーブルは、選択地域全体の外接矩形で候補を絞り込んでから
+    厳密な交差判定を行い、集約はメッシュのキー列だけで行う。
+    外接矩形の列がないテーブルでは、境界との交差で結合して属性列ごと集約する。
+    split_by_area=True の場合は地域ごとに集約し、複数の地域にまたがるメッシュは
+    地域ごとの断片として返す（断片の地域コードは CLIP_AREA_COLUMN 列に入る）。
     :param con: DuckDB接続
     :param codes: 都道府県 or 市区町村コードのリスト
     :param boundary_name: クリップに使用する境界名（pref or city）
     :param table_name: クリップ対象のテーブル名
+    :param split_by_area: 地域ごとの断片に分けて返すか
+    :param columns: 取得する属性列（Noneはすべての列）。テーブルにない列は無視する
     """
-    
+    boundary_table, code_column = BOUNDARY_TABLES[boundary_name]
+    params = area_code_params(area_codes)
+    table_column_names = table_columns(con, table_name)
+    # ミラーで追加した外接矩形の列は出力しない
+    # 集約テーブルは数値以外の列を持たないため、選んだ列のうちテーブルにあるものだけを取得する
+    attribute_columns = select_columns(
+        None if columns is None else [c for c in columns if c in table_column_names],
+        table_alias="t",
+        exclude=["geom"] + [c for c in BBOX_COLUMNS if c in table_column_names]
+    )
+
     if boundary_name == "pref":
-        clipped_df = con.sql('''
-            WITH boundary AS (
+        boundary_cte = '''
+            SELECT id, pref_name, pref_code AS area_code, geom
+            FROM {}
+            WHERE {}
+        '''.format(boundary_table, area_code_filter("pref_code"))
+        name_column = "string_agg(DISTINCT b.pref_name, '・' ORDER BY b.pref_name) AS pref_name,"
+        inside_name_column = "b.pref_name,"
+        output_name_column = "c.pref_name,"
+    else:  # boundary_name == "city"
+        boundary_cte = '''
+            SELECT id, pref_name, pref_code, city_name, jcode AS area_code, geom
+            FROM {}
+            WHERE {}
+        '''.format(boundary_table, area_code_filter("jcode"))
+        # string_agg(DISTINCT b.pref_name, '・') AS pref_name,
+        # string_agg(DISTINCT b.city_name, '・') AS city_name,
+        name_column = ""
+        inside_name_column = ""
+        output_name_column = ""
+
+    # 地域ごとに分ける場合は、地域コードも集約のキーにして出力する
+    area_group = ", b.area_code" if split_by_area else ""
+    inside_area_column = f"i.area_code AS {CLIP_AREA_COLUMN}," if split_by_area else ""
+    output_area_column = f"c.area_code AS {CLIP_AREA_COLUMN}," if split_by_area else ""
+
+    # 所属関係インデックスがあれば、境界をまたぐメッシュだけをクリップする
+    index_table = MESH_MEMBERSHIP_INDEXES.get(table_name)
+    if index_table is not None and table_exists(con, index_table):
+        return query_to_geodataframe(con, '''
+            WITH boundary AS ({boundary_cte}),
+            members AS (
+                SELECT {key}, area_code, is_inside
+                FROM {index_table}
+                WHERE boundary_name = $boundary_name AND {area_filter}
+            ),
+            -- いずれかの境界に完全に含まれるメッシュ
+            inside AS (
+                SELECT {key}, arg_max(area_code, is_inside) AS area_code
+                FROM members
+                GROUP BY {key}
+                HAVING bool_or(is_inside)
+            ),
+            -- 境界をまたぐメッシュ
+            crossing AS (
+                SELECT m.{key}, m.area_code
+                FROM members AS m
+                ANTI JOIN inside AS i ON m.{key} = i.{key}
+            ),
+            -- 境界をまたぐメッシュだけをクリップする
+            clipped AS (
                 SELECT
-                    id,
-                    pref_name,
-                    pref_code,
-                    geom
-                FROM  main_intermediate.int_kokudo__map_00_all_2025_pref
-                WHERE pref_code IN ({})
+                    x.{key}{area_group},
+                    {name_column}
+                    ST_Union_Agg(ST_Intersection(t.geom, b.geom)) AS geom
+                FROM crossing AS x
+                JOIN {table_name} AS t ON t.{key} = x.{key}
+                JOIN boundary AS b ON b.area_code = x.area_code
+                GROUP BY x.{key}{area_group}
             )
             SELECT
-                t.* EXCLUDE(geom), 
-                string_agg(DISTINCT b.pref_name, '・') AS pref_name,
-                ST_AsText(ST_Union_Agg(ST_Intersection(t.geom, b.geom))) AS geometry
-            FROM {} AS t, boundary AS b
-            WHERE ST_Intersects(t.geom, b.geom)
-            GROUP BY t.*
-        '''.format(', '.join(f"'{code}'" for code in area_codes), table_name)).df()
-    else:  # boundary_name == "city"
-        clipped_df = con.sql('''
-            WITH boundary AS (
-                SELECT
-                    id,
-                    pref_name,
-                    pref_code,
-                    city_name,
-                    jcode,
-                    geom
-                FROM  main_intermediate.int_kokudo__map_00_all_2025_city
-                WHERE jcode IN ({})
-            )          
+                {attribute_columns},
+                {inside_name_column}
+                {inside_area_column}
+                ST_AsWKB(t.geom) AS geometry
+            FROM {table_name} AS t
+            JOIN inside AS i ON t.{key} = i.{key}
+            JOIN boundary AS b ON b.area_code = i.area_code
+            UNION ALL
             SELECT
-                t.* EXCLUDE(geom), 
-                -- string_agg(DISTINCT b.pref_name, '・') AS pref_name,
-                -- string_agg(DISTINCT b.city_name, '・') AS city_name,
-                ST_AsText(ST_Union_Agg(ST_Intersection(t.geom, b.geom))) AS geometry
-            FROM {} AS t, boundary AS b
-            WHERE ST_Intersects(t.geom, b.geom)
-            GROUP BY t.*
-        '''.format(', '.join(f"'{code}'" for code in area_codes), table_name)).df()
-    
-    # geometry列をジオメトリ型に変換
-    clipped_gdf = gpd.GeoDataFrame(
-        clipped_df.drop(columns=["geometry"]),
-        geometry=gpd.GeoSeries.from_wkt(clipped_df["geometry"]),
-        crs="EPSG:4326"
-    )
+                {attribute_columns},
+                {output_name_column}
+                {output_area_column}
+                ST_AsWKB(c.geom) AS geometry
+            FROM {table_name} AS t
+            JOIN clipped AS c ON t.{key} = c.{key}
+        '''.format(
+            boundary_cte=boundary_cte,
+            key=MESH_KEY_COLUMN,
+            index_table=index_table,
+            area_filter=area_code_filter("area_code"),
+            name_column=name_column,
+            inside_name_column=inside_name_column,
+            output_name_column=output_name_column,
+            area_group=area_group,
+            inside_area_column=inside_area_column,
+            output_area_column=output_area_column,
+            attribute_columns=attribute_columns,
+            table_name=table_name
+        ), {"boundary_name": boundary_name, **params})
+
+    # 外接矩形の列がなければ、候補の絞り込みと属性の結合し直しはかえって遅くなるため、
+    # 境界との交差で結合して属性列ごと集約する
+    if not has_bbox_columns(table_column_names):
+        return query_to_geodataframe(con, '''
+            WITH boundary AS ({boundary_cte})
+            SELECT
+                {attribute_columns},
+                {name_column}
+                {area_column}
+                ST_AsWKB(ST_Union_Agg(ST_Intersection(t.geom, b.geom))) AS geometry
+            FROM {table_name} AS t
+            JOIN boundary AS b ON ST_Intersects(t.geom, b.geom)
+            GROUP BY ALL
+        '''.format(
+            boundary_cte=boundary_cte,
+            attribute_columns=attribute_columns,
+            name_column=name_column,
+            area_column=f"b.area_code AS {CLIP_AREA_COLUMN}," if split_by_area else "",
+            table_name=table_name
+        ), params)
+
+    # 選択地域全体の外接矩形で候補を絞り込む
+    extent = _selection_extent(con, boundary_table, code_column, area_codes)
+    bbox_predicate = _bbox_predicate(extent is not None)
+    if extent is not None:
+        params.update(zip(("bbox_xmin", "bbox_ymin", "bbox_xmax", "bbox_ymax"), extent))
+
+    clipped_gdf = query_to_geodataframe(con, '''
+        WITH boundary AS ({boundary_cte}),
+        candidates AS (
+            SELECT t.{key}, t.geom
+            FROM {table_name} AS t
+            WHERE {bbox_predicate}
+        ),
+        clipped AS (
+            SELECT
+                t.{key}{area_group},
+                {name_column}
+                ST_Union_Agg(ST_Intersection(t.geom, b.geom)) AS geom
+            FROM candidates AS t
+            JOIN boundary AS b ON ST_Intersects(t.geom, b.geom)
+            GROUP BY t.{key}{area_group}
+        )
+        SELECT
+            {attribute_columns},
+            {output_name_column}
+            {output_area_column}
+            ST_AsWKB(c.geom) AS geometry
+        FROM {table_name} AS t
+        JOIN clipped AS c ON t.{key} = c.{key}
+        -- 属性を結合し直す際も、同じ条件で読み飛ばす
+        WHERE {bbox_predicate}
+    '''.format(
+        boundary_cte=boundary_cte,
+        key=MESH_KEY_COLUMN,
+        table_name=table_name,
+        bbox_predicate=bbox_predicate,
+        name_column=name_column,
+        output_name_column=output_name_column,
+        area_group=area_group,
+        output_area_column=output_area_column,
+        attribute_columns=attribute_columns
+    ), params)
 
     return clipped_gdf
 
+
+def _selection_extent(
+        con: duckdb.DuckDBPyConnection,
+        boundary_table: str,
+        code_column: str,
+        area_codes: List[str]
+    ) -> Optional[Tuple[float, float, float, float]]:
+    """
+    選択した境界全体の外接矩形（xmin, ymin, xmax, ymax）を求める。境界がなければNoneを返す。
+    """
+    row = con.execute('''
+        SELECT min(ST_XMin(geom)), min(ST_YMin(geom)), max(ST_XMax(geom)), max(ST_YMax(geom))
+        FROM {}
+        WHERE {}
+    '''.format(boundary_table, area_code_filter(code_column)), area_code_params(area_codes)).fetchone()
+    if row is None or row[0] is None:
+        return None
+    return row
+
+
+def _bbox_predicate(has_extent: bool) -> str:
+    """
+    外接矩形の列で候補を絞り込む条件式を返す
+    列の比較にすることで、Parquetの統計情報による読み飛ばしを効かせる。
+    矩形の座標は $bbox_xmin などのパラメータで渡す。
+    """
+    if not has_extent:
+        return "FALSE"
+    return (
+        "t.bbox_xmax >= $bbox_xmin AND t.bbox_xmin <= $bbox_xmax "
+        "AND t.bbox_ymax >= $bbox_ymin AND t.bbox_ymin <= $bbox_ymax"
+    )
+
+
+def count_clipped_geometry(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        table_name: str,
+        split_by_area: bool = False
+    ) -> Optional[int]:
+    """
+    download_clipped_geometry() で取得する行数を、所属関係インデックスから数える
+    インデックスがなければ厳密な交差判定をしないと分からないため、Noneを返す。
+    :param con: DuckDB接続
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: クリップに使用する境界名（pref or city）
+    :param table_name: クリップ対象のテーブル名
+    :param split_by_area: 地域ごとの断片に分けて数えるか（境界をまたぐメッシュは地域の数だけ数える）
+    """
+    index_table = MESH_MEMBERSHIP_INDEXES.get(table_name)
+    if index_table is None or not table_exists(con, index_table):
+        return None
+    return con.execute('''
+        SELECT {count}
+        FROM {index_table}
+        WHERE boundary_name = $boundary_name AND {area_filter}
+    '''.format(
+        count="count(*)" if split_by_area else f"count(DISTINCT {MESH_KEY_COLUMN})",
+        index_table=index_table,
+        area_filter=area_code_filter("area_code")
+    ), {"boundary_name": boundary_name, **area_code_params(area_codes)}).fetchone()[0]
@@ -1,22 +1,93 @@
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
 import duckdb
-import streamlit as st  
+import streamlit as st
+
+from components.extension_loader import load_extensions
+from components.local_mirror import MIRROR_DIR, check_mirror_staleness, connect_local_mirror
+
+# 接続先（motherduck: MotherDuckに直接接続 / local: ローカルミラーを参照）
+CONNECTION_MODE = os.environ.get("GEOROOST_CONNECTION_MODE", "motherduck")
 
 # ===== MotherDuck 接続まわり =====
 @st.cache_resource
 def get_md_con_georoost():
     """
     MotherDuckへの接続を確立する。
+    GEOROOST_CONNECTION_MODE=local の場合はローカルミラーに接続する。
+    warm_up_connection() で接続を始めていれば、その完了を待って同じ接続を返す。
+    接続に失敗した場合は開始した接続処理をキャッシュから外し、次の再実行で接続し直す。
+    """
+    try:
+        return _connection_future().result()
+    except Exception:
+        _connection_future.clear()
+        raise
+
+
+def warm_up_connection() -> None:
+    """
+    接続の確立をバックグラウンドで始める（待たずに戻る）。
+    ページの描画と並行して拡張の読み込みやMotherDuckへの接続を済ませておく。
     """
-    # DuckDB データベースのパス 
+    _connection_future()
+
+
+@st.cache_resource
+def _connection_future() -> Future:
+    """
+    プロセス全体で1回だけ接続処理を開始し、その完了を表すFutureを返す。
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="md-connect")
+    future = executor.submit(_open_connection)
+    executor.shutdown(wait=False)
+    return future
+
+
+def _open_connection() -> duckdb.DuckDBPyConnection:
+    """
+    接続を開き、最初のクエリで使うカタログ情報を読み込んでおく。
+    """
+    if CONNECTION_MODE == "local":
+        con = connect_local_mirror(MIRROR_DIR)
+    else:
+        con = connect_georoost()
+    con.execute("SELECT count(*) FROM information_schema.tables").fetchone()
+    return con
+
+
+def connect_georoost(read_only: bool = True) -> duckdb.DuckDBPyConnection:
+    """
+    MotherDuckのgeoroost-devデータベースに接続する（キャッシュしない）。
+    """
+    # DuckDB データベースのパス
     try :
         MOTHERDUCK_TOKEN = os.environ['MOTHERDUCK_TOKEN']
     except KeyError:
         MOTHERDUCK_TOKEN = st.secrets["MOTHERDUCK_TOKEN"]
     DUCKDB_PATH = f"md:georoost-dev?motherduck_token={MOTHERDUCK_TOKEN}"
-    con = duckdb.connect(DUCKDB_PATH, read_only=True)
-    con.sql('INSTALL spatial;')
-    con.sql('LOAD spatial;')
-    con.sql('INSTALL motherduck;')
-    con.sql('LOAD motherduck;')
-    return con
\ No newline at end of file
+    con = duckdb.connect(DUCKDB_PATH, read_only=read_only)
+    load_extensions(con, ["spatial", "motherduck"])
+    return con
+
+
+@st.cache_data(ttl=3600)
+def get_mirror_warnings() -> List[str]:
+    """
+    ローカルミラー利用時に、ミラーが古くなっていないか確認する。
+    GEOROOST_MIRROR_CHECK_REMOTE=1 の場合はリモートの件数とも比較する。
+    """
+    if CONNECTION_MODE != "local":
+        return []
+    remote_con = None
+    if os.environ.get("GEOROOST_MIRROR_CHECK_REMOTE") == "1":
+        try:
+            remote_con = connect_georoost()
+        except Exception as e:
+            return [f"リモートに接続できないため鮮度を確認できませんでした: {e}"]
+    try:
+        return check_mirror_staleness(MIRROR_DIR, remote_con=remote_con)
+    finally:
+        if remote_con is not None:
+            remote_con.close()
@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Literal, Optional, Tuple
+import streamlit as st
+
+# キャッシュに載せるエクスポート結果の上限（MB）
+DEFAULT_EXPORT_CACHE_MB = 512
+# 参照元テーブルのバージョン（テーブルを更新したら環境変数で切り替える）
+SOURCE_TABLE_VERSION = os.environ.get("GEOROOST_SOURCE_VERSION", "2025")
+
+
+class ExportCache:
+    """
+    エンコード済みのエクスポート結果をプロセス全体で共有するLRUキャッシュ
+    保持しているバイト数が上限を超えたら、最も長く使われていないものから捨てる。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # キー → (値, バイト数)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        キャッシュから値を取り出す。見つからなければNoneを返す。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        キーが登録されているか確かめる（利用状況の集計やLRUの順序は変えない）。
+        """
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        """
+        キャッシュに値を登録する。上限より大きい値は登録しない。
+        :param key: キー
+        :param value: 値（通常はバイト列）
+        :param size: 値のバイト数（バイト列以外の値を登録する場合に指定する）
+        """
+        if size is None:
+            size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.current_bytes -= old_entry[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        キャッシュの利用状況を返す。
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def make_export_key(
+        layer: str,
+        boundary_name: Literal["pref", "city"],
+        area_codes: List[str],
+        options: Tuple = (),
+        version: str = SOURCE_TABLE_VERSION
+    ) -> Tuple:
+    """
+    エクスポート結果のキャッシュキーを作成する
+    :param layer: レイヤー名（zip全体の場合は"zip"）
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param options: 出力内容を変える設定（簡略化の許容誤差など）
+    :param version: 参照元テーブルのバージョン
+    """
+    return (layer, boundary_name, tuple(sorted(set(area_codes))), options, version)
+
+
+@st.cache_resource
+def get_export_cache() -> ExportCache:
+    """
+    プロセス全体で共有するエクスポートキャッシュを取得する。
+    """
+    max_mb = int(os.environ.get("GEOROOST_EXPORT_CACHE_MB", DEFAULT_EXPORT_CACHE_MB))
+    return ExportCache(max_bytes=max_mb * 1024 * 1024)
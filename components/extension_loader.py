@@ -0,0 +1,25 @@
+from typing import Sequence
+import duckdb
+
+
+def load_extensions(con: duckdb.DuckDBPyConnection, extensions: Sequence[str]) -> None:
+    """
+    DuckDBの拡張機能を読み込むための関数
+    インストール済みの拡張はINSTALLを省略し（起動時のダウンロード確認を避ける）、
+    読み込み済みの拡張はLOADも省略する。
+    :param con: DuckDB接続
+    :param extensions: 読み込む拡張機能の名前
+    """
+    status = {
+        name: (installed, loaded)
+        for name, installed, loaded in con.execute('''
+            SELECT extension_name, installed, loaded
+            FROM duckdb_extensions()
+        ''').fetchall()
+    }
+    for extension in extensions:
+        installed, loaded = status.get(extension, (False, False))
+        if not installed:
+            con.sql(f'INSTALL {extension};')
+        if not loaded:
+            con.sql(f'LOAD {extension};')
@@ -0,0 +1,166 @@
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# 結果をArrowのレコードバッチで受け取る際の1バッチの行数（進捗の更新・中止の確認の単位）
+STREAM_BATCH_ROWS = int(os.environ.get("GEOROOST_STREAM_BATCH_ROWS", "100000"))
+# 1回の取得で許容する見積もり行数の上限（0は上限なし）
+MAX_FETCH_ROWS = int(os.environ.get("GEOROOST_MAX_FETCH_ROWS", "0"))
+
+# 実行中の取得の進捗と、ワーカースレッドが取得しているレイヤー名
+_current_progress: contextvars.ContextVar[Optional["FetchProgress"]] = contextvars.ContextVar("current_progress", default=None)
+_current_layer: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_layer", default=None)
+
+
+class FetchCancelled(Exception):
+    """
+    利用者の操作で取得を中止した
+    """
+
+
+class FetchProgress:
+    """
+    レイヤーごとの取得済み行数を見積もり行数と比べて、取得全体の進捗を求める
+    ワーカースレッドはバッチを受け取るたびに行数を加え、中止されていれば例外で抜ける。
+    on_updateは取得を待っているスレッド（Streamlitのスクリプト）から呼ばれる。
+    """
+
+    def __init__(
+            self,
+            expected_rows: Dict[str, Optional[int]],
+            on_update: Optional[Callable[["FetchProgress"], None]] = None
+        ):
+        self.expected_rows = dict(expected_rows)
+        self.on_update = on_update
+        self.fetched_rows: Dict[str, int] = {layer: 0 for layer in expected_rows}
+        self.finished: Dict[str, bool] = {layer: False for layer in expected_rows}
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """
+        取得を中止する（実行中のクエリの中断は呼び出し側がカーソルに対して行う）。
+        """
+        self._cancelled.set()
+
+    def check_cancelled(self) -> None:
+        """
+        中止されていれば FetchCancelled を送出する。
+        """
+        if self.cancelled:
+            raise FetchCancelled("取得を中止しました")
+
+    def advance(self, layer: str, rows: int) -> None:
+        """
+        レイヤーの取得済み行数を加える（中止されていれば例外を送出する）。
+        """
+        with self._lock:
+            self.fetched_rows[layer] = self.fetched_rows.get(layer, 0) + rows
+        self.check_cancelled()
+
+    def finish(self, layer: str) -> None:
+        """
+        レイヤーの取得が終わった（成功・失敗を問わない）ことを記録する。
+        """
+        with self._lock:
+            self.finished[layer] = True
+
+    def fraction(self) -> float:
+        """
+        取得全体の進捗（0〜1）を返す。見積もりのないレイヤーは終わるまで0とし、
+        問い合わせない（見積もりが0行の）レイヤーは取得済みとする。
+        """
+        with self._lock:
+            layers = set(self.expected_rows) | set(self.fetched_rows)
+            if not layers:
+                return 0.0
+            total = 0.0
+            for layer in layers:
+                expected = self.expected_rows.get(layer)
+                if self.finished.get(layer) or expected == 0:
+                    total += 1.0
+                elif expected:
+                    total += min(self.fetched_rows.get(layer, 0) / expected, 1.0)
+            return total / len(layers)
+
+    def total_rows(self) -> int:
+        """
+        全レイヤーの取得済み行数を返す。
+        """
+        with self._lock:
+            return sum(self.fetched_rows.values())
+
+    def expected_total(self) -> Optional[int]:
+        """
+        見積もり行数の合計を返す（見積もりのあるレイヤーのみ。1つもなければNone）。
+        """
+        known = [rows for rows in self.expected_rows.values() if rows is not None]
+        return sum(known) if known else None
+
+    def describe(self) -> str:
+        """
+        進捗の表示用に「取得済み / 見積もり行数」を返す。
+        """
+        expected = self.expected_total()
+        if expected is None:
+            return f"{self.total_rows():,}行"
+        return f"{self.total_rows():,} / 約{expected:,}行"
+
+    def notify(self) -> None:
+        """
+        進捗の表示を更新する（取得を待っているスレッドから呼ぶ）。
+        """
+        if self.on_update is not None:
+            self.on_update(self)
+
+
+@contextmanager
+def track_fetch_progress(progress: FetchProgress) -> Iterator[FetchProgress]:
+    """
+    このブロックの中で行うレイヤーの取得の進捗をprogressに集める。
+    ワーカースレッドで取得する場合は contextvars.copy_context() を引き継ぐこと。
+    """
+    token = _current_progress.set(progress)
+    try:
+        yield progress
+    finally:
+        _current_progress.reset(token)
+
+
+def current_fetch_progress() -> Optional[FetchProgress]:
+    """
+    実行中の取得の進捗を返す（track_fetch_progress() の外ではNone）。
+    """
+    return _current_progress.get()
+
+
+@contextmanager
+def fetching_layer(layer: str) -> Iterator[None]:
+    """
+    ブロックの中で受け取った行数を、指定したレイヤーの進捗として数える（ワーカースレッドで使う）。
+    """
+    token = _current_layer.set(layer)
+    try:
+        yield
+    finally:
+        _current_layer.reset(token)
+        progress = _current_progress.get()
+        if progress is not None:
+            progress.finish(layer)
+
+
+def report_rows(rows: int) -> None:
+    """
+    受け取った行数を実行中の取得の進捗に加える（進捗を集めていなければ何もしない）。
+    中止されていれば FetchCancelled を送出する。
+    """
+    progress = _current_progress.get()
+    layer = _current_layer.get()
+    if progress is not None and layer is not None:
+        progress.advance(layer, rows)
@@ -0,0 +1,92 @@
+import datetime
+import decimal
+import io
+import json
+from typing import BinaryIO, Iterator
+import geopandas as gpd
+
+# 1回のエンコードでまとめて処理する地物数
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iter_geojson_chunks(
+        gdf: gpd.GeoDataFrame,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+    """
+    GeoDataFrameをGeoJSONのFeatureCollectionとして少しずつエンコードする
+    レイヤー全体の文字列や地物の辞書リストを一度に作らないため、
+    出力サイズに関わらずメモリ使用量はチャンク分に抑えられる。
+    :param gdf: エンコードするGeoDataFrame
+    :param chunk_size: 1チャンクあたりの地物数
+    """
+    yield b'{"type": "FeatureCollection", "features": ['
+    for start in range(0, len(gdf), chunk_size):
+        features = gdf.iloc[start:start + chunk_size].iterfeatures(na="null")
+        chunk = ", ".join(json.dumps(feature, ensure_ascii=False, default=_json_default) for feature in features)
+        if start > 0:
+            chunk = ", " + chunk
+        yield chunk.encode("utf-8")
+    yield b']}'
+
+
+def iter_geojsonseq_chunks(
+        gdf: gpd.GeoDataFrame,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+    """
+    GeoDataFrameを1行1地物のGeoJSONSeq（改行区切り）として少しずつエンコードする
+    全体を1つの配列にしないため、読み込む側も1行ずつストリーム処理できる。
+    :param gdf: エンコードするGeoDataFrame
+    :param chunk_size: 1チャンクあたりの地物数
+    """
+    for start in range(0, len(gdf), chunk_size):
+        features = gdf.iloc[start:start + chunk_size].iterfeatures(na="null")
+        chunk = "".join(json.dumps(feature, ensure_ascii=False, default=_json_default) + "\n" for feature in features)
+        yield chunk.encode("utf-8")
+
+
+def _json_default(value):
+    """
+    json.dumps で直接書き出せない属性値（日付・日時・DECIMAL）を変換する。
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        # pandasのTimestampもdatetimeのサブクラス
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
+def write_geojson(
+        gdf: gpd.GeoDataFrame,
+        fileobj: BinaryIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> None:
+    """
+    GeoDataFrameをGeoJSONとしてファイルオブジェクトに逐次書き込む。
+    :param gdf: 書き込むGeoDataFrame
+    :param fileobj: 書き込み先（zipエントリも可）
+    :param chunk_size: 1チャンクあたりの地物数
+    """
+    for chunk in iter_geojson_chunks(gdf, chunk_size=chunk_size):
+        fileobj.write(chunk)
+
+
+def encode_geojson(gdf: gpd.GeoDataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bytes:
+    """
+    GeoDataFrameをGeoJSONのバイト列にエンコードする。
+    :param gdf: エンコードするGeoDataFrame
+    :param chunk_size: 1チャンクあたりの地物数
+    """
+    buffer = io.BytesIO()
+    write_geojson(gdf, buffer, chunk_size=chunk_size)
+    return buffer.getvalue()
+
+
+def decode_geojson(data: bytes) -> gpd.GeoDataFrame:
+    """
+    エンコード済みのGeoJSONをGeoDataFrameに戻す。
+    :param data: GeoJSONのバイト列
+    """
+    return gpd.read_file(io.BytesIO(data))
@@ -0,0 +1,77 @@
+from typing import Dict, Optional, Sequence, Union
+import geopandas as gpd
+import pyarrow as pa
+import duckdb
+
+from components.fetch_progress import STREAM_BATCH_ROWS, report_rows
+from components.instrumentation import instrument, query_profile
+
+def query_to_geodataframe(
+        con: duckdb.DuckDBPyConnection,
+        query: str,
+        params: Optional[Union[Sequence, Dict]] = None,
+        geometry_column: str = "geometry",
+        crs: str = "EPSG:4326"
+    ) -> gpd.GeoDataFrame:
+    """
+    WKBでジオメトリを返すクエリを実行し、GeoDataFrameに変換するための関数
+    クエリ側では `ST_AsWKB(geom) AS geometry` のようにジオメトリをWKBで返すこと。
+    結果はArrowのレコードバッチで順に受け取り、WKTの文字列化・パースを行わない。
+    バッチごとに取得の進捗を更新し、中止されていればそこで打ち切る。
+    クエリの実行とジオメトリの変換はそれぞれ段階として計測する。
+    :param con: DuckDB接続
+    :param query: 実行するSQL
+    :param params: SQLのプレースホルダに渡すパラメータ（名前付きの場合は辞書）
+    :param geometry_column: WKBが入っている列名
+    :param crs: ジオメトリの座標参照系
+    """
+    with instrument("query") as record:
+        with query_profile(con, record):
+            reader = con.execute(query, params).to_arrow_reader(STREAM_BATCH_ROWS)
+            batches = []
+            for batch in reader:
+                batches.append(batch)
+                report_rows(batch.num_rows)
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+        record["rows"] = table.num_rows
+        record["bytes"] = table.nbytes
+    with instrument("decode_wkb", rows=table.num_rows):
+        return arrow_to_geodataframe(table, geometry_column=geometry_column, crs=crs)
+
+
+def arrow_to_geodataframe(
+        table: pa.Table,
+        geometry_column: str = "geometry",
+        crs: str = "EPSG:4326"
+    ) -> gpd.GeoDataFrame:
+    """
+    WKB列を含むArrowテーブルをGeoDataFrameに変換する。
+    :param table: Arrowテーブル
+    :param geometry_column: WKBが入っている列名
+    :param crs: ジオメトリの座標参照系
+    """
+    # WKBはpandasを経由せずArrowから直接ジオメトリ型に変換する
+    geometry = gpd.GeoSeries.from_wkb(
+        table.column(geometry_column).to_numpy(zero_copy_only=False),
+        crs=crs
+    )
+    attributes = _cast_like_duckdb(table.drop_columns([geometry_column])).to_pandas()
+
+    return gpd.GeoDataFrame(attributes, geometry=geometry, crs=crs)
+
+
+def _cast_like_duckdb(table: pa.Table) -> pa.Table:
+    """
+    属性列の型を DuckDB の .df() と同じpandasの型になるように揃える。
+    Arrowのまま変換するとDECIMALは decimal.Decimal、DATEは datetime.date のobject列になり、
+    GeoJSONの書き出しやカテゴリ化が数値・日時として扱えなくなる。
+    """
+    fields = []
+    for field in table.schema:
+        if pa.types.is_decimal(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_date(field.type):
+            field = field.with_type(pa.timestamp("us"))
+        fields.append(field)
+    schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table if schema.equals(table.schema) else table.cast(schema)
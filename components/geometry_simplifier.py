@@ -0,0 +1,51 @@
+from typing import TYPE_CHECKING, Optional
+
+# 選択肢の定数だけを使う画面描画時にgeopandas・shapelyを読み込まないよう、関数内でimportする
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# 簡略化のプリセット → 許容誤差（度、EPSG:4326）。Noneは簡略化しない
+SIMPLIFY_PRESETS = {
+    "元の精度": None,
+    "高精細（約1m）": 0.00001,
+    "標準（約5m）": 0.00005,
+    "軽量（約20m）": 0.0002,
+}
+# 座標の小数点以下の桁数の選択肢（Noneは丸めない、6桁で約0.1m）
+COORDINATE_PRECISION_OPTIONS = [None, 7, 6, 5]
+DEFAULT_COORDINATE_PRECISION = 6
+
+
+def simplify_geodataframe(
+        gdf: "gpd.GeoDataFrame",
+        tolerance: Optional[float] = None,
+        precision: Optional[int] = DEFAULT_COORDINATE_PRECISION
+    ) -> "gpd.GeoDataFrame":
+    """
+    ジオメトリの簡略化と座標の丸めを行うための関数
+    ポリゴンだけのレイヤーは隣接ポリゴンとの共有境界を保ったまま簡略化し（coverage simplify）、
+    それ以外は地物ごとにトポロジーを壊さない範囲で簡略化する。
+    :param gdf: 対象のGeoDataFrame
+    :param tolerance: 簡略化の許容誤差（度）、Noneは簡略化しない
+    :param precision: 座標の小数点以下の桁数、Noneは丸めない
+    """
+    if gdf.empty or (tolerance is None and precision is None):
+        return gdf
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    geometry = gdf.geometry
+    if tolerance is not None:
+        if geometry.geom_type.isin(["Polygon", "MultiPolygon"]).all():
+            geometry = geometry.simplify_coverage(tolerance)
+        else:
+            geometry = geometry.simplify(tolerance, preserve_topology=True)
+    if precision is not None:
+        geometry = gpd.GeoSeries(
+            shapely.transform(np.asarray(geometry.values), lambda coords: np.round(coords, precision)),
+            index=geometry.index,
+            crs=geometry.crs
+        )
+
+    return gdf.set_geometry(geometry.rename(gdf.geometry.name))
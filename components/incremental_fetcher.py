@@ -0,0 +1,157 @@
+from typing import Dict, Hashable, List, Literal, Optional, Set, Tuple
+import geopandas as gpd
+import duckdb
+
+from components.area_cache import (
+    AREA_CODE_LENGTHS,
+    LAYER_AREA_COLUMNS,
+    combine_area_pieces,
+    fetch_basemap_layers_by_area,
+    join_area_names,
+    missing_area_codes,
+)
+from components.mesh_rollup import CLIPPED_MESH_LAYER, MESH_SOURCE_TABLE
+from components.parallel_layer_fetcher import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT_SEC
+
+# 未加工（簡略化・座標の丸め前）の取得結果を表すキャッシュキーの設定
+RAW_LAYER_OPTIONS = ("raw",)
+
+
+def is_raw_layer_key(key: Hashable, raw_options: Tuple = RAW_LAYER_OPTIONS) -> bool:
+    """
+    ResultStoreのキーが未加工の取得結果（make_export_keyにRAW_LAYER_OPTIONSを渡したもの）か判定する。
+    :param raw_options: 未加工の取得結果の設定（メッシュ人口は解像度を加えたもの）
+    """
+    return isinstance(key, tuple) and len(key) > 3 and key[3] == raw_options
+
+
+def fetch_basemap_layers_incremental(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        layer_keys: List[str],
+        previous_codes: Optional[List[str]] = None,
+        previous_layers: Optional[Dict[str, gpd.GeoDataFrame]] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT_SEC,
+        mesh_table: str = MESH_SOURCE_TABLE,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None
+    ) -> Tuple[Dict[str, gpd.GeoDataFrame], Dict[str, Exception]]:
+    """
+    前回の取得結果を使い、選択地域の差分だけを取得してレイヤーを更新するための関数
+    追加された地域だけを問い合わせて結合し、外された地域の行は取り除く。
+    クリップしたメッシュは、境界をまたぐセルを追加側の断片と合わせ、外した地域の部分を削る。
+    前回の結果がない（または境界名が異なる）レイヤーは全地域を取得し直す。
+    :param con: DuckDB接続
+    :param area_codes: 今回の都道府県 or 市区町村コードのリスト
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param layer_keys: 取得するレイヤー
+    :param previous_codes: 前回の地域コードのリスト（同じ境界名のもの）
+    :param previous_layers: 前回の未加工の取得結果（セッションステートのキー → GeoDataFrame）
+    :param max_workers: 同時実行数の上限
+    :param timeout: 全レイヤー取得のタイムアウト（秒）
+    :param mesh_table: メッシュ人口のテーブル名（前回の結果も同じ解像度のもの）
+    :param layer_columns: セッションステートのキー → 出力する列（前回の結果も同じ列のもの）
+    """
+    previous_layers = previous_layers or {}
+    incremental_keys, added = _incremental_plan(area_codes, layer_keys, previous_codes, previous_layers)
+    removed = set(previous_codes or []) - set(area_codes)
+    if not incremental_keys:
+        return fetch_basemap_layers_by_area(con, area_codes, boundary_name, layer_keys, max_workers, timeout, mesh_table, layer_columns)
+
+    layers, errors = {}, {}
+    full_keys = [key for key in layer_keys if key not in incremental_keys]
+    if full_keys:
+        layers, errors = fetch_basemap_layers_by_area(con, area_codes, boundary_name, full_keys, max_workers, timeout, mesh_table, layer_columns)
+    added_layers, added_errors = {}, {}
+    if added:
+        added_layers, added_errors = fetch_basemap_layers_by_area(con, added, boundary_name, incremental_keys, max_workers, timeout, mesh_table, layer_columns)
+        errors.update(added_errors)
+
+    for key in incremental_keys:
+        gdf = previous_layers[key]
+        if removed:
+            gdf = _drop_areas(key, gdf, removed, boundary_name, previous_layers['boundary_gdf'])
+        if key in added_layers and key not in added_errors:
+            gdf = combine_area_pieces(key, [gdf, added_layers[key]])
+        layers[key] = gdf
+
+    return layers, errors
+
+
+def plan_incremental_fetch(
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        layer_keys: List[str],
+        previous_codes: Optional[List[str]] = None,
+        previous_layers: Optional[Dict[str, gpd.GeoDataFrame]] = None,
+        mesh_table: str = MESH_SOURCE_TABLE,
+        layer_columns: Optional[Dict[str, Tuple[str, ...]]] = None
+    ) -> Dict[str, List[str]]:
+    """
+    fetch_basemap_layers_incremental() が実際に問い合わせる地域コードを、レイヤーごとに返す
+    差分で更新するレイヤーは追加された地域だけ、そのうえで地域ごとのキャッシュにある地域は除く。
+    引数は fetch_basemap_layers_incremental() と同じ。
+    """
+    incremental_keys, added = _incremental_plan(area_codes, layer_keys, previous_codes, previous_layers or {})
+    codes_by_layer = {}
+    for key in layer_keys:
+        codes = added if key in incremental_keys else area_codes
+        codes_by_layer.update(missing_area_codes(codes, boundary_name, [key], mesh_table, layer_columns))
+    return codes_by_layer
+
+
+def _incremental_plan(
+        area_codes: List[str],
+        layer_keys: List[str],
+        previous_codes: Optional[List[str]],
+        previous_layers: Dict[str, gpd.GeoDataFrame]
+    ) -> Tuple[List[str], List[str]]:
+    """
+    差分で更新できるレイヤーと、追加された地域コードを返す（差分にしない場合、レイヤーは空）。
+    """
+    added = sorted(set(area_codes) - set(previous_codes or []))
+    incremental_keys = [
+        key for key in layer_keys
+        if key in previous_layers
+        # メッシュから外した地域を削るには前回の境界が必要
+        and (key != CLIPPED_MESH_LAYER or 'boundary_gdf' in previous_layers)
+    ]
+    # 前回と重なる地域がなければ差分にする意味がない
+    if not incremental_keys or len(added) >= len(set(area_codes)):
+        return [], added
+    return incremental_keys, added
+
+
+def _drop_areas(
+        key: str,
+        gdf: gpd.GeoDataFrame,
+        removed: Set[str],
+        boundary_name: Literal["pref", "city"],
+        boundary_gdf: gpd.GeoDataFrame
+    ) -> gpd.GeoDataFrame:
+    """
+    外された地域の行を取り除く（メッシュは外した地域と重なる部分を削る）。
+    """
+    code_length = AREA_CODE_LENGTHS[boundary_name]
+    if key != CLIPPED_MESH_LAYER:
+        column = LAYER_AREA_COLUMNS[key][0 if boundary_name == "pref" else 1]
+        return gdf[~gdf[column].astype(str).str[:code_length].isin(removed)]
+
+    boundary_column = LAYER_AREA_COLUMNS['boundary_gdf'][0 if boundary_name == "pref" else 1]
+    removed_boundary = boundary_gdf[boundary_gdf[boundary_column].astype(str).isin(removed)]
+    removed_geometry = removed_boundary.geometry.union_all()
+    hit = gdf.geometry.intersects(removed_geometry)
+    if not hit.any():
+        return gdf
+
+    gdf = gdf.copy()
+    gdf.loc[hit, gdf.geometry.name] = gdf.loc[hit].geometry.difference(removed_geometry)
+    if "pref_name" in gdf.columns:
+        removed_names = set(removed_boundary["pref_name"].astype(str))
+        gdf["pref_name"] = gdf["pref_name"].astype(object)
+        gdf.loc[hit, "pref_name"] = gdf.loc[hit, "pref_name"].map(
+            lambda names: join_area_names(set(str(names).split("・")) - removed_names)
+        )
+    # 外した地域の内側にあったセルは空になる
+    return gdf[~gdf.geometry.is_empty]
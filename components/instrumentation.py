@@ -0,0 +1,177 @@
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import duckdb
+
+# 段階ごとの計測結果を1行1レコードのJSONでログに出すか（既定では出さない）
+# 出力先のハンドラーはライブラリ側では設定せず、アプリ側（load_page.configure_metrics_logging など）に任せる
+METRICS_LOG = os.environ.get("GEOROOST_METRICS_LOG") == "1"
+logger = logging.getLogger("georoost.metrics")
+# ピークメモリを計測するか（tracemallocのオーバーヘッドがあるため既定では無効）
+TRACE_MEMORY = os.environ.get("GEOROOST_TRACE_MEMORY") == "1"
+# クエリごとにDuckDBのプロファイルを取得するか
+PROFILE_QUERIES = os.environ.get("GEOROOST_PROFILE_QUERIES") == "1"
+
+# 内側の段階に引き継ぐ付加情報（レイヤー名など）と、1回の取得分の計測結果の収集先
+_stage_fields: contextvars.ContextVar[Dict] = contextvars.ContextVar("stage_fields", default={})
+_stage_collector: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar("stage_collector", default=None)
+# 実行中の段階で観測したピークメモリ（内側の段階がピークをリセットしても外側の値を失わないようにする）
+_stage_peak: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("stage_peak", default=None)
+
+
+class MetricsRegistry:
+    """
+    段階ごとの計測結果をプロセス全体で集計する（運用向けの /metrics で返す）
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: Dict) -> None:
+        """
+        計測結果を1件集計に加える。
+        """
+        with self._lock:
+            stage = self._stages.setdefault(record["stage"], {
+                "count": 0, "errors": 0, "total_sec": 0.0, "max_sec": 0.0, "rows": 0, "bytes": 0,
+            })
+            stage["count"] += 1
+            stage["errors"] += 1 if "error" in record else 0
+            stage["total_sec"] += record["seconds"]
+            stage["max_sec"] = max(stage["max_sec"], record["seconds"])
+            stage["rows"] += record.get("rows", 0)
+            stage["bytes"] += record.get("bytes", 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        段階ごとの集計（件数、合計・最大時間、行数、バイト数）を返す。
+        """
+        with self._lock:
+            return {
+                name: {**stage, "avg_sec": stage["total_sec"] / stage["count"]}
+                for name, stage in self._stages.items()
+            }
+
+
+metrics_registry = MetricsRegistry()
+
+
+@contextmanager
+def instrument(stage: str, **fields) -> Iterator[Dict]:
+    """
+    処理の1段階を計測するためのコンテキストマネージャ
+    経過時間と（有効な場合は）ピークメモリを記録し、呼び出し側は返された辞書に
+    rows・bytes などを書き込む。終了時に構造化ログへ出力し、集計に加える。
+    付加情報（layer=... など）は内側の段階にも引き継がれる。
+    :param stage: 段階名（query, decode, encode など）
+    :param fields: 記録に含める付加情報
+    """
+    fields = {**_stage_fields.get(), **fields}
+    record = {"stage": stage, **fields}
+    token = _stage_fields.set(fields)
+    memory_before, peak_token = 0, None
+    if TRACE_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # ピークをこの段階の開始時点からにする（外側の段階のそれまでのピークは退避しておく）
+        # 並列に実行中の段階があると、ピークメモリはそれらを含んだ値になる
+        memory_before, peak_before = tracemalloc.get_traced_memory()
+        outer_peak = _stage_peak.get()
+        if outer_peak is not None:
+            outer_peak["bytes"] = max(outer_peak["bytes"], peak_before)
+        tracemalloc.reset_peak()
+        stage_peak = {"bytes": 0}
+        peak_token = _stage_peak.set(stage_peak)
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        if peak_token is not None:
+            peak = max(stage_peak["bytes"], tracemalloc.get_traced_memory()[1])
+            record["peak_memory_bytes"] = max(peak - memory_before, 0)
+            _stage_peak.reset(peak_token)
+            if outer_peak is not None:
+                outer_peak["bytes"] = max(outer_peak["bytes"], peak)
+        _stage_fields.reset(token)
+        if METRICS_LOG:
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        metrics_registry.record(record)
+        collector = _stage_collector.get()
+        if collector is not None:
+            collector.append(record)
+
+
+@contextmanager
+def collect_stages() -> Iterator[List[Dict]]:
+    """
+    このブロックの中で計測した段階の記録をリストに集める（診断パネルの表示用）。
+    ワーカースレッドで計測する場合は contextvars.copy_context() を引き継ぐこと。
+    """
+    records: List[Dict] = []
+    token = _stage_collector.set(records)
+    try:
+        yield records
+    finally:
+        _stage_collector.reset(token)
+
+
+@contextmanager
+def query_profile(con: duckdb.DuckDBPyConnection, record: Dict) -> Iterator[None]:
+    """
+    ブロック内で最後に実行したクエリのDuckDBプロファイルを記録に加える
+    GEOROOST_PROFILE_QUERIES=1 の場合のみ有効。設定は接続（カーソル）ごとに行う。
+    :param con: DuckDB接続
+    :param record: instrument() が返した記録
+    """
+    if not PROFILE_QUERIES:
+        yield
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        profile_path = f.name
+    con.execute("SET enable_profiling = 'json'")
+    con.execute(f"SET profiling_output = '{profile_path}'")
+    try:
+        yield
+        # 無効化の前に読み込む（プロファイルはクエリごとに上書きされる）
+        try:
+            with open(profile_path, encoding="utf-8") as f:
+                record["profile"] = _summarize_profile(json.load(f))
+        except (OSError, ValueError) as e:
+            record["profile_error"] = repr(e)
+    finally:
+        con.execute("PRAGMA disable_profiling")
+        os.remove(profile_path)
+
+
+def _summarize_profile(profile: Dict, top_n: int = 5) -> Dict:
+    """
+    DuckDBのプロファイル（JSON）から全体の指標と時間のかかった演算子を取り出す。
+    """
+    operators = []
+    stack = list(profile.get("children", []))
+    while stack:
+        node = stack.pop()
+        operators.append({
+            "operator": node.get("operator_name") or node.get("operator_type"),
+            "seconds": node.get("operator_timing", 0.0),
+            "rows": node.get("operator_cardinality", 0),
+        })
+        stack.extend(node.get("children", []))
+    operators.sort(key=lambda operator: operator["seconds"], reverse=True)
+
+    summary = {key: profile[key] for key in ("latency", "cpu_time", "rows_returned", "result_set_size") if key in profile}
+    summary["operators"] = operators[:top_n]
+    return summary
@@ -0,0 +1,64 @@
+from typing import Literal, List, Optional, Sequence
+import geopandas as gpd
+import duckdb
+
+from components.geometry_reader import query_to_geodataframe
+from components.query_builder import area_code_filter, area_code_params, select_columns
+
+def download_layer_kepler(
+        con: duckdb.DuckDBPyConnection,
+        table_name: str,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        city_column: str = "jcode",
+        pref_column: str = "pref_code",
+        columns: Optional[Sequence[str]] = None
+    ) -> gpd.GeoDataFrame:
+    """
+    Kepler用テーブルから選択地域のレコードを抽出するための関数
+    :param con: DuckDB接続
+    :param table_name: 抽出対象のテーブル名
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: 抽出に使用する境界名（pref or city）
+    :param city_column: 市区町村コードで絞り込む列名
+    :param pref_column: 都道府県コードで絞り込む列名
+    :param columns: 取得する属性列（Noneはすべての列）。指定した列だけをSQLで読み込む
+    """
+
+    where_clause = _kepler_where_clause(boundary_name, city_column, pref_column)
+
+    layer_gdf = query_to_geodataframe(con, '''
+        SELECT
+            {},
+            ST_AsWKB(geom) AS geometry
+        FROM {}
+        WHERE {}
+    '''.format(select_columns(columns), table_name, where_clause), area_code_params(area_codes))
+
+    return layer_gdf
+
+
+def count_layer_kepler(
+        con: duckdb.DuckDBPyConnection,
+        table_name: str,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"],
+        city_column: str = "jcode",
+        pref_column: str = "pref_code"
+    ) -> int:
+    """
+    download_layer_kepler() で取得する行数を数える（ジオメトリを読まないため軽い）。
+    引数は download_layer_kepler() と同じ。
+    """
+    return con.execute('''
+        SELECT count(*)
+        FROM {}
+        WHERE {}
+    '''.format(table_name, _kepler_where_clause(boundary_name, city_column, pref_column)), area_code_params(area_codes)).fetchone()[0]
+
+
+def _kepler_where_clause(boundary_name: Literal["pref", "city"], city_column: str, pref_column: str) -> str:
+    if boundary_name == "pref":
+        return area_code_filter(pref_column, code_length=2)
+    # boundary_name == "city"
+    return area_code_filter(city_column, code_length=5)
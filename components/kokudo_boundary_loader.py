@@ -2,6 +2,10 @@ from typing import Literal, List
 import geopandas as gpd
 import duckdb
 
+from components.geometry_reader import query_to_geodataframe
+from components.query_builder import area_code_filter, area_code_params
+from components.table_catalog import BOUNDARY_TABLES
+
 def download_boundary_kokudo(
         con: duckdb.DuckDBPyConnection, 
         area_codes: List[str], 
@@ -16,33 +20,45 @@ def download_boundary_kokudo(
     """
 
     if boundary_name == "pref":
-        boundary_df = con.sql('''
+        boundary_gdf = query_to_geodataframe(con, '''
             SELECT
                 id,
                 pref_name,
                 pref_code,
-                St_AsText(geom) AS geometry
+                ST_AsWKB(geom) AS geometry
             FROM  main_intermediate.int_kokudo__map_00_all_2025_pref
-            WHERE pref_code IN ({})
-        '''.format(', '.join(f"'{code}'" for code in area_codes))).df()
+            WHERE {}
+        '''.format(area_code_filter("pref_code")), area_code_params(area_codes))
     else:  # boundary_name == "city"
-        boundary_df = con.sql('''
+        boundary_gdf = query_to_geodataframe(con, '''
             SELECT
                 id,
                 pref_name,
                 pref_code,
                 city_name,
                 jcode,
-                St_AsText(geom) AS geometry
+                ST_AsWKB(geom) AS geometry
             FROM  main_intermediate.int_kokudo__map_00_all_2025_city
-            WHERE jcode IN ({})
-        '''.format(', '.join(f"'{code}'" for code in area_codes))).df()
+            WHERE {}
+        '''.format(area_code_filter("jcode")), area_code_params(area_codes))
     
-    # geometry列をジオメトリ型に変換
-    boundary_gdf = gpd.GeoDataFrame(
-        boundary_df.drop(columns=["geometry"]),
-        geometry=gpd.GeoSeries.from_wkt(boundary_df["geometry"]),
-        crs="EPSG:4326"
-    )
+    return boundary_gdf
+
 
-    return boundary_gdf
\ No newline at end of file
+def count_boundary_kokudo(
+        con: duckdb.DuckDBPyConnection,
+        area_codes: List[str],
+        boundary_name: Literal["pref", "city"]
+    ) -> int:
+    """
+    download_boundary_kokudo() で取得する行数を数える。
+    :param con: DuckDB接続
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param boundary_name: 境界名（pref or city）
+    """
+    boundary_table, code_column = BOUNDARY_TABLES[boundary_name]
+    return con.execute('''
+        SELECT count(*)
+        FROM {}
+        WHERE {}
+    '''.format(boundary_table, area_code_filter(code_column)), area_code_params(area_codes)).fetchone()[0]
@@ -0,0 +1,62 @@
+import io
+import json
+from typing import TYPE_CHECKING, Dict
+
+# 出力形式の選択肢だけを使う画面描画時にgeopandasを読み込まないよう、関数内でimportする
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# 出力形式 → 拡張子とMIMEタイプ
+EXPORT_FORMATS: Dict[str, Dict[str, str]] = {
+    "GeoJSON": {"extension": ".geojson", "mime": "application/geo+json"},
+    "FlatGeobuf": {"extension": ".fgb", "mime": "application/flatgeobuf"},
+    "GeoParquet": {"extension": ".parquet", "mime": "application/vnd.apache.parquet"},
+    "GeoJSONSeq": {"extension": ".geojsonl", "mime": "application/geo+json-seq"},
+}
+DEFAULT_EXPORT_FORMAT = "GeoJSON"
+
+
+def encode_layer(gdf: "gpd.GeoDataFrame", export_format: str = DEFAULT_EXPORT_FORMAT) -> bytes:
+    """
+    GeoDataFrameを指定した出力形式のバイト列にエンコードするための関数
+    FlatGeobufは空間インデックス付きで書き出し、GeoParquetは各行のバウンディングボックス列を付けるため、
+    受け取った側で全件を読み込まずに範囲で絞り込める。
+    :param gdf: エンコードするGeoDataFrame
+    :param export_format: 出力形式（EXPORT_FORMATSのキー）
+    """
+    from components.geojson_exporter import encode_geojson, iter_geojsonseq_chunks
+
+    if export_format == "GeoJSON":
+        return encode_geojson(gdf)
+    if export_format == "GeoJSONSeq":
+        return b"".join(iter_geojsonseq_chunks(gdf))
+
+    buffer = io.BytesIO()
+    if export_format == "FlatGeobuf":
+        gdf.to_file(buffer, driver="FlatGeobuf", engine="pyogrio", SPATIAL_INDEX="YES")
+    elif export_format == "GeoParquet":
+        gdf.to_parquet(buffer, compression="zstd", write_covering_bbox=True)
+    else:
+        raise ValueError(f"未対応の出力形式です: {export_format}")
+    return buffer.getvalue()
+
+
+def decode_layer(data: bytes, export_format: str = DEFAULT_EXPORT_FORMAT) -> "gpd.GeoDataFrame":
+    """
+    エンコード済みのレイヤーをGeoDataFrameに戻す。
+    :param data: エンコード済みのバイト列
+    :param export_format: 出力形式（EXPORT_FORMATSのキー）
+    """
+    import geopandas as gpd
+    from components.geojson_exporter import decode_geojson
+
+    if export_format == "GeoJSON":
+        return decode_geojson(data)
+    if export_format == "GeoParquet":
+        return gpd.read_parquet(io.BytesIO(data))
+    if export_format == "FlatGeobuf":
+        return gpd.read_file(io.BytesIO(data), engine="pyogrio")
+    if export_format == "GeoJSONSeq":
+        features = [json.loads(line) for line in data.decode("utf-8").splitlines() if line]
+        return gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    raise ValueError(f"未対応の出力形式です: {export_format}")
@@ -0,0 +1,133 @@
+from typing import Dict, List, Literal, NamedTuple, Optional, Tuple
+import streamlit as st
+
+from components.mesh_membership_index import MESH_KEY_COLUMN
+from components.mesh_rollup import CLIPPED_MESH_LAYER, MESH_SOURCE_TABLE
+from components.table_catalog import BBOX_COLUMNS, BOUNDARY_TABLES, table_columns
+
+
+class LayerSpec(NamedTuple):
+    """
+    ベースマップの1レイヤーの定義
+    """
+    # ツールチップに表示するレイヤー名と、ダウンロードするファイル名に使うレイヤー名
+    label: str
+    export_name: str
+    # 参照元のテーブル
+    table: str
+    # 都道府県・市区町村で絞り込む列（メッシュは境界でクリップするためNone）
+    pref_column: Optional[str]
+    city_column: Optional[str]
+    # 取得方法（filter: 地域コードで絞り込む、clip: 境界でクリップする、boundary: 境界そのもの）
+    clip: Literal["filter", "clip", "boundary"]
+    # プレビューでの表示スタイル
+    style: Dict
+    # 出力する列の既定値（Noneはすべての列）
+    columns: Optional[Tuple[str, ...]] = None
+    # ベクトルタイルのレイヤー名（タイルで配信しないものはNone）
+    tile_layer: Optional[str] = None
+
+
+# セッションステートのキー → レイヤーの定義（取得・出力の順）
+LAYER_REGISTRY: Dict[str, LayerSpec] = {
+    'clipped_station_gdf': LayerSpec(
+        label="鉄道駅", export_name="鉄道駅",
+        table="main_jpn.jpn_kokudo__station_info_kepler", pref_column="pref_code", city_column="jcode",
+        clip="filter", style={"line_width_min_pixels": 4, "get_line_color": [25, 100, 25, 200]}, # 深緑色
+        tile_layer="station"
+    ),
+    'clipped_ralisection_gdf': LayerSpec(
+        label="鉄道路線", export_name="鉄道路線",
+        table="main_jpn.jpn_kokudo__railroad_section_kepler", pref_column="pref_code", city_column="jcode",
+        clip="filter", style={"line_width_min_pixels": 3, "get_line_color": [152, 251, 152, 200]}, # 若草色
+        tile_layer="railroad"
+    ),
+    'clipped_busstop_gdf': LayerSpec(
+        label="バス停", export_name="バス停",
+        table="main_jpn.jpn_kokudo__bus_stop_kepler", pref_column="pref_code", city_column="jcode",
+        clip="filter", style={"line_width_min_pixels": 4, "get_line_color": [0, 0, 255, 200]}, # 青色
+        tile_layer="busstop"
+    ),
+    'clipped_busline_gdf': LayerSpec(
+        label="バス路線", export_name="バス路線",
+        table="main_jpn.jpn_kokudo__bus_line_kepler", pref_column="pref_code", city_column="jcode",
+        clip="filter", style={"line_width_min_pixels": 2, "get_line_color": [64, 224, 208, 200]}, # ターコイズブルー
+        tile_layer="busline"
+    ),
+    CLIPPED_MESH_LAYER: LayerSpec(
+        label="メッシュ人口", export_name="メッシュ人口",
+        table=MESH_SOURCE_TABLE, pref_column=None, city_column=None,
+        clip="clip", style={"line_width_min_pixels": 1, "get_line_color": [255, 140, 0, 200]}, # 灰色
+        tile_layer="meshpop"
+    ),
+    'clipped_mappop_gdf': LayerSpec(
+        label="町丁字人口", export_name="町丁字人口",
+        table="main_jpn.jpn_census2020_town__map_with_all_kepler", pref_column="KEY_CODE", city_column="KEY_CODE",
+        clip="filter", style={"line_width_min_pixels": 1, "get_line_color": [255, 140, 0, 200]}, # 灰色
+        tile_layer="mappop"
+    ),
+    'boundary_gdf': LayerSpec(
+        label="行政区域データ", export_name="行政区域",
+        table=BOUNDARY_TABLES["city"][0], pref_column="pref_code", city_column="jcode",
+        clip="boundary", style={"line_width_min_pixels": 4, "get_line_color": [0, 0, 0, 255]}, # 黒色
+    ),
+}
+
+
+def column_selectable(key: str) -> bool:
+    """
+    出力する列を選べるレイヤーか（境界は取得する列が決まっているため選べない）。
+    """
+    return LAYER_REGISTRY[key].clip != "boundary"
+
+
+def required_columns(key: str) -> Tuple[str, ...]:
+    """
+    列を絞り込んでも必ず取得する列（地域ごとの分割やメッシュの結合に使うキー）を返す。
+    """
+    spec = LAYER_REGISTRY[key]
+    if spec.clip == "clip":
+        return (MESH_KEY_COLUMN,)
+    return tuple(dict.fromkeys(column for column in (spec.pref_column, spec.city_column) if column))
+
+
+def projected_columns(key: str, columns: Optional[Tuple[str, ...]]) -> Optional[Tuple[str, ...]]:
+    """
+    SQLで取得する列を返す（必須の列を先頭に加える）。Noneはすべての列。
+    :param key: セッションステートのキー
+    :param columns: 利用者が選んだ列（Noneはすべての列）
+    """
+    if columns is None:
+        return None
+    return tuple(dict.fromkeys(required_columns(key) + tuple(columns)))
+
+
+def column_options(key: str, layer_columns: Dict[str, Tuple[str, ...]]) -> Tuple:
+    """
+    キャッシュキーの設定に、レイヤーの列の選択を加えるための値を返す（すべての列なら空）。
+    """
+    columns = layer_columns.get(key)
+    return () if columns is None else (("columns", columns),)
+
+
+def default_layer_columns() -> Dict[str, Tuple[str, ...]]:
+    """
+    レジストリで出力する列を決めているレイヤーの、既定の列の選択を返す。
+    """
+    return {key: spec.columns for key, spec in LAYER_REGISTRY.items() if spec.columns is not None}
+
+
+@st.cache_data(ttl=3600)
+def list_layer_columns(key: str) -> List[str]:
+    """
+    列の選択肢として、レイヤーの参照元テーブルの属性列を返す（ジオメトリと外接矩形の列は除く）。
+    """
+    # 接続を確立するまで待つため、列を選ぶときだけ呼ぶ
+    from components.connect_motherduck import get_md_con_georoost
+
+    cursor = get_md_con_georoost().cursor()
+    try:
+        columns = table_columns(cursor, LAYER_REGISTRY[key].table)
+    finally:
+        cursor.close()
+    return [column for column in columns if column != "geom" and column not in BBOX_COLUMNS]
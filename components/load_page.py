@@ -1,15 +1,32 @@
+import logging
 import streamlit as st
-from PIL import Image
 
-from components.save_memo import save_memo_to_motherduck
+from components.instrumentation import METRICS_LOG, logger as metrics_logger
+from components.save_memo import get_memo_writer, save_memo_to_motherduck
+
+
+@st.cache_resource
+def configure_metrics_logging() -> None:
+    """
+    GEOROOST_METRICS_LOG=1 の場合に、段階ごとの計測結果のログを標準エラー出力に出す（プロセスで1回だけ設定する）。
+    """
+    if not METRICS_LOG:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    metrics_logger.addHandler(handler)
+    metrics_logger.setLevel(logging.INFO)
+
 
 # ページ設定を読み込む関数
 def load_page_config():
-    # Streamlitのページ設定
-    im = Image.open("./static/images/GeoRoost_favicon.ico")
+    # 計測結果のログの出力先
+    configure_metrics_logging()
+
+    # Streamlitのページ設定（アイコンはパスで渡し、PILを読み込まない）
     st.set_page_config(
         page_title="GeoRoost", 
-        page_icon=im,
+        page_icon="./static/images/GeoRoost_favicon.ico",
         layout="wide", 
         initial_sidebar_state="expanded",
     )
@@ -51,6 +68,10 @@ def load_page_config():
                 st.success(msg)
             else:
                 st.error(msg)
+        # 送信待ちのメモがあれば件数を表示
+        memo_stats = get_memo_writer().stats()
+        if memo_stats["pending"]:
+            st.caption(f"送信待ち: {memo_stats['pending']}件（順次送信します）")
 
     # サイドバーに権利表記を追加し、リンクを設定
     st.sidebar.markdown(
@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import duckdb
+
+from components.extension_loader import load_extensions
+from components.table_catalog import bbox_select_expression
+
+# ローカルミラーの保存先
+MIRROR_DIR = os.environ.get("GEOROOST_MIRROR_DIR", "data/mirror")
+# ミラーの鮮度チェックで許容する経過日数
+MIRROR_MAX_AGE_DAYS = float(os.environ.get("GEOROOST_MIRROR_MAX_AGE_DAYS", "30"))
+# 同期の記録を残すファイル
+MANIFEST_FILE = "manifest.json"
+
+# ミラー対象のテーブル → 並び替えに使う列（Noneは並び替えない）
+# ローダーは地域コードの列を範囲条件で絞り込む（area_code_filter）ため、その列の順に書き出せば
+# Parquetの行グループの統計情報（zone map）で選択地域以外を読み飛ばせる。
+# 市区町村コード（jcode）は先頭2桁が都道府県コードなので、jcode順は都道府県コード順も兼ねる。
+MIRROR_TABLES: Dict[str, Optional[str]] = {
+    "main_jpn.jpn_kokudo__station_info_kepler": "jcode",
+    "main_jpn.jpn_kokudo__railroad_section_kepler": "jcode",
+    "main_jpn.jpn_kokudo__bus_stop_kepler": "jcode",
+    "main_jpn.jpn_kokudo__bus_line_kepler": "jcode",
+    "main_jpn.jpn_census2020_mesh5__all_kepler": "KEY_CODE",
+    "main_jpn.jpn_census2020_town__map_with_all_kepler": "KEY_CODE",
+    "main_intermediate.int_kokudo__map_00_all_2025_pref": "pref_code",
+    "main_intermediate.int_kokudo__map_00_all_2025_city": "jcode",
+}
+
+# 外接矩形の列を追加するテーブル
+# （クリップ時の候補の絞り込みで、Parquetの統計情報による読み飛ばしが効くようにする）
+MIRROR_BBOX_TABLES = {
+    "main_jpn.jpn_census2020_mesh5__all_kepler",
+}
+
+
+def sync_local_mirror(
+        con: duckdb.DuckDBPyConnection,
+        mirror_dir: str = MIRROR_DIR,
+        tables: Optional[Dict[str, Optional[str]]] = None
+    ) -> Dict:
+    """
+    MotherDuckのテーブルをローカルのGeoParquetに書き出すための関数
+    地域コードの列の順に並べて書き出し、書き出しが終わったテーブルから順に差し替える。
+    :param con: MotherDuckへのDuckDB接続
+    :param mirror_dir: ミラーの保存先
+    :param tables: ミラー対象のテーブル（省略時はMIRROR_TABLES）
+    :return: 同期結果のマニフェスト
+    """
+    if tables is None:
+        tables = MIRROR_TABLES
+
+    for table_name, order_by in tables.items():
+        query = f"SELECT * FROM {table_name}"
+        if table_name in MIRROR_BBOX_TABLES:
+            query = f"SELECT *, {bbox_select_expression()} FROM {table_name}"
+        write_mirror_table(
+            con,
+            table_name,
+            query,
+            mirror_dir=mirror_dir,
+            order_by=order_by
+        )
+
+    return read_mirror_manifest(mirror_dir)
+
+
+def write_mirror_table(
+        con: duckdb.DuckDBPyConnection,
+        table_name: str,
+        query: str,
+        mirror_dir: str = MIRROR_DIR,
+        order_by: Optional[str] = None
+    ) -> None:
+    """
+    クエリ結果をミラーのテーブルとしてGeoParquetに書き出し、マニフェストに登録する
+    書き出しが終わってから既存のファイルと差し替えるため、途中で失敗しても元のミラーは残る。
+    :param con: DuckDB接続
+    :param table_name: ミラー上のテーブル名（スキーマ名.テーブル名）
+    :param query: 書き出すデータを返すSQL
+    :param mirror_dir: ミラーの保存先
+    :param order_by: 並び替えに使う列（Noneはクエリの順のまま）
+    """
+    started = time.perf_counter()
+    table_dir = os.path.join(mirror_dir, table_name)
+    tmp_dir = table_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(mirror_dir, exist_ok=True)
+    os.makedirs(tmp_dir)
+    parquet_glob = os.path.join(tmp_dir, "*.parquet")
+    if order_by is not None:
+        query = f"SELECT * FROM ({query}) ORDER BY {order_by}"
+    con.execute('''
+        COPY ({}) TO '{}' (FORMAT PARQUET, COMPRESSION ZSTD)
+    '''.format(query, os.path.join(tmp_dir, "data.parquet")))
+    rows = con.execute('''
+        SELECT count(*) FROM read_parquet('{}')
+    '''.format(parquet_glob)).fetchone()[0]
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.rename(tmp_dir, table_dir)
+
+    manifest = read_mirror_manifest(mirror_dir) or {"tables": {}}
+    manifest["tables"][table_name] = {
+        "order_by": order_by,
+        "synced_at": datetime.now(timezone.utc).isoformat(),
+        "rows": rows,
+    }
+    _write_mirror_manifest(mirror_dir, manifest)
+    print(f"{table_name}: {rows} rows ({time.perf_counter() - started:.1f}s)")
+
+
+def connect_local_mirror(mirror_dir: str = MIRROR_DIR) -> duckdb.DuckDBPyConnection:
+    """
+    ローカルミラーをMotherDuckと同じテーブル名で参照できる接続を作成する
+    GeoParquetの上にビューを作るだけなので、ローダー側のSQLは変更しなくてよい。
+    :param mirror_dir: ミラーの保存先
+    """
+    manifest = read_mirror_manifest(mirror_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"ローカルミラーが見つかりません: {mirror_dir}")
+
+    con = duckdb.connect()
+    load_extensions(con, ["spatial"])
+    for table_name in manifest["tables"]:
+        schema_name = table_name.split(".")[0]
+        table_dir = os.path.join(os.path.abspath(mirror_dir), table_name)
+        con.execute(f'CREATE SCHEMA IF NOT EXISTS {schema_name}')
+        con.execute('''
+            CREATE VIEW {} AS
+            SELECT * FROM read_parquet('{}')
+        '''.format(table_name, os.path.join(table_dir, "*.parquet")))
+    return con
+
+
+def read_mirror_manifest(mirror_dir: str = MIRROR_DIR) -> Optional[Dict]:
+    """
+    ローカルミラーのマニフェストを読み込む。ミラーがなければNoneを返す。
+    """
+    manifest_path = os.path.join(mirror_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_mirror_staleness(
+        mirror_dir: str = MIRROR_DIR,
+        remote_con: Optional[duckdb.DuckDBPyConnection] = None,
+        max_age_days: float = MIRROR_MAX_AGE_DAYS
+    ) -> List[str]:
+    """
+    ローカルミラーが古くなっていないか確認する
+    同期からの経過日数を調べ、接続が渡された場合はリモートの件数とも突き合わせる。
+    :param mirror_dir: ミラーの保存先
+    :param remote_con: MotherDuckへのDuckDB接続（省略時はリモートと比較しない）
+    :param max_age_days: 許容する経過日数
+    :return: 古くなっているテーブルについてのメッセージ
+    """
+    manifest = read_mirror_manifest(mirror_dir)
+    if manifest is None:
+        return [f"ローカルミラーが見つかりません: {mirror_dir}"]
+
+    messages = []
+    now = datetime.now(timezone.utc)
+    for table_name in MIRROR_TABLES:
+        table_info = manifest["tables"].get(table_name)
+        if table_info is None:
+            messages.append(f"{table_name} がミラーされていません")
+            continue
+        age_days = (now - datetime.fromisoformat(table_info["synced_at"])).total_seconds() / 86400
+        if age_days > max_age_days:
+            messages.append(f"{table_name} は{age_days:.0f}日前に同期されたままです")
+        if remote_con is not None:
+            remote_rows = _table_fingerprint(remote_con, table_name)["rows"]
+            if remote_rows != table_info["rows"]:
+                messages.append(
+                    f"{table_name} の件数がリモートと異なります（ローカル {table_info['rows']} / リモート {remote_rows}）"
+                )
+    return messages
+
+
+def _table_fingerprint(con: duckdb.DuckDBPyConnection, table_name: str) -> Dict:
+    """
+    鮮度の比較に使うテーブルの特徴量を取得する。
+    """
+    rows = con.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0]
+    return {"rows": rows}
+
+
+def _write_mirror_manifest(mirror_dir: str, manifest: Dict) -> None:
+    """
+    マニフェストを書き込む（途中で落ちても壊れないよう一時ファイル経由で置き換える）。
+    """
+    manifest_path = os.path.join(mirror_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+if __name__ == "__main__":
+    from components.connect_motherduck import connect_georoost
+
+    parser = argparse.ArgumentParser(description="MotherDuckのテーブルをローカルのGeoParquetにミラーする")
+    parser.add_argument("command", choices=["sync", "check"], help="sync: 同期 / check: 鮮度の確認")
+    parser.add_argument("--mirror-dir", default=MIRROR_DIR, help="ミラーの保存先")
+    parser.add_argument("--table", action="append", help="同期するテーブル（複数指定可、省略時は全テーブル）")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        tables = MIRROR_TABLES if not args.table else {t: MIRROR_TABLES[t] for t in args.table}
+        sync_local_mirror(connect_georoost(), mirror_dir=args.mirror_dir, tables=tables)
+    else:
+        messages = check_mirror_staleness(mirror_dir=args.mirror_dir, remote_con=connect_georoost())
+        for message in messages:
+            print(message)
+        raise SystemExit(1 if messages else 0)
@@ -0,0 +1,132 @@
+from typing import Dict, List, Optional, Tuple
+import geopandas as gpd
+import pandas as pd
+import pydeck as pdk
+
+from components.geometry_simplifier import simplify_geodataframe
+from components.layer_registry import LAYER_REGISTRY
+from components.tile_server import TILE_MIN_ZOOM
+
+# プレビューで1レイヤーあたりに表示する地物数の上限
+PREVIEW_MAX_FEATURES = 5000
+# プレビュー用の簡略化の許容誤差（度、約20m）と座標の桁数
+PREVIEW_SIMPLIFY_TOLERANCE = 0.0002
+PREVIEW_COORDINATE_PRECISION = 5
+# この件数を超える点レイヤーはグリッドに集約して表示する
+POINT_AGGREGATION_THRESHOLD = 2000
+
+# ベクトルタイルで表示できるレイヤー（セッションステートのキー → タイルのレイヤー名）
+PREVIEW_TILE_LAYERS = {
+    key: LAYER_REGISTRY[key].tile_layer
+    for key in ('clipped_meshpop_gdf', 'clipped_mappop_gdf')
+}
+
+# セッションステートのキー → プレビューでの表示スタイル（描画順）
+PREVIEW_LAYER_STYLES = {
+    key: LAYER_REGISTRY[key].style
+    for key in (
+        'boundary_gdf',
+        'clipped_ralisection_gdf',
+        'clipped_station_gdf',
+        'clipped_busline_gdf',
+        'clipped_busstop_gdf',
+        'clipped_meshpop_gdf',
+        'clipped_mappop_gdf',
+    )
+}
+
+
+class CachedDeck(pdk.Deck):
+    """
+    一度シリアライズしたJSONを使い回すDeck
+    Streamlitは再実行のたびに to_json() を呼ぶため、結果を保持して作り直さないようにする。
+    """
+
+    def to_json(self):
+        if getattr(self, "_cached_json", None) is None:
+            self._cached_json = super().to_json()
+        return self._cached_json
+
+
+def build_preview_deck(
+        layers: Dict[str, gpd.GeoDataFrame],
+        center_lat: float,
+        center_lon: float,
+        zoom: int = 11,
+        max_features: int = PREVIEW_MAX_FEATURES,
+        tile_urls: Optional[Dict[str, str]] = None
+    ) -> Tuple[pdk.Deck, List[str]]:
+    """
+    プレビュー用の軽量なDeckを作成するための関数
+    各レイヤーを上限件数までに間引き、簡略化したうえでツールチップ以外の属性を落とす。
+    件数の多い点レイヤーはグリッドに集約する。
+    タイルURLを指定したレイヤーはベクトルタイルで表示し、見えている範囲だけを読み込む。
+    :param layers: セッションステートのキー → GeoDataFrame
+    :param center_lat: 地図の中心緯度
+    :param center_lon: 地図の中心経度
+    :param zoom: 地図の初期ズーム
+    :param max_features: 1レイヤーあたりの地物数の上限
+    :param tile_urls: セッションステートのキー → タイルURLのテンプレート
+    :return: Deckと、間引いたレイヤーのキー
+    """
+    deck_layers = []
+    truncated = []
+    tile_urls = tile_urls or {}
+    for key, style in PREVIEW_LAYER_STYLES.items():
+        if key in tile_urls:
+            deck_layers.append(pdk.Layer(
+                "MVTLayer",
+                data=tile_urls[key],
+                pickable=True,
+                stroked=True,
+                filled=False,
+                min_zoom=TILE_MIN_ZOOM,
+                max_zoom=14,
+                **style,
+            ))
+            continue
+
+        gdf = layers[key]
+        if gdf.empty:
+            continue
+
+        # 件数の多い点レイヤーはグリッドに集約する
+        if len(gdf) > POINT_AGGREGATION_THRESHOLD and (gdf.geom_type == "Point").all():
+            deck_layers.append(pdk.Layer(
+                "ScreenGridLayer",
+                data=pd.DataFrame({"lon": gdf.geometry.x, "lat": gdf.geometry.y}),
+                get_position=["lon", "lat"],
+                cell_size_pixels=20,
+                opacity=0.6,
+            ))
+            continue
+
+        if len(gdf) > max_features:
+            gdf = gdf.sample(n=max_features, random_state=0)
+            truncated.append(key)
+        gdf = simplify_geodataframe(
+            gdf[["tooltip", gdf.geometry.name]],
+            tolerance=PREVIEW_SIMPLIFY_TOLERANCE,
+            precision=PREVIEW_COORDINATE_PRECISION
+        )
+        deck_layers.append(pdk.Layer(
+            "GeoJsonLayer",
+            data=gdf.__geo_interface__,
+            pickable=True,
+            stroked=True,
+            filled=False,
+            **style,
+        ))
+
+    deck = CachedDeck(
+        layers=deck_layers,
+        tooltip={"text": "レイヤー名: {tooltip}"},
+        initial_view_state=pdk.ViewState(
+            latitude=center_lat,
+            longitude=center_lon,
+            zoom=zoom,
+            pitch=0,
+        ),
+        map_style='light'
+    )
+    return deck, truncated
@@ -0,0 +1,80 @@
+import argparse
+from typing import Dict
+import duckdb
+
+# メッシュを識別するキー列
+MESH_KEY_COLUMN = "KEY_CODE"
+
+# メッシュテーブル → 境界との所属関係を持つインデックステーブル
+MESH_MEMBERSHIP_INDEXES: Dict[str, str] = {
+    "main_jpn.jpn_census2020_mesh5__all_kepler": "main_intermediate.int_census2020_mesh5__boundary_membership",
+    # 上位メッシュの集約テーブル（mesh_rollup.pyで作成）
+    "main_intermediate.int_census2020_mesh4__rollup": "main_intermediate.int_census2020_mesh4__boundary_membership",
+    "main_intermediate.int_census2020_mesh3__rollup": "main_intermediate.int_census2020_mesh3__boundary_membership",
+}
+
+
+def mesh_membership_query(table_name: str) -> str:
+    """
+    メッシュと都道府県・市区町村境界の所属関係を求めるSQLを返す
+    境界に接するメッシュごとに、境界の内側に完全に含まれるか（is_inside）を記録する。
+    :param table_name: メッシュテーブル名
+    """
+    return '''
+        SELECT
+            t.{key} AS {key},
+            'pref' AS boundary_name,
+            b.pref_code AS area_code,
+            ST_Within(t.geom, b.geom) AS is_inside
+        FROM {table} AS t
+        JOIN main_intermediate.int_kokudo__map_00_all_2025_pref AS b
+            ON ST_Intersects(t.geom, b.geom)
+        UNION ALL
+        SELECT
+            t.{key} AS {key},
+            'city' AS boundary_name,
+            b.jcode AS area_code,
+            ST_Within(t.geom, b.geom) AS is_inside
+        FROM {table} AS t
+        JOIN main_intermediate.int_kokudo__map_00_all_2025_city AS b
+            ON ST_Intersects(t.geom, b.geom)
+        ORDER BY boundary_name, area_code
+    '''.format(key=MESH_KEY_COLUMN, table=table_name)
+
+
+def build_mesh_membership_index(
+        con: duckdb.DuckDBPyConnection,
+        table_name: str = "main_jpn.jpn_census2020_mesh5__all_kepler"
+    ) -> str:
+    """
+    メッシュの所属関係インデックスをデータベース上に作成する（書き込み可能な接続が必要）。
+    :param con: DuckDB接続
+    :param table_name: メッシュテーブル名
+    :return: 作成したインデックステーブル名
+    """
+    index_table = MESH_MEMBERSHIP_INDEXES[table_name]
+    con.execute('''
+        CREATE OR REPLACE TABLE {} AS {}
+    '''.format(index_table, mesh_membership_query(table_name)))
+    return index_table
+
+
+if __name__ == "__main__":
+    from components.connect_motherduck import connect_georoost
+    from components.local_mirror import MIRROR_DIR, connect_local_mirror, write_mirror_table
+
+    parser = argparse.ArgumentParser(description="メッシュと境界の所属関係インデックスを作成する")
+    parser.add_argument("--table", default="main_jpn.jpn_census2020_mesh5__all_kepler", help="メッシュテーブル名")
+    parser.add_argument("--local", action="store_true", help="MotherDuckではなくローカルミラーに作成する")
+    parser.add_argument("--mirror-dir", default=MIRROR_DIR, help="ミラーの保存先")
+    args = parser.parse_args()
+
+    if args.local:
+        write_mirror_table(
+            connect_local_mirror(args.mirror_dir),
+            MESH_MEMBERSHIP_INDEXES[args.table],
+            mesh_membership_query(args.table),
+            mirror_dir=args.mirror_dir
+        )
+    else:
+        print(build_mesh_membership_index(connect_georoost(read_only=False), args.table))
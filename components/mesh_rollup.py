@@ -0,0 +1,206 @@
+import argparse
+import os
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+import duckdb
+
+from components.mesh_membership_index import MESH_KEY_COLUMN, MESH_MEMBERSHIP_INDEXES
+from components.query_builder import area_code_filter, area_code_params
+from components.table_catalog import BBOX_COLUMNS, table_exists
+
+# セッションステートのキー（メッシュ人口のレイヤー）
+CLIPPED_MESH_LAYER = 'clipped_meshpop_gdf'
+# 集約元の5次メッシュ（250m）のテーブル
+MESH_SOURCE_TABLE = "main_jpn.jpn_census2020_mesh5__all_kepler"
+
+# 解像度 → 表示名、テーブル、メッシュコードの桁数、セルの大きさ（緯度方向・経度方向の秒）
+# 細かい順に並べる（自動選択は先頭から予算に収まるものを探す）
+MESH_LEVELS: Dict[str, Dict] = {
+    "mesh5": {"label": "5次メッシュ（250m）", "table": MESH_SOURCE_TABLE, "code_length": 10, "cell_seconds": (7.5, 11.25)},
+    "mesh4": {"label": "4次メッシュ（500m）", "table": "main_intermediate.int_census2020_mesh4__rollup", "code_length": 9, "cell_seconds": (15.0, 22.5)},
+    "mesh3": {"label": "3次メッシュ（1km）", "table": "main_intermediate.int_census2020_mesh3__rollup", "code_length": 8, "cell_seconds": (30.0, 45.0)},
+}
+DEFAULT_MESH_LEVEL = "mesh5"
+# 合計できない列（秘匿処理の有無・秘匿先・合算先のメッシュコード）
+NON_ADDITIVE_COLUMNS = ("HTKSYORI", "HTKSAKI", "GASSAN")
+# 合計する数値型
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "REAL", "DOUBLE", "DECIMAL")
+
+# 自動選択で許容するメッシュ人口の行数と、メモリ上の大きさ（MB）
+MESH_ROW_BUDGET = int(os.environ.get("GEOROOST_MESH_ROW_BUDGET", "100000"))
+MESH_BYTE_BUDGET_MB = float(os.environ.get("GEOROOST_MESH_BYTE_BUDGET_MB", "256"))
+# 1行あたりのメモリ使用量の見積もり（属性約40列 + 四角形のジオメトリ）
+ESTIMATED_BYTES_PER_ROW = 512
+
+
+def mesh_rollup_query(con: duckdb.DuckDBPyConnection, level: str, source_table: str = MESH_SOURCE_TABLE) -> str:
+    """
+    5次メッシュを上位のメッシュに集約するSQLを返す
+    メッシュコードの先頭の桁でまとめ、数値列は合計し、ジオメトリは結合する。
+    秘匿処理に関する列と数値以外の列は集約できないため出力しない。
+    :param con: DuckDB接続（集約元の列の型を調べる）
+    :param level: 集約先の解像度（MESH_LEVELSのキー）
+    :param source_table: 集約元のテーブル名
+    """
+    schema_name, name = source_table.split(".")
+    rows = con.execute('''
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ?
+        ORDER BY ordinal_position
+    ''', [schema_name, name]).fetchall()
+    column_types = dict(rows)
+    sum_columns = [
+        column for column, data_type in rows
+        if column not in (MESH_KEY_COLUMN, *NON_ADDITIVE_COLUMNS, *BBOX_COLUMNS)
+        and data_type.split("(")[0] in _NUMERIC_TYPES
+    ]
+    # キー列の型は元のテーブルに合わせる（文字列・整数のどちらでも先頭の桁で切り出す）
+    return '''
+        SELECT
+            CAST(SUBSTRING(CAST({key} AS VARCHAR), 1, {code_length}) AS {key_type}) AS {key},
+            {sum_columns}
+            ST_Union_Agg(geom) AS geom
+        FROM {source_table}
+        GROUP BY 1
+        ORDER BY 1
+    '''.format(
+        key=MESH_KEY_COLUMN,
+        key_type=column_types[MESH_KEY_COLUMN],
+        code_length=MESH_LEVELS[level]["code_length"],
+        sum_columns=''.join(f"sum({column}) AS {column},\n" for column in sum_columns),
+        source_table=source_table
+    )
+
+
+def build_mesh_rollups(con: duckdb.DuckDBPyConnection, levels: Optional[List[str]] = None) -> List[str]:
+    """
+    上位メッシュの集約テーブルをデータベース上に作成する（書き込み可能な接続が必要）。
+    :param con: DuckDB接続
+    :param levels: 作成する解像度（省略時は5次メッシュ以外のすべて）
+    :return: 作成したテーブル名
+    """
+    if levels is None:
+        levels = [level for level in MESH_LEVELS if level != DEFAULT_MESH_LEVEL]
+    created = []
+    for level in levels:
+        table_name = MESH_LEVELS[level]["table"]
+        con.execute('''
+            CREATE OR REPLACE TABLE {} AS {}
+        '''.format(table_name, mesh_rollup_query(con, level)))
+        created.append(table_name)
+    return created
+
+
+def available_mesh_levels(con: duckdb.DuckDBPyConnection) -> List[str]:
+    """
+    テーブルが存在する解像度を細かい順に返す（集約テーブルを作成していなければ5次メッシュのみ）。
+    """
+    return [
+        level for level, info in MESH_LEVELS.items()
+        if level == DEFAULT_MESH_LEVEL or table_exists(con, info["table"])
+    ]
+
+
+def estimate_mesh_rows(
+        con: duckdb.DuckDBPyConnection,
+        boundary_name: Literal["pref", "city"],
+        area_codes: List[str],
+        area_bounds: Callable[[], List[Tuple[float, float, float, float]]]
+    ) -> Dict[str, int]:
+    """
+    選択地域のメッシュ人口の行数を解像度ごとに見積もる
+    5次メッシュの所属関係インデックスがあれば、選択地域に接するメッシュコードを数える（正確な値）。
+    なければ地域ごとの外接矩形に入るセルの数で見積もる（海や無人のセルも含むため多めになる）。
+    :param con: DuckDB接続
+    :param boundary_name: 境界名（pref or city）
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param area_bounds: 地域ごとの外接矩形（xmin, ymin, xmax, ymax）を返す関数（インデックスがない場合だけ呼ぶ）
+    """
+    index_table = MESH_MEMBERSHIP_INDEXES.get(MESH_SOURCE_TABLE)
+    # 複数のセッションから同時に呼ばれるため、共有接続ではなくカーソルを使う
+    cursor = con.cursor()
+    try:
+        if index_table is not None and table_exists(cursor, index_table):
+            row = cursor.execute('''
+                SELECT {counts}
+                FROM {index_table}
+                WHERE boundary_name = $boundary_name AND {area_filter}
+            '''.format(
+                counts=', '.join(
+                    f"count(DISTINCT SUBSTRING(CAST({MESH_KEY_COLUMN} AS VARCHAR), 1, {info['code_length']}))"
+                    for info in MESH_LEVELS.values()
+                ),
+                index_table=index_table,
+                area_filter=area_code_filter("area_code")
+            ), {"boundary_name": boundary_name, **area_code_params(area_codes)}).fetchone()
+            return dict(zip(MESH_LEVELS, row))
+    finally:
+        cursor.close()
+
+    estimates = {}
+    bounds = area_bounds()
+    for level, info in MESH_LEVELS.items():
+        lat_seconds, lon_seconds = info["cell_seconds"]
+        estimates[level] = int(sum(
+            (xmax - xmin) * 3600 / lon_seconds * (ymax - ymin) * 3600 / lat_seconds
+            for xmin, ymin, xmax, ymax in bounds
+        ))
+    return estimates
+
+
+def choose_mesh_level(
+        estimates: Dict[str, int],
+        levels: Optional[List[str]] = None,
+        row_budget: int = MESH_ROW_BUDGET,
+        byte_budget_mb: float = MESH_BYTE_BUDGET_MB
+    ) -> str:
+    """
+    行数・メモリ上の大きさの予算に収まる、最も細かい解像度を選ぶ（どれも収まらなければ最も粗いもの）。
+    :param estimates: 解像度 → 見積もり行数
+    :param levels: 選択できる解像度（細かい順）
+    :param row_budget: 行数の上限
+    :param byte_budget_mb: メモリ上の大きさの上限（MB）
+    """
+    if levels is None:
+        levels = list(MESH_LEVELS)
+    for level in levels:
+        rows = estimates.get(level, 0)
+        if rows <= row_budget and rows * ESTIMATED_BYTES_PER_ROW <= byte_budget_mb * 1024 * 1024:
+            return level
+    return levels[-1]
+
+
+def mesh_level_options(layer: str, options: Tuple, mesh_level: str) -> Tuple:
+    """
+    キャッシュキーの設定に解像度を加える（メッシュ人口とzipのみ）
+    5次メッシュは従来のキーのままにして、事前生成したバンドルやキャッシュをそのまま使えるようにする。
+    :param layer: セッションステートのキー（zip全体の場合は"zip"）
+    :param options: 出力内容を変える設定
+    :param mesh_level: メッシュ人口の解像度
+    """
+    if mesh_level == DEFAULT_MESH_LEVEL or layer not in (CLIPPED_MESH_LAYER, "zip"):
+        return options
+    return options + (mesh_level,)
+
+
+if __name__ == "__main__":
+    from components.connect_motherduck import connect_georoost
+    from components.local_mirror import MIRROR_DIR, connect_local_mirror, write_mirror_table
+
+    parser = argparse.ArgumentParser(description="上位メッシュ（4次・3次）の集約テーブルを作成する")
+    parser.add_argument("--level", action="append", choices=[level for level in MESH_LEVELS if level != DEFAULT_MESH_LEVEL], help="作成する解像度（複数指定可、省略時はすべて）")
+    parser.add_argument("--local", action="store_true", help="MotherDuckではなくローカルミラーに作成する")
+    parser.add_argument("--mirror-dir", default=MIRROR_DIR, help="ミラーの保存先")
+    args = parser.parse_args()
+
+    if args.local:
+        mirror_con = connect_local_mirror(args.mirror_dir)
+        for level in args.level or [level for level in MESH_LEVELS if level != DEFAULT_MESH_LEVEL]:
+            write_mirror_table(
+                mirror_con,
+                MESH_LEVELS[level]["table"],
+                mesh_rollup_query(mirror_con, level),
+                mirror_dir=args.mirror_dir
+            )
+    else:
+        print(build_mesh_rollups(connect_georoost(read_only=False), args.level))
@@ -0,0 +1,119 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Set, Tuple
+import geopandas as gpd
+import duckdb
+
+from components.fetch_progress import current_fetch_progress, fetching_layer
+from components.instrumentation import instrument
+
+# 同時に投げるクエリ数の上限
+DEFAULT_MAX_WORKERS = 4
+# 全レイヤー取得のタイムアウト（秒）
+DEFAULT_TIMEOUT_SEC = 300.0
+# 進捗の表示を更新する間隔（秒）
+PROGRESS_INTERVAL_SEC = 0.5
+
+LayerLoader = Callable[[duckdb.DuckDBPyConnection], gpd.GeoDataFrame]
+
+
+def fetch_layers_parallel(
+        con: duckdb.DuckDBPyConnection,
+        loaders: Dict[str, LayerLoader],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = DEFAULT_TIMEOUT_SEC,
+        stage: str = "fetch"
+    ) -> Tuple[Dict[str, gpd.GeoDataFrame], Dict[str, Exception]]:
+    """
+    複数レイヤーの取得クエリを並列に実行するための関数
+    共有接続からレイヤーごとにカーソルを払い出し、スレッドプールで同時に実行する。
+    あるレイヤーの失敗やタイムアウトは他のレイヤーには影響しない。
+    進捗を集めている場合（track_fetch_progress）は、待っている間に一定間隔で表示を更新する。
+    待っている間に中止された場合（Streamlitの再実行による例外を含む）は、実行中のクエリを中断する。
+    :param con: DuckDB接続
+    :param loaders: レイヤー名 → カーソルを受け取りGeoDataFrameを返す関数
+    :param max_workers: 同時実行数の上限
+    :param timeout: 全レイヤー取得のタイムアウト（秒）
+    :param stage: 計測結果に記録する段階名（行数を数える場合は "estimate" など）
+    :return: 取得できたレイヤーと、失敗したレイヤーの例外
+    """
+    # DuckDBの接続はスレッド間で共有できないため、カーソルをレイヤーごとに用意する
+    cursors = {name: con.cursor() for name in loaders}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="layer-fetch")
+    # 計測結果の収集先をワーカースレッドにも引き継ぐ
+    futures = {
+        executor.submit(contextvars.copy_context().run, _run_loader, name, loader, cursors[name], stage): name
+        for name, loader in loaders.items()
+    }
+    progress = current_fetch_progress()
+    deadline = time.monotonic() + timeout
+    not_done: Set[Future] = set(futures)
+    try:
+        while not_done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            interval = remaining if progress is None else min(remaining, PROGRESS_INTERVAL_SEC)
+            _, not_done = wait(not_done, timeout=interval, return_when=FIRST_COMPLETED)
+            if progress is not None:
+                progress.notify()
+                progress.check_cancelled()
+    except BaseException:
+        if progress is not None:
+            progress.cancel()
+        _stop_pending(not_done, futures, cursors)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    done = set(futures) - not_done
+
+    results = {}
+    errors = {}
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            errors[name] = e
+
+    # 時間内に終わらなかったレイヤーは実行中のクエリを中断する
+    _stop_pending(not_done, futures, cursors)
+    for future in not_done:
+        errors[futures[future]] = TimeoutError(f"{timeout}秒以内に取得が完了しませんでした")
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return results, errors
+
+
+def _stop_pending(
+        not_done: Set[Future],
+        futures: Dict[Future, str],
+        cursors: Dict[str, duckdb.DuckDBPyConnection]
+    ) -> None:
+    """
+    まだ始まっていないレイヤーは取り消し、実行中のレイヤーはクエリを中断する。
+    """
+    for future in not_done:
+        name = futures[future]
+        if future.cancel():
+            cursors[name].close()
+        else:
+            try:
+                cursors[name].interrupt()
+            except duckdb.Error:
+                pass
+
+
+def _run_loader(name: str, loader: LayerLoader, cursor: duckdb.DuckDBPyConnection, stage: str = "fetch") -> gpd.GeoDataFrame:
+    """
+    ワーカースレッド上でレイヤーを取得し、使い終わったカーソルを閉じる。
+    行数を数える関数の場合は、戻り値（行数、数えられなければNone）をそのまま記録する。
+    """
+    try:
+        with fetching_layer(name), instrument(stage, layer=name) as record:
+            gdf = loader(cursor)
+            if gdf is not None:
+                record["rows"] = gdf if isinstance(gdf, int) else len(gdf)
+        return gdf
+    finally:
+        cursor.close()
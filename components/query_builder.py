@@ -0,0 +1,51 @@
+from typing import Dict, List, Optional, Sequence
+
+
+def area_code_filter(column: str, code_length: Optional[int] = None) -> str:
+    """
+    地域コードで絞り込むWHERE句の条件式を返す
+    コードの最小値〜最大値の範囲条件を先に置くことで、列の統計情報（zone map）による
+    読み飛ばしが効くようにし、その後で選択したコードに完全に一致するものだけを残す。
+    SQLの文字列は選択内容に依存せず、値は area_code_params() のパラメータで渡す。
+    :param column: コードが入っている列名
+    :param code_length: 先頭何文字で照合するか（Noneは列全体で照合）
+    """
+    code_expr = column if code_length is None else f"SUBSTRING({column}, 1, {code_length})"
+    return (
+        f"({column} >= $code_min AND {column} < $code_max "
+        f"AND list_contains($area_codes, {code_expr}))"
+    )
+
+
+def area_code_params(area_codes: List[str]) -> Dict[str, object]:
+    """
+    area_code_filter() の条件式に渡すパラメータを返す。
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    """
+    codes = sorted(set(area_codes))
+    return {
+        "code_min": codes[0],
+        "code_max": _prefix_upper_bound(codes[-1]),
+        "area_codes": codes,
+    }
+
+
+def select_columns(columns: Optional[Sequence[str]], table_alias: str = "", exclude: Sequence[str] = ("geom",)) -> str:
+    """
+    属性列を選ぶSELECT句の式を返す。
+    :param columns: 取得する列（Noneはexclude以外のすべての列）
+    :param table_alias: 列に付けるテーブルの別名（"t" など）
+    :param exclude: すべての列を取得する場合に除く列
+    """
+    prefix = f"{table_alias}." if table_alias else ""
+    if columns is None:
+        return f"{prefix}* EXCLUDE({', '.join(exclude)})"
+    # 列名は識別子として引用する（日本語や予約語の列名でも壊れないように）
+    return ", ".join(prefix + '"{}"'.format(column.replace('"', '""')) for column in columns)
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """
+    指定した接頭辞で始まる文字列すべてより大きい最小の文字列を返す（'13101' → '13102'）。
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import geopandas as gpd
+import pandas as pd
+import streamlit as st
+
+# メモリ上に保持する取得結果の上限（MB）。超えた分は古いものからParquetに退避する
+DEFAULT_RESULT_STORE_MB = 1024
+# 退避先のディレクトリ（プロセスごとにこの下へ一時ディレクトリを作り、終了時にそれだけを消す）
+RESULT_SPILL_DIR = os.environ.get("GEOROOST_RESULT_SPILL_DIR", "data/result_spill")
+# 値の種類がこの割合以下の文字列列はカテゴリ型にする
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+# 1座標あたりのバイト数と、1地物あたりのジオメトリのオーバーヘッド（メモリ使用量の見積もり用）
+_COORDINATE_BYTES = 16
+_GEOMETRY_OVERHEAD_BYTES = 64
+
+
+class ResultHandle:
+    """
+    ResultStoreに登録した取得結果への参照
+    セッションステートにはGeoDataFrameではなくこれを保持する。
+    参照がなくなる（セッションが終わる、取り直す）とストアの参照数が減る。
+    """
+
+    def __init__(self, store: "ResultStore", key: Hashable):
+        self.key = key
+        self._store = store
+        weakref.finalize(self, store.release, key)
+
+    def get(self) -> gpd.GeoDataFrame:
+        """
+        取得結果を返す（退避されていればParquetから読み戻す）。
+        """
+        return self._store.get(self.key)
+
+
+class ResultStore:
+    """
+    同じ条件の取得結果をセッション間で共有する、参照数付きのストア
+    メモリ上のバイト数が上限を超えたら、最も長く使われていない結果をParquetに退避する。
+    どのセッションからも参照されなくなった結果は削除する。
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: str = RESULT_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+        # キー → {"gdf": メモリ上の結果（退避中はNone）, "path": 退避先, "bytes": 見積もりバイト数, "refs": 参照数}
+        self._entries: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        # 複数のプロセスが同じ退避先を使っても、他のプロセスのファイルは消さない
+        os.makedirs(spill_dir, exist_ok=True)
+        self.spill_dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=spill_dir)
+        weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+
+    def put(self, key: Hashable, gdf: gpd.GeoDataFrame) -> ResultHandle:
+        """
+        取得結果を登録し、参照を返す。同じキーの結果があればそれを共有する。
+        :param key: 取得条件を表すキー（make_export_keyなど）
+        :param gdf: 取得結果
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                gdf = downcast_categories(gdf)
+                entry = {"gdf": gdf, "path": None, "bytes": estimate_bytes(gdf), "refs": 0}
+                self._entries[key] = entry
+                self.current_bytes += entry["bytes"]
+            self._entries.move_to_end(key)
+            entry["refs"] += 1
+            self._enforce_budget(keep=key)
+            return ResultHandle(self, key)
+
+    def acquire(self, key: Hashable) -> Optional[ResultHandle]:
+        """
+        同じキーの結果があれば参照を増やして返す。なければNoneを返す。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            return ResultHandle(self, key)
+
+    def get(self, key: Hashable) -> gpd.GeoDataFrame:
+        """
+        取得結果を返す。退避されていればParquetから読み戻してメモリに載せる。
+        """
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            if entry["gdf"] is None:
+                entry["gdf"] = gpd.read_parquet(entry["path"])
+                self.current_bytes += entry["bytes"]
+                self.reloads += 1
+                self._enforce_budget(keep=key)
+            return entry["gdf"]
+
+    def release(self, key: Hashable) -> None:
+        """
+        参照を1つ減らし、参照がなくなった結果を削除する。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            del self._entries[key]
+            if entry["gdf"] is not None:
+                self.current_bytes -= entry["bytes"]
+            if entry["path"] is not None and os.path.exists(entry["path"]):
+                os.remove(entry["path"])
+
+    def stats(self) -> Dict[str, int]:
+        """
+        ストアの利用状況を返す。
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "in_memory": sum(1 for entry in self._entries.values() if entry["gdf"] is not None),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+            }
+
+    def _enforce_budget(self, keep: Optional[Hashable] = None) -> None:
+        """
+        上限を超えている間、古い結果から順にParquetへ退避する（keepは退避しない）。
+        """
+        for key, entry in list(self._entries.items()):
+            if self.current_bytes <= self.max_bytes:
+                return
+            if key == keep or entry["gdf"] is None:
+                continue
+            if entry["path"] is None:
+                entry["path"] = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.parquet")
+                entry["gdf"].to_parquet(entry["path"])
+            entry["gdf"] = None
+            self.current_bytes -= entry["bytes"]
+            self.spills += 1
+
+
+def downcast_categories(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    値の種類が少ない文字列列（pref_name、tooltipなど）をカテゴリ型にしてメモリを減らす。
+    """
+    if gdf.empty:
+        return gdf
+    columns = {}
+    for column in gdf.columns:
+        if column == gdf.geometry.name or not pd.api.types.is_object_dtype(gdf[column]):
+            continue
+        if gdf[column].nunique(dropna=False) <= len(gdf) * CATEGORY_MAX_UNIQUE_RATIO:
+            columns[column] = gdf[column].astype("category")
+    return gdf.assign(**columns) if columns else gdf
+
+
+def estimate_bytes(gdf: gpd.GeoDataFrame) -> int:
+    """
+    GeoDataFrameのメモリ使用量を見積もる（ジオメトリは座標数から概算する）。
+    """
+    attributes = gdf.drop(columns=[gdf.geometry.name]).memory_usage(deep=True, index=True).sum()
+    coordinates = int(gdf.geometry.count_coordinates().sum()) if not gdf.empty else 0
+    return int(attributes) + coordinates * _COORDINATE_BYTES + len(gdf) * _GEOMETRY_OVERHEAD_BYTES
+
+
+@st.cache_resource
+def get_result_store() -> ResultStore:
+    """
+    プロセス全体で共有する取得結果のストアを取得する。
+    """
+    max_mb = int(os.environ.get("GEOROOST_RESULT_STORE_MB", DEFAULT_RESULT_STORE_MB))
+    return ResultStore(max_bytes=max_mb * 1024 * 1024)
@@ -1,9 +1,23 @@
+import atexit
+import json
+import logging
 import os
+import threading
+import uuid
 import duckdb
 import streamlit as st
 from datetime import datetime
+from typing import Dict, List, Optional
 
-st.set_page_config(page_title="Memo with MotherDuck", layout="wide")
+# 送信待ちのメモを保存するファイル（MotherDuckに届くまで消さない）
+MEMO_SPOOL_PATH = os.environ.get("GEOROOST_MEMO_SPOOL", "data/memo_spool.jsonl")
+# まとめて書き込む間隔（秒）と、間隔を待たずに書き込む件数
+MEMO_FLUSH_INTERVAL_SEC = float(os.environ.get("GEOROOST_MEMO_FLUSH_INTERVAL_SEC", "10"))
+MEMO_FLUSH_BATCH_SIZE = int(os.environ.get("GEOROOST_MEMO_FLUSH_BATCH_SIZE", "50"))
+
+MEMO_COLUMNS = ["memo_id", "name", "identifier", "mail", "created_at", "memo_text"]
+
+logger = logging.getLogger("georoost.memo")
 
 # ===== MotherDuck 接続まわり =====
 
@@ -32,27 +46,174 @@ def get_md_con_debug():
         )
         """
     )
-    # IDの生成方法は環境に合わせて調整してください（簡略化したい場合はid無しでもOK）
+    # 再送しても二重に登録されないよう、メモごとのIDで重複を判定する
+    conn.execute("ALTER TABLE main.memo_log ADD COLUMN IF NOT EXISTS memo_id TEXT")
+    # 書き込み前に受け取ったメモを置く一時テーブル
+    conn.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS memo_staging (
+            memo_id     TEXT,
+            name        TEXT,
+            identifier  TEXT,
+            mail        TEXT,
+            created_at  TIMESTAMPTZ,
+            memo_text   TEXT
+        )
+        """
+    )
 
     return conn
 
 
+class MemoWriter:
+    """
+    メモを受け付けてすぐに戻り、バックグラウンドでまとめてMotherDuckに書き込むキュー
+    受け付けたメモはまずローカルのファイルに追記し、書き込みが成功するまで残す。
+    MotherDuckが遅い・つながらない場合もメモは失われず、次の書き込みで再送される。
+    """
+
+    def __init__(
+            self,
+            spool_path: str = MEMO_SPOOL_PATH,
+            flush_interval: float = MEMO_FLUSH_INTERVAL_SEC,
+            batch_size: int = MEMO_FLUSH_BATCH_SIZE
+        ):
+        self.spool_path = spool_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flushed = 0
+        self.last_flush_at: Optional[datetime] = None
+        self.last_failed_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # 前回のプロセスで送信できなかったメモを読み込む
+        self._pending: List[Dict] = self._read_spool()
+        self._thread = threading.Thread(target=self._run, name="memo-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, memo: Dict) -> str:
+        """
+        メモをキューに追加する（ファイルへの追記のみで、MotherDuckへは書き込まない）。
+        :param memo: MEMO_COLUMNSのうちmemo_id以外の値
+        :return: 付与したメモID
+        """
+        memo = {"memo_id": uuid.uuid4().hex, **memo}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(memo, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.append(memo)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return memo["memo_id"]
+
+    def flush(self) -> int:
+        """
+        送信待ちのメモをまとめてMotherDuckに書き込む
+        同じメモIDの行がすでにあれば登録しないため、同じメモを何度送っても1行になる。
+        :return: 書き込んだ件数
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+            try:
+                conn = get_md_con_debug()
+                conn.execute("DELETE FROM memo_staging")
+                conn.executemany(
+                    "INSERT INTO memo_staging VALUES (?, ?, ?, ?, ?, ?)",
+                    [[memo[column] for column in MEMO_COLUMNS] for memo in batch]
+                )
+                conn.execute(
+                    """
+                    INSERT INTO main.memo_log BY NAME
+                    SELECT s.*
+                    FROM memo_staging AS s
+                    ANTI JOIN main.memo_log AS m ON m.memo_id = s.memo_id
+                    """
+                )
+                conn.execute("DELETE FROM memo_staging")
+            except Exception:
+                # エラー文には接続先やSQLが含まれるため、画面には出さずサーバーのログにだけ残す
+                logger.exception("メモの送信に失敗しました（送信待ち %d 件）", len(batch))
+                self.last_failed_at = datetime.now()
+                return 0
+
+            # 書き込めたメモをファイルから取り除く（受け付け中に追加されたメモは残す）
+            flushed_ids = {memo["memo_id"] for memo in batch}
+            with self._lock:
+                self._pending = [memo for memo in self._pending if memo["memo_id"] not in flushed_ids]
+                self._write_spool(self._pending)
+            self.flushed += len(batch)
+            self.last_flush_at = datetime.now()
+            self.last_failed_at = None
+            return len(batch)
+
+    def stats(self) -> Dict:
+        """
+        キューの状況（送信待ちの件数、送信済みの件数、直近の送信に失敗した日時）を返す。
+        """
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "flushed": self.flushed,
+            "last_flush_at": self.last_flush_at,
+            "last_failed_at": self.last_failed_at,
+        }
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _read_spool(self) -> List[Dict]:
+        if not os.path.exists(self.spool_path):
+            return []
+        with open(self.spool_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _write_spool(self, memos: List[Dict]) -> None:
+        # 途中で落ちても壊れないよう一時ファイル経由で置き換える
+        with open(self.spool_path + ".tmp", "w", encoding="utf-8") as f:
+            for memo in memos:
+                f.write(json.dumps(memo, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.spool_path + ".tmp", self.spool_path)
+
+
+@st.cache_resource
+def get_memo_writer() -> MemoWriter:
+    """
+    プロセス全体で共有するメモの書き込みキューを取得する（終了時に残りを書き込む）。
+    """
+    writer = MemoWriter()
+    atexit.register(writer.flush)
+    return writer
+
+
 def save_memo_to_motherduck(memo_text: str):
     """
-    メモをMotherDuck上のmemo_logテーブルに保存する。
+    メモを受け付け、MotherDuck上のmemo_logテーブルへの書き込みを予約する。
+    書き込みはバックグラウンドでまとめて行うため、画面の操作を待たせない。
     """
     if not memo_text.strip():
         # 空文字やスペースだけのときは何もしない
         return False, "メモが空です。"
 
-    con_debug = get_md_con_debug()
     created_at = datetime.now()
-
-    con_debug.execute(
-        """
-        INSERT INTO main.memo_log (name, identifier, mail, created_at, memo_text)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        [st.user.name, st.user.sub, st.user.email, created_at, memo_text],
-    )
+    # st.user はスクリプトのスレッドでしか参照できないため、受け付け時に値を確定する
+    get_memo_writer().enqueue({
+        "name": st.user.name,
+        "identifier": st.user.sub,
+        "mail": st.user.email,
+        "created_at": created_at.astimezone().isoformat(),
+        "memo_text": memo_text,
+    })
     return True, f"ご意見ありがとうございました（{created_at}）。"
@@ -0,0 +1,61 @@
+from typing import List
+import duckdb
+
+# ジオメトリの外接矩形を保持する列（ミラー作成時に追加する）
+BBOX_COLUMNS = ("bbox_xmin", "bbox_ymin", "bbox_xmax", "bbox_ymax")
+
+# 境界名 → (境界テーブル, コード列)
+BOUNDARY_TABLES = {
+    "pref": ("main_intermediate.int_kokudo__map_00_all_2025_pref", "pref_code"),
+    "city": ("main_intermediate.int_kokudo__map_00_all_2025_city", "jcode"),
+}
+
+
+def table_exists(con: duckdb.DuckDBPyConnection, table_name: str) -> bool:
+    """
+    テーブル（またはビュー）が存在するか確認する。
+    :param con: DuckDB接続
+    :param table_name: スキーマ名.テーブル名
+    """
+    schema_name, name = table_name.split(".")
+    row = con.execute('''
+        SELECT count(*)
+        FROM information_schema.tables
+        WHERE table_schema = ? AND table_name = ?
+    ''', [schema_name, name]).fetchone()
+    return row[0] > 0
+
+
+def table_columns(con: duckdb.DuckDBPyConnection, table_name: str) -> List[str]:
+    """
+    テーブル（またはビュー）の列名を定義順に取得する。
+    :param con: DuckDB接続
+    :param table_name: スキーマ名.テーブル名
+    """
+    schema_name, name = table_name.split(".")
+    rows = con.execute('''
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ?
+        ORDER BY ordinal_position
+    ''', [schema_name, name]).fetchall()
+    return [row[0] for row in rows]
+
+
+def has_bbox_columns(columns: List[str]) -> bool:
+    """
+    外接矩形の列がすべて揃っているか確認する。
+    """
+    return all(column in columns for column in BBOX_COLUMNS)
+
+
+def bbox_select_expression(geometry_column: str = "geom") -> str:
+    """
+    外接矩形の列を計算するSELECT句の式を返す。
+    """
+    return ', '.join([
+        f"ST_XMin({geometry_column}) AS bbox_xmin",
+        f"ST_YMin({geometry_column}) AS bbox_ymin",
+        f"ST_XMax({geometry_column}) AS bbox_xmax",
+        f"ST_YMax({geometry_column}) AS bbox_ymax",
+    ])
@@ -0,0 +1,331 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Literal, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+import duckdb
+import streamlit as st
+
+from components.export_cache import SOURCE_TABLE_VERSION, get_export_cache
+from components.instrumentation import instrument, metrics_registry
+from components.layer_registry import LAYER_REGISTRY
+from components.mesh_membership_index import MESH_KEY_COLUMN, MESH_MEMBERSHIP_INDEXES
+from components.mesh_rollup import CLIPPED_MESH_LAYER, DEFAULT_MESH_LEVEL, MESH_LEVELS
+from components.query_builder import area_code_filter, area_code_params
+from components.table_catalog import BBOX_COLUMNS, BOUNDARY_TABLES, table_columns, table_exists
+
+# タイルサーバーを起動するか（ブラウザから届くポートを公開できる環境でのみ有効にする）
+TILE_SERVER_ENABLED = os.environ.get("GEOROOST_TILE_SERVER") == "1"
+# 既定はローカルのみ（他の端末から使う場合は GEOROOST_TILE_HOST=0.0.0.0 などを明示する）
+TILE_SERVER_HOST = os.environ.get("GEOROOST_TILE_HOST", "127.0.0.1")
+TILE_SERVER_PORT = int(os.environ.get("GEOROOST_TILE_PORT", "8765"))
+# ブラウザから見たタイルサーバーのURL
+TILE_BASE_URL = os.environ.get("GEOROOST_TILE_URL", f"http://localhost:{TILE_SERVER_PORT}")
+# 生成したタイルの保存先（参照元テーブルのバージョンごとに分ける）
+TILE_CACHE_DIR = os.environ.get("GEOROOST_TILE_CACHE_DIR", ".tile_cache")
+# MVTの座標の解像度とバッファ
+TILE_EXTENT = 4096
+TILE_BUFFER = 256
+# これより小さいズームのタイルは生成しない（広い範囲のメッシュを1枚に詰め込まないようにする）
+TILE_MIN_ZOOM = int(os.environ.get("GEOROOST_TILE_MIN_ZOOM", "8"))
+
+logger = logging.getLogger("georoost.tile_server")
+
+# タイルのレイヤー名 → ツールチップの表示名、参照するテーブルと地域コードの列
+TILE_LAYERS: Dict[str, Dict] = {
+    spec.tile_layer: {
+        "label": spec.label, "table": spec.table, "pref_column": spec.pref_column, "city_column": spec.city_column
+    }
+    for spec in LAYER_REGISTRY.values()
+    if spec.tile_layer
+}
+# メッシュ人口のタイルのレイヤー名（解像度ごとの集約テーブルを選べる）
+MESH_TILE_LAYER = LAYER_REGISTRY[CLIPPED_MESH_LAYER].tile_layer
+
+_TILE_PATH = re.compile(r"^/tiles/(?P<layer>[a-z]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.pbf$")
+
+
+def tile_url(
+        layer: str,
+        boundary_name: Optional[Literal["pref", "city"]] = None,
+        area_codes: Optional[List[str]] = None,
+        mesh_level: str = DEFAULT_MESH_LEVEL
+    ) -> str:
+    """
+    MVTLayerに渡すタイルURLのテンプレートを返す
+    :param layer: タイルのレイヤー名（TILE_LAYERSのキー）
+    :param boundary_name: 絞り込みに使用する境界名（pref or city）、Noneは全域
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param mesh_level: メッシュ人口の解像度（MESH_LEVELSのキー、メッシュ人口のレイヤーのみ）
+    """
+    url = f"{TILE_BASE_URL}/tiles/{layer}/{{z}}/{{x}}/{{y}}.pbf"
+    query = {}
+    if boundary_name and area_codes:
+        query.update(boundary=boundary_name, codes=",".join(sorted(area_codes)))
+    if layer == MESH_TILE_LAYER and mesh_level != DEFAULT_MESH_LEVEL:
+        query["mesh"] = mesh_level
+    if query:
+        url += "?" + urlencode(query)
+    return url
+
+
+def render_tile(
+        con: duckdb.DuckDBPyConnection,
+        layer: str,
+        z: int,
+        x: int,
+        y: int,
+        boundary_name: Optional[Literal["pref", "city"]] = None,
+        area_codes: Optional[List[str]] = None,
+        mesh_level: str = DEFAULT_MESH_LEVEL,
+        cache_dir: str = TILE_CACHE_DIR,
+        version: str = SOURCE_TABLE_VERSION
+    ) -> bytes:
+    """
+    1枚のベクトルタイル（MVT）を返すための関数
+    ディスクにキャッシュがあればそれを返し、なければDuckDB spatialで生成して保存する。
+    TILE_MIN_ZOOMより小さいズームでは空のタイルを返す。
+    :param con: DuckDB接続
+    :param layer: タイルのレイヤー名（TILE_LAYERSのキー）
+    :param z: ズームレベル
+    :param x: タイルのX番号
+    :param y: タイルのY番号
+    :param boundary_name: 絞り込みに使用する境界名（pref or city）、Noneは全域
+    :param area_codes: 都道府県 or 市区町村コードのリスト
+    :param mesh_level: メッシュ人口の解像度（MESH_LEVELSのキー、メッシュ人口のレイヤーのみ）
+    :param cache_dir: タイルの保存先
+    :param version: 参照元テーブルのバージョン（テーブルを更新した後に古いタイルを返さないよう保存先を分ける）
+    """
+    if z < TILE_MIN_ZOOM:
+        return b""
+    table_name = TILE_LAYERS[layer]["table"]
+    if layer == MESH_TILE_LAYER:
+        table_name = MESH_LEVELS[mesh_level]["table"]
+        layer_dir = layer if mesh_level == DEFAULT_MESH_LEVEL else f"{layer}_{mesh_level}"
+    else:
+        layer_dir = layer
+    if area_codes:
+        selection = hashlib.sha1(f"{boundary_name}:{','.join(sorted(area_codes))}".encode()).hexdigest()[:16]
+    else:
+        selection = "all"
+    cache_path = os.path.join(cache_dir, version, layer_dir, selection, str(z), str(x), f"{y}.pbf")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+
+    tile = _generate_tile(con, layer, table_name, z, x, y, boundary_name, area_codes)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(tile)
+    os.replace(tmp_path, cache_path)
+    return tile
+
+
+def _generate_tile(
+        con: duckdb.DuckDBPyConnection,
+        layer: str,
+        table_name: str,
+        z: int,
+        x: int,
+        y: int,
+        boundary_name: Optional[Literal["pref", "city"]],
+        area_codes: Optional[List[str]]
+    ) -> bytes:
+    """
+    DuckDB spatialでベクトルタイルを生成する。
+    """
+    layer_info = TILE_LAYERS[layer]
+    columns = table_columns(con, table_name)
+    exclude_columns = ', '.join(["geom"] + [c for c in BBOX_COLUMNS if c in columns])
+    params = {"z": z, "x": x, "y": y, "layer": layer, "label": layer_info["label"]}
+
+    # 選択地域で絞り込む（メッシュは所属関係インデックスがあればそれを、なければ境界との交差を使う）
+    area_predicate = "TRUE"
+    if boundary_name and area_codes:
+        code_column = layer_info["pref_column"] if boundary_name == "pref" else layer_info["city_column"]
+        index_table = MESH_MEMBERSHIP_INDEXES.get(table_name)
+        if code_column is not None:
+            area_predicate = area_code_filter(code_column, code_length=2 if boundary_name == "pref" else 5)
+            params.update(area_code_params(area_codes))
+        elif index_table is not None and table_exists(con, index_table):
+            area_predicate = '''
+                t.{key} IN (
+                    SELECT {key} FROM {index_table}
+                    WHERE boundary_name = $boundary_name AND {area_filter}
+                )
+            '''.format(
+                key=MESH_KEY_COLUMN,
+                index_table=index_table,
+                area_filter=area_code_filter("area_code")
+            )
+            params.update(area_code_params(area_codes), boundary_name=boundary_name)
+        else:
+            boundary_table, boundary_code_column = BOUNDARY_TABLES[boundary_name]
+            area_predicate = '''
+                EXISTS (
+                    SELECT 1 FROM {boundary_table} AS b
+                    WHERE {area_filter} AND ST_Intersects(t.geom, b.geom)
+                )
+            '''.format(
+                boundary_table=boundary_table,
+                area_filter=area_code_filter(f"b.{boundary_code_column}")
+            )
+            params.update(area_code_params(area_codes))
+
+    row = con.execute('''
+        WITH tile AS (
+            SELECT
+                ST_Extent(ST_TileEnvelope($z, $x, $y)) AS bounds,
+                ST_Transform(ST_TileEnvelope($z, $x, $y), 'EPSG:3857', 'EPSG:4326', always_xy := true) AS envelope
+        )
+        SELECT ST_AsMVT(r, $layer, {extent}, 'geometry')
+        FROM (
+            SELECT
+                t.* EXCLUDE({exclude_columns}),
+                $label AS tooltip,
+                ST_AsMVTGeom(
+                    ST_Transform(t.geom, 'EPSG:4326', 'EPSG:3857', always_xy := true),
+                    tile.bounds,
+                    {extent},
+                    {buffer},
+                    true
+                ) AS geometry
+            FROM {table_name} AS t, tile
+            WHERE ST_Intersects(t.geom, tile.envelope)
+              AND {area_predicate}
+        ) AS r
+        WHERE r.geometry IS NOT NULL
+    '''.format(
+        extent=TILE_EXTENT,
+        buffer=TILE_BUFFER,
+        exclude_columns=exclude_columns,
+        table_name=table_name,
+        area_predicate=area_predicate
+    ), params).fetchone()
+
+    return bytes(row[0]) if row and row[0] is not None else b""
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """
+    /tiles/{layer}/{z}/{x}/{y}.pbf?boundary=city&codes=13101,13102&mesh=mesh4 を処理するハンドラ
+    /metrics では段階ごとの計測結果の集計をJSONで返す。
+    """
+    con: duckdb.DuckDBPyConnection = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self._send_metrics()
+            return
+        match = _TILE_PATH.match(url.path)
+        if match is None or match["layer"] not in TILE_LAYERS:
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        boundary_name = query.get("boundary", [None])[0]
+        codes = query.get("codes", [""])[0]
+        area_codes = [code for code in codes.split(",") if code]
+        if boundary_name not in (None, "pref", "city"):
+            self.send_error(400, "boundary must be pref or city")
+            return
+        mesh_level = query.get("mesh", [DEFAULT_MESH_LEVEL])[0]
+        if mesh_level not in MESH_LEVELS:
+            self.send_error(400, "unknown mesh level")
+            return
+
+        # DuckDBの接続はスレッド間で共有できないため、リクエストごとにカーソルを使う
+        cursor = self.con.cursor()
+        try:
+            with instrument("tile", layer=match["layer"], z=int(match["z"])) as record:
+                tile = render_tile(
+                    cursor,
+                    match["layer"],
+                    int(match["z"]), int(match["x"]), int(match["y"]),
+                    boundary_name=boundary_name,
+                    area_codes=area_codes,
+                    mesh_level=mesh_level
+                )
+                record["bytes"] = len(tile)
+        except duckdb.Error:
+            # DuckDBのエラー文にはテーブル名やSQLが含まれるため、ブラウザには返さずログにだけ残す
+            logger.exception("タイルの生成に失敗しました: %s", url.path)
+            self.send_error(500)
+            return
+        finally:
+            cursor.close()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+        self.send_header("Content-Length", str(len(tile)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def _send_metrics(self):
+        body = json.dumps({
+            "stages": metrics_registry.snapshot(),
+            "export_cache": get_export_cache().stats(),
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # タイルごとのアクセスログは出さない
+        pass
+
+
+def start_tile_server(
+        con: duckdb.DuckDBPyConnection,
+        host: str = TILE_SERVER_HOST,
+        port: int = TILE_SERVER_PORT
+    ) -> ThreadingHTTPServer:
+    """
+    タイルサーバーをデーモンスレッドで起動する。
+    :param con: DuckDB接続
+    :param host: 待ち受けるホスト
+    :param port: 待ち受けるポート
+    """
+    handler = type("BoundTileRequestHandler", (TileRequestHandler,), {"con": con})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="tile-server", daemon=True).start()
+    return server
+
+
+@st.cache_resource
+def get_tile_server() -> Optional[ThreadingHTTPServer]:
+    """
+    Streamlitのプロセス内でタイルサーバーを1つだけ起動する（無効な場合はNone）。
+    """
+    if not TILE_SERVER_ENABLED:
+        return None
+    from components.connect_motherduck import get_md_con_georoost
+    return start_tile_server(get_md_con_georoost())
+
+
+if __name__ == "__main__":
+    from components.connect_motherduck import CONNECTION_MODE, MIRROR_DIR, connect_georoost
+    from components.local_mirror import connect_local_mirror
+
+    parser = argparse.ArgumentParser(description="ベクトルタイル（MVT）サーバーを起動する")
+    parser.add_argument("--host", default=TILE_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=TILE_SERVER_PORT)
+    args = parser.parse_args()
+
+    con = connect_local_mirror(MIRROR_DIR) if CONNECTION_MODE == "local" else connect_georoost()
+    handler = type("BoundTileRequestHandler", (TileRequestHandler,), {"con": con})
+    print(f"Serving tiles on http://{args.host}:{args.port}/tiles/{{layer}}/{{z}}/{{x}}/{{y}}.pbf")
+    print(f"Metrics on http://{args.host}:{args.port}/metrics")
+    ThreadingHTTPServer((args.host, args.port), handler).serve_forever()
@@ -0,0 +1,203 @@
+import contextvars
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from components.instrumentation import instrument
+
+if TYPE_CHECKING:
+    # streamlitを読み込まないよう、型注釈のためだけに参照する
+    from components.export_cache import ExportCache
+
+# zipの圧縮レベル（0は無圧縮で格納するだけ。ローカルで使う場合に速い）
+_zip_level_setting = os.environ.get("GEOROOST_ZIP_COMPRESSION_LEVEL", "6")
+if not (_zip_level_setting.strip().isdigit() and 0 <= int(_zip_level_setting) <= 9):
+    raise ValueError(f"GEOROOST_ZIP_COMPRESSION_LEVEL は0〜9の整数で指定してください: {_zip_level_setting!r}")
+ZIP_COMPRESSION_LEVEL = int(_zip_level_setting)
+# 画面で選べる圧縮の選択肢（表示名 → zlibの圧縮レベル）
+ZIP_COMPRESSION_PRESETS = {
+    "無圧縮（最速）": 0,
+    "速度優先（レベル1）": 1,
+    "標準（レベル6）": 6,
+    "サイズ優先（レベル9）": 9,
+}
+if ZIP_COMPRESSION_LEVEL not in ZIP_COMPRESSION_PRESETS.values():
+    ZIP_COMPRESSION_PRESETS[f"既定（レベル{ZIP_COMPRESSION_LEVEL}）"] = ZIP_COMPRESSION_LEVEL
+# レイヤーを同時に圧縮するスレッド数（zlibは圧縮中にGILを解放する）
+DEFAULT_ZIP_WORKERS = min(8, os.cpu_count() or 1)
+
+_STORED = 0
+_DEFLATED = 8
+# 汎用フラグのビット11: ファイル名がUTF-8
+_UTF8_FLAG = 0x0800
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+
+
+class CompressedMember(NamedTuple):
+    """
+    圧縮済みのzipメンバー
+    """
+    method: int
+    crc: int
+    size: int
+    data: bytes
+
+
+def compress_member(data: bytes, level: int = ZIP_COMPRESSION_LEVEL) -> CompressedMember:
+    """
+    1つのメンバーを圧縮する（level=0は無圧縮）。
+    :param data: メンバーのバイト列
+    :param level: zlibの圧縮レベル（0〜9）
+    """
+    crc = zlib.crc32(data)
+    if level == 0:
+        return CompressedMember(_STORED, crc, len(data), data)
+    # zipのメンバーはヘッダーなしのdeflateストリーム
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    return CompressedMember(_DEFLATED, crc, len(data), compressed)
+
+
+def compress_members(
+        members: Dict[str, bytes],
+        level: int = ZIP_COMPRESSION_LEVEL,
+        max_workers: int = DEFAULT_ZIP_WORKERS,
+        cache: Optional["ExportCache"] = None,
+        cache_keys: Optional[Dict[str, Hashable]] = None
+    ) -> Dict[str, CompressedMember]:
+    """
+    メンバーをスレッドプールで並列に圧縮する
+    キャッシュとメンバーごとのキーを渡した場合は、圧縮済みのものを再利用し、圧縮したものを登録する。
+    :param members: zip内のファイル名 → バイト列
+    :param level: zlibの圧縮レベル（0は無圧縮）
+    :param max_workers: 同時に圧縮するスレッド数
+    :param cache: 圧縮済みのメンバーを共有するキャッシュ
+    :param cache_keys: zip内のファイル名 → メンバーの内容を表すキー（make_export_keyなど）
+    """
+    cache_keys = cache_keys or {}
+    compressed: Dict[str, CompressedMember] = {}
+    pending: List[str] = []
+    for filename in members:
+        cached = None
+        if cache is not None and filename in cache_keys:
+            cached = cache.get(("zip_member", cache_keys[filename], level))
+        if cached is not None:
+            compressed[filename] = cached
+        else:
+            pending.append(filename)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))), thread_name_prefix="zip-deflate") as executor:
+            # 計測結果の収集先をワーカースレッドにも引き継ぐ
+            futures = {
+                filename: executor.submit(contextvars.copy_context().run, _compress_instrumented, filename, members[filename], level)
+                for filename in pending
+            }
+            for filename, future in futures.items():
+                compressed[filename] = future.result()
+                if cache is not None and filename in cache_keys:
+                    cache.put(("zip_member", cache_keys[filename], level), compressed[filename], size=len(compressed[filename].data))
+
+    return {filename: compressed[filename] for filename in members}
+
+
+def assemble_zip(
+        members: Dict[str, CompressedMember],
+        date_time: Optional[Tuple[int, ...]] = None,
+        force_zip64: bool = False
+    ) -> bytes:
+    """
+    圧縮済みのメンバーからzipを組み立てる
+    ファイル名はUTF-8のフラグ付きで格納し、4GBを超えるメンバーや位置にはZIP64の拡張情報を付ける。
+    :param members: zip内のファイル名 → 圧縮済みのメンバー
+    :param date_time: 更新日時（年, 月, 日, 時, 分, 秒。省略時は現在時刻）
+    :param force_zip64: 大きさに関わらずZIP64の拡張情報と終端レコードを付ける（検証用）
+    """
+    dos_time, dos_date = _dos_date_time(date_time or time.localtime()[:6])
+    parts: List[bytes] = []
+    central: List[bytes] = []
+    offset = 0
+    for filename, member in members.items():
+        name = filename.encode("utf-8")
+        compressed_size = len(member.data)
+        base_version = 20 if member.method == _DEFLATED else 10
+
+        # ローカルファイルヘッダー
+        local_zip64 = force_zip64 or member.size >= _ZIP64_LIMIT or compressed_size >= _ZIP64_LIMIT
+        local_extra = struct.pack("<HHQQ", 0x0001, 16, member.size, compressed_size) if local_zip64 else b""
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50, 45 if local_zip64 else base_version, _UTF8_FLAG, member.method, dos_time, dos_date,
+            member.crc,
+            _ZIP64_LIMIT if local_zip64 else compressed_size,
+            _ZIP64_LIMIT if local_zip64 else member.size,
+            len(name), len(local_extra)
+        )
+        parts.extend([header, name, local_extra, member.data])
+
+        # セントラルディレクトリのエントリ
+        central_zip64 = local_zip64 or offset >= _ZIP64_LIMIT
+        central_extra = struct.pack("<HHQQQ", 0x0001, 24, member.size, compressed_size, offset) if central_zip64 else b""
+        central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50, 45 if central_zip64 else base_version, 45 if central_zip64 else base_version,
+            _UTF8_FLAG, member.method, dos_time, dos_date, member.crc,
+            _ZIP64_LIMIT if central_zip64 else compressed_size,
+            _ZIP64_LIMIT if central_zip64 else member.size,
+            len(name), len(central_extra), 0, 0, 0, 0,
+            _ZIP64_LIMIT if central_zip64 else offset
+        ) + name + central_extra)
+        offset += len(header) + len(name) + len(local_extra) + compressed_size
+
+    central_offset = offset
+    central_size = sum(len(entry) for entry in central)
+    parts.extend(central)
+    count = len(members)
+    if force_zip64 or count >= _ZIP64_COUNT_LIMIT or central_offset >= _ZIP64_LIMIT or central_size >= _ZIP64_LIMIT:
+        # ZIP64の終端レコードとその位置
+        parts.append(struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064B50, 44, 45, 45, 0, 0, count, count, central_size, central_offset
+        ))
+        parts.append(struct.pack("<IIQI", 0x07064B50, 0, central_offset + central_size, 1))
+        parts.append(struct.pack(
+            "<IHHHHIIH",
+            0x06054B50, 0, 0, _ZIP64_COUNT_LIMIT, _ZIP64_COUNT_LIMIT, _ZIP64_LIMIT, _ZIP64_LIMIT, 0
+        ))
+    else:
+        parts.append(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, central_size, central_offset, 0))
+    return b"".join(parts)
+
+
+def build_zip(
+        members: Dict[str, bytes],
+        level: int = ZIP_COMPRESSION_LEVEL,
+        max_workers: int = DEFAULT_ZIP_WORKERS,
+        cache: Optional["ExportCache"] = None,
+        cache_keys: Optional[Dict[str, Hashable]] = None
+    ) -> bytes:
+    """
+    メンバーを並列に圧縮してzipにまとめる。引数は compress_members() と同じ。
+    """
+    return assemble_zip(compress_members(members, level, max_workers, cache, cache_keys))
+
+
+def _compress_instrumented(filename: str, data: bytes, level: int) -> CompressedMember:
+    with instrument("deflate", member=filename, level=level) as record:
+        member = compress_member(data, level)
+        record["bytes"] = len(member.data)
+    return member
+
+
+def _dos_date_time(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    """
+    日時をzipのMS-DOS形式（時刻, 日付）にする（1980年より前は1980年1月1日とする）。
+    """
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
@@ -0,0 +1,133 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import box
+
+from benchmarks.synthetic_fixture import add_synthetic_layers, build_synthetic_database
+from components.area_cache import combine_area_pieces, fetch_basemap_layers_by_area, get_area_piece_cache
+from components.basemap_loader import BASEMAP_LAYER_NAMES, fetch_basemap_layers
+from components.incremental_fetcher import fetch_basemap_layers_incremental, plan_incremental_fetch
+from components.mesh_membership_index import MESH_KEY_COLUMN
+from components.mesh_rollup import CLIPPED_MESH_LAYER
+
+LAYER_KEYS = list(BASEMAP_LAYER_NAMES)
+
+
+@pytest.fixture(scope="module")
+def con():
+    # 2x2の都道府県（01と02が東西に隣接）。境界はメッシュの境目とずれているため、またぐセルがある
+    con = build_synthetic_database(grid_size=40, pref_grid=2)
+    add_synthetic_layers(con, features_per_city=10, town_grid=2)
+    yield con
+    con.close()
+
+
+@pytest.fixture(autouse=True)
+def empty_area_cache():
+    # 地域ごとのキャッシュはプロセス全体で共有するため、テストごとに空にする
+    get_area_piece_cache.clear()
+    yield
+    get_area_piece_cache.clear()
+
+
+def assert_same_layer(key: str, actual: gpd.GeoDataFrame, expected: gpd.GeoDataFrame) -> None:
+    """
+    行の順序によらず、同じ属性・ジオメトリのレイヤーか確かめる。
+    """
+    assert len(actual) == len(expected), key
+    assert sorted(actual.columns) == sorted(expected.columns), key
+    if key == CLIPPED_MESH_LAYER:
+        actual = actual.set_index(MESH_KEY_COLUMN).sort_index()
+        expected = expected.set_index(MESH_KEY_COLUMN).sort_index()[actual.columns]
+        assert actual.index.equals(expected.index), key
+    else:
+        attributes = [column for column in expected.columns if column != expected.geometry.name]
+        actual = actual.assign(_wkb=actual.geometry.to_wkb()).sort_values(attributes + ["_wkb"]).drop(columns="_wkb")
+        expected = expected.assign(_wkb=expected.geometry.to_wkb()).sort_values(attributes + ["_wkb"]).drop(columns="_wkb")
+        expected = expected[actual.columns]
+
+    attributes = [column for column in actual.columns if column != actual.geometry.name]
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(actual[attributes]).reset_index(drop=True),
+        pd.DataFrame(expected[attributes]).reset_index(drop=True),
+        check_dtype=False
+    )
+    difference = shapely.area(shapely.symmetric_difference(actual.geometry.values, expected.geometry.values))
+    assert (difference < 1e-12).all(), key
+
+
+def test_combine_area_pieces_dissolves_cells_crossing_areas():
+    pieces = [
+        gpd.GeoDataFrame(
+            {MESH_KEY_COLUMN: ["A", "B"], "T001142001": [10, 20], "pref_name": ["県01", "県01"]},
+            geometry=[box(0, 0, 0.4, 1), box(2, 0, 3, 1)],
+            crs="EPSG:4326"
+        ),
+        gpd.GeoDataFrame(
+            {MESH_KEY_COLUMN: ["A"], "T001142001": [10], "pref_name": ["県02"]},
+            geometry=[box(0.4, 0, 1, 1)],
+            crs="EPSG:4326"
+        ),
+    ]
+
+    combined = combine_area_pieces(CLIPPED_MESH_LAYER, pieces).set_index(MESH_KEY_COLUMN).sort_index()
+
+    assert list(combined.index) == ["A", "B"]
+    assert combined.loc["A", "pref_name"] == "県01・県02"
+    assert combined.loc["A", "T001142001"] == 10
+    assert combined.loc["A", "geometry"].equals(box(0, 0, 1, 1))
+    assert combined.loc["B", "geometry"].equals(box(2, 0, 3, 1))
+
+
+def test_combine_area_pieces_concatenates_other_layers():
+    pieces = [
+        gpd.GeoDataFrame({"jcode": ["01001"]}, geometry=[box(0, 0, 1, 1)], crs="EPSG:4326"),
+        gpd.GeoDataFrame({"jcode": ["02001"]}, geometry=[box(0, 0, 1, 1)], crs="EPSG:4326"),
+    ]
+
+    combined = combine_area_pieces("clipped_station_gdf", pieces)
+
+    assert list(combined["jcode"]) == ["01001", "02001"]
+
+
+@pytest.mark.parametrize("boundary_name, area_codes", [
+    ("pref", ["01", "02"]),
+    ("city", ["01002", "01004", "02001"]),
+])
+def test_fetch_by_area_matches_fetch_of_whole_selection(con, boundary_name, area_codes):
+    expected, expected_errors = fetch_basemap_layers(con, area_codes, boundary_name, LAYER_KEYS)
+
+    # 1地域ずつキャッシュに載せてから、組み合わせて返す
+    for code in area_codes:
+        fetch_basemap_layers_by_area(con, [code], boundary_name, LAYER_KEYS)
+    assert plan_incremental_fetch(area_codes, boundary_name, LAYER_KEYS) == {key: [] for key in LAYER_KEYS}
+    actual, errors = fetch_basemap_layers_by_area(con, area_codes, boundary_name, LAYER_KEYS)
+
+    assert errors == expected_errors == {}
+    for key in LAYER_KEYS:
+        assert_same_layer(key, actual[key], expected[key])
+
+
+def test_incremental_add_and_remove_match_fresh_fetch(con):
+    first, _ = fetch_basemap_layers_by_area(con, ["01"], "pref", LAYER_KEYS)
+    crossing = first[CLIPPED_MESH_LAYER]
+    assert (crossing["pref_name"] == "県01").all()
+
+    # 隣接する都道府県を加える：またぐセルは2つの断片を結合し、都道府県名もまとめる
+    assert plan_incremental_fetch(["01", "02"], "pref", LAYER_KEYS, ["01"], first) == {key: ["02"] for key in LAYER_KEYS}
+    added, errors = fetch_basemap_layers_incremental(con, ["01", "02"], "pref", LAYER_KEYS, ["01"], first)
+    fresh, _ = fetch_basemap_layers(con, ["01", "02"], "pref", LAYER_KEYS)
+    assert errors == {}
+    assert (added[CLIPPED_MESH_LAYER]["pref_name"] == "県01・県02").any()
+    for key in LAYER_KEYS:
+        assert_same_layer(key, added[key], fresh[key])
+
+    # 先に選んだ都道府県を外す：またぐセルからは外した側の部分を削り、都道府県名からも除く
+    get_area_piece_cache.clear()
+    removed, errors = fetch_basemap_layers_incremental(con, ["02"], "pref", LAYER_KEYS, ["01", "02"], added)
+    fresh, _ = fetch_basemap_layers(con, ["02"], "pref", LAYER_KEYS)
+    assert errors == {}
+    assert (removed[CLIPPED_MESH_LAYER]["pref_name"] == "県02").all()
+    for key in LAYER_KEYS:
+        assert_same_layer(key, removed[key], fresh[key])
@@ -0,0 +1,32 @@
+import pytest
+
+from benchmarks.clip_benchmark import BENCHMARK_CASES, assert_same_clip, widen_mesh_table
+from benchmarks.synthetic_fixture import build_synthetic_database
+from components.cilpped_geometry_loader import download_clipped_geometry
+from components.mesh_rollup import MESH_SOURCE_TABLE
+
+
+@pytest.fixture(scope="module")
+def cons():
+    # 外接矩形の列がないテーブルと、ミラーと同じく列を加えたテーブル
+    plain = build_synthetic_database(grid_size=40, pref_grid=2)
+    with_bbox = build_synthetic_database(grid_size=40, pref_grid=2)
+    widen_mesh_table(with_bbox, MESH_SOURCE_TABLE, attribute_columns=1, bbox_columns=True)
+    yield plain, with_bbox
+    plain.close()
+    with_bbox.close()
+
+
+@pytest.mark.parametrize("label, boundary_name, area_codes", BENCHMARK_CASES)
+@pytest.mark.parametrize("split_by_area", [False, True])
+def test_bbox_plan_matches_plain_plan(cons, label, boundary_name, area_codes, split_by_area):
+    plain, with_bbox = cons
+
+    expected = download_clipped_geometry(plain, area_codes, boundary_name, MESH_SOURCE_TABLE, split_by_area)
+    actual = download_clipped_geometry(with_bbox, area_codes, boundary_name, MESH_SOURCE_TABLE, split_by_area)
+
+    if split_by_area:
+        # 境界をまたぐメッシュは地域ごとの断片になるため、地域コードと合わせて照合する
+        piece_key = lambda gdf: gdf.assign(KEY_CODE=gdf["KEY_CODE"].astype(str) + ":" + gdf["clip_area_code"])
+        expected, actual = piece_key(expected), piece_key(actual)
+    assert_same_clip(expected, actual)
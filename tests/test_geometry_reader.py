@@ -0,0 +1,45 @@
+import json
+
+import duckdb
+import pandas as pd
+import pytest
+
+from components.geojson_exporter import encode_geojson
+from components.geometry_reader import query_to_geodataframe
+
+ATTRIBUTE_QUERY = '''
+    SELECT
+        1.25::DECIMAL(10, 2) AS population_ratio,
+        DATE '2020-10-01' AS survey_date,
+        'A' AS name,
+        ST_AsWKB(ST_Point(139.0, 35.0)) AS geometry
+'''
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.sql('INSTALL spatial;')
+    con.sql('LOAD spatial;')
+    yield con
+    con.close()
+
+
+def test_attribute_dtypes_match_duckdb_df(con):
+    gdf = query_to_geodataframe(con, ATTRIBUTE_QUERY)
+    expected = con.sql(ATTRIBUTE_QUERY).df().drop(columns=["geometry"])
+
+    assert gdf["population_ratio"].dtype == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(gdf["survey_date"])
+    pd.testing.assert_frame_equal(pd.DataFrame(gdf.drop(columns="geometry")), expected)
+
+
+def test_decimal_and_date_round_trip_to_geojson(con):
+    gdf = query_to_geodataframe(con, ATTRIBUTE_QUERY)
+
+    feature = json.loads(encode_geojson(gdf))["features"][0]
+
+    assert feature["properties"]["population_ratio"] == 1.25
+    assert feature["properties"]["survey_date"].startswith("2020-10-01")
+    assert feature["properties"]["name"] == "A"
+    assert feature["geometry"] == {"type": "Point", "coordinates": [139.0, 35.0]}
@@ -0,0 +1,41 @@
+import tracemalloc
+
+import pytest
+
+from components import instrumentation
+from components.instrumentation import collect_stages, instrument
+
+
+@pytest.fixture
+def trace_memory(monkeypatch):
+    monkeypatch.setattr(instrumentation, "TRACE_MEMORY", True)
+    yield
+    tracemalloc.stop()
+
+
+def test_peak_memory_is_per_stage(trace_memory):
+    with collect_stages() as records:
+        with instrument("large"):
+            data = bytearray(50 * 1024 * 1024)
+            del data
+        with instrument("small"):
+            data = bytearray(1024)
+            del data
+
+    peaks = {record["stage"]: record["peak_memory_bytes"] for record in records}
+    assert peaks["large"] >= 50 * 1024 * 1024
+    assert peaks["small"] < 1024 * 1024
+
+
+def test_outer_stage_keeps_peak_of_inner_stages(trace_memory):
+    with collect_stages() as records:
+        with instrument("outer"):
+            with instrument("inner_large"):
+                data = bytearray(20 * 1024 * 1024)
+                del data
+            with instrument("inner_small"):
+                pass
+
+    peaks = {record["stage"]: record["peak_memory_bytes"] for record in records}
+    assert peaks["inner_small"] < 1024 * 1024
+    assert peaks["outer"] >= 20 * 1024 * 1024
@@ -0,0 +1,64 @@
+import math
+import urllib.error
+import urllib.request
+
+import duckdb
+import pytest
+
+from benchmarks.synthetic_fixture import add_synthetic_layers, build_synthetic_database
+from components.tile_server import MESH_TILE_LAYER, TILE_MIN_ZOOM, render_tile, start_tile_server
+
+# 合成データ（経度139.0〜139.1、緯度35.0〜35.1）を含むタイル
+TILE_Z = 12
+
+
+def tile_index(lon: float, lat: float, z: int):
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+@pytest.fixture(scope="module")
+def con():
+    con = build_synthetic_database(grid_size=40, pref_grid=2)
+    add_synthetic_layers(con, features_per_city=10, town_grid=2)
+    yield con
+    con.close()
+
+
+def test_mesh_tile_is_filtered_by_boundary_without_membership_index(con, tmp_path):
+    x, y = tile_index(139.05, 35.05, TILE_Z)
+
+    whole = render_tile(con, MESH_TILE_LAYER, TILE_Z, x, y, cache_dir=str(tmp_path))
+    selected = render_tile(con, MESH_TILE_LAYER, TILE_Z, x, y, "pref", ["01"], cache_dir=str(tmp_path))
+
+    assert selected
+    assert len(selected) < len(whole)
+
+
+def test_tiles_below_min_zoom_are_empty(con, tmp_path):
+    z = TILE_MIN_ZOOM - 1
+    x, y = tile_index(139.05, 35.05, z)
+
+    assert render_tile(con, MESH_TILE_LAYER, z, x, y, cache_dir=str(tmp_path)) == b""
+
+
+def test_unknown_mesh_level_and_database_errors_are_not_leaked(tmp_path):
+    # テーブルのない接続ではタイルの生成に失敗する
+    empty_con = duckdb.connect()
+    server = start_tile_server(empty_con, host="127.0.0.1", port=0)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/tiles/{MESH_TILE_LAYER}/{TILE_Z}/0/0.pbf"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as bad_level:
+            urllib.request.urlopen(base_url + "?mesh=main_jpn.other_table")
+        assert bad_level.value.code == 400
+
+        with pytest.raises(urllib.error.HTTPError) as failed:
+            urllib.request.urlopen(base_url)
+        assert failed.value.code == 500
+        body = failed.value.read().decode("utf-8", "replace")
+        assert "main_jpn" not in body and "Catalog" not in body
+    finally:
+        server.shutdown()
+        empty_con.close()
@@ -0,0 +1,76 @@
+import io
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from components.export_cache import ExportCache
+from components.zip_builder import assemble_zip, build_zip, compress_members
+
+MEMBERS = {
+    "鉄道駅.geojson": b'{"type": "FeatureCollection", "features": []}' * 50,
+    "メッシュ人口.geojson": os.urandom(2048),
+    "空.geojson": b"",
+}
+
+
+def read_members(data: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert zip_file.testzip() is None
+        return {info.filename: zip_file.read(info) for info in zip_file.infolist()}
+
+
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_build_zip_is_readable_by_zipfile(level):
+    data = build_zip(MEMBERS, level=level, max_workers=2)
+
+    assert read_members(data) == MEMBERS
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        expected_type = zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED
+        assert {info.compress_type for info in zip_file.infolist()} == {expected_type}
+        # ファイル名はUTF-8のフラグ付き
+        assert all(info.flag_bits & 0x0800 for info in zip_file.infolist())
+
+
+def test_forced_zip64_is_readable_by_zipfile():
+    for level in (0, 6):
+        data = assemble_zip(compress_members(MEMBERS, level=level), force_zip64=True)
+
+        assert read_members(data) == MEMBERS
+        # ZIP64の終端レコードとその位置
+        assert b"PK\x06\x06" in data and b"PK\x06\x07" in data
+
+
+def test_date_time_is_stored():
+    data = assemble_zip(compress_members(MEMBERS), date_time=(2024, 5, 6, 7, 8, 10))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert zip_file.infolist()[0].date_time == (2024, 5, 6, 7, 8, 10)
+
+
+def test_compressed_members_are_reused_from_cache():
+    cache = ExportCache(max_bytes=1024 * 1024)
+    cache_keys = {filename: ("layer", filename) for filename in MEMBERS}
+    first = build_zip(MEMBERS, level=6, cache=cache, cache_keys=cache_keys)
+    hits = cache.stats()["hits"]
+
+    second = build_zip(MEMBERS, level=6, cache=cache, cache_keys=cache_keys)
+
+    assert cache.stats()["hits"] == hits + len(MEMBERS)
+    assert read_members(second) == read_members(first) == MEMBERS
+
+
+@pytest.mark.parametrize("setting", ["10", "-1", "fast"])
+def test_invalid_compression_level_setting_fails_at_import(setting):
+    # 設定は読み込み時に確かめるため、別のプロセスで読み込む
+    result = subprocess.run(
+        [sys.executable, "-c", "import components.zip_builder"],
+        env={**os.environ, "GEOROOST_ZIP_COMPRESSION_LEVEL": setting},
+        capture_output=True,
+        text=True
+    )
+
+    assert result.returncode != 0
+    assert "GEOROOST_ZIP_COMPRESSION_LEVEL" in result.stderr